@@ -1,28 +1,75 @@
 from flask import Flask, render_template, request, redirect, url_for, send_file, flash, Response
 import os
 import subprocess
+import signal
+import fcntl
 import uuid
 import threading
+import shutil
+import tarfile
 import json
+import hashlib
 import time
-from zipfile import ZipFile
+import math
+from zipfile import ZipFile, BadZipFile
 from datetime import datetime
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import MultiDict
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from collections import deque
 import socket
 import ipaddress
 from urllib.parse import urlparse, urlunparse
+from cleanup import ExpiryIndex, NullIndex, TEMP_MAX_AGE, run_sweeper
+from storage import StorageError, open_storage
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
-MAX_DIMENSION = 10000
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024   # 2 GB — total request limit (MAX_CONTENT_LENGTH)
-PER_FILE_MAX_SIZE = 200 * 1024 * 1024    # 200 MB — per individual file
+PER_FILE_MAX_SIZE = int(os.getenv('IMAGUICK_MAX_FILE_MB', '200')) * 1024 * 1024    # per individual file
+
+
+def _available_memory():
+    """Physical memory, or the container's cgroup limit when that is lower (bytes)."""
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = 4 * 1024 ** 3
+    for limit_file in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(limit_file) as f:
+                memory = min(memory, int(f.read().strip()))
+        except (OSError, ValueError):
+            continue
+    return memory
+
+
+# Gunicorn worker processes on this machine (start.sh passes its --workers). Each runs its own
+# conversion scheduler, so the machine's memory, cores and workers are split evenly between them.
+SERVER_PROCESSES = max(1, int(os.getenv('IMAGUICK_GUNICORN_WORKERS', '1')))
+
+# Image size limits. Images whose pixels don't fit a conversion's share of MEMORY_BUDGET are
+# still accepted up to MAX_DIMENSION / MAX_MEGAPIXELS, but run in large-image mode: ImageMagick's
+# pixel cache spills to disk, and JPEGs are decoded at a reduced scale (see large_image_options).
+MEMORY_BUDGET = (int(os.getenv('IMAGUICK_MEMORY_MB', str(_available_memory() // 2 // 1024 ** 2)))
+                 * 1024 ** 2 // SERVER_PROCESSES)
+MAX_DIMENSION = int(os.getenv('IMAGUICK_MAX_DIMENSION', '65000'))
+MAX_MEGAPIXELS = int(os.getenv('IMAGUICK_MAX_MEGAPIXELS', '2500'))
+BYTES_PER_PIXEL = 16            # Q16 RGBA source plus a resize intermediate of similar size
+TEMP_FOLDER = '/tmp'            # decoder temps outside a job or single-image work tree (CLI, benchmarks)
+PIXEL_CACHE_DIR = os.getenv('IMAGUICK_PIXEL_CACHE_DIR', TEMP_FOLDER)
+ANALYSIS_PROXY_SIZE = 1024      # px; large JPEGs are analysed from a proxy this size
+THUMBNAIL_SIZE = 256            # px; cached WEBP thumbnail of each upload
+PREVIEW_PROXY_SIZE = 1024       # px; cached copy of each upload that live previews are rendered from
+PREVIEW_GRID_LIMIT = 48         # thumbnails shown on the batch options page
+PREVIEW_TIMEOUT = 30
+PREVIEW_RETRY_AFTER = 1         # seconds a page waits before asking again for a thumbnail still being rendered
 DEFAULTS = {
     "quality": "100",
     "width": "",
@@ -30,6 +77,18 @@ DEFAULTS = {
     "percentage": "",
 }
 
+# Named processing presets (form-style fields, fed through extract_processing_params)
+PRESETS = {
+    'web-1920': {'format': 'WEBP', 'quality': '85', 'use_1920p': 'on'},
+    'web-1080': {'format': 'WEBP', 'quality': '82', 'use_1080p': 'on'},
+    'jpeg-1920': {'format': 'JPEG', 'quality': '88', 'use_1920p': 'on'},
+    'auto-1920': {'format': 'AUTO', 'use_1920p': 'on'},
+    'avif-1920': {'format': 'AVIF', 'quality': '60', 'use_1920p': 'on'},
+    'archive-jxl': {'format': 'JXL', 'quality': '95'},
+    'raw-tiff': {'format': 'TIFF'},
+    'thumbnail': {'format': 'WEBP', 'quality': '75', 'width': '320', 'height': '320', 'keep_ratio': 'on'},
+}
+
 # Allowlist of accepted output formats — prevents path injection via format field
 ALLOWED_OUTPUT_FORMATS = {
     'PNG', 'JPEG', 'JPG', 'WEBP', 'AVIF', 'GIF', 'TIFF', 'BMP', 'ICO',
@@ -41,29 +100,285 @@ ALLOWED_OUTPUT_FORMATS = {
 
 ALLOWED_SHARPEN_LEVELS = {'low', 'standard', 'high'}
 
+# "AUTO" output format: candidates are encoded side by side at roughly equal perceived
+# quality, and the smallest one within AUTO_MAX_DSSIM of the resized source is kept.
+AUTO_FORMAT = 'AUTO'
+AUTO_CANDIDATES_PHOTO = ('AVIF', 'WEBP', 'JPEG')
+AUTO_CANDIDATES_GRAPHIC = ('AVIF', 'WEBP', 'PNG')    # no JPEG: transparency, hard edges
+AUTO_QUALITY = {'AVIF': '60', 'WEBP': '80', 'JPEG': '82', 'PNG': ''}   # '' = lossless encoder default
+AUTO_EXTENSIONS = {'AVIF': '.avif', 'WEBP': '.webp', 'JPEG': '.jpg', 'PNG': '.png'}
+AUTO_MAX_DSSIM = float(os.getenv('IMAGUICK_AUTO_MAX_DSSIM', '0.015'))
+AUTO_TIME_BUDGET = float(os.getenv('IMAGUICK_AUTO_BUDGET', '20'))      # seconds; slower candidates are dropped
+
+# Target-size encoding (max_size_kb): quality is searched per file for formats where it sets the bitrate
+SIZE_TARGET_EXTENSIONS = {'.jpg', '.jpeg', '.webp', '.avif', '.heic', '.jxl'}
+SIZE_TARGET_QUALITY_RANGE = (5, 95)     # search bounds when the form leaves quality at 100
+SIZE_TARGET_MAX_ENCODES = 7
+
+# Animated inputs (more than one frame) written to one of these run through convert_animation()
+ANIMATED_OUTPUT_EXTENSIONS = {'.gif', '.webp', '.apng'}
+SEQUENCE_AUTO_EXTENSION = '.webp'       # AUTO output for animations and multi-page documents
+
+# Multi-page inputs (PDF, multi-page TIFF) run through convert_pages(): page ranges convert in
+# parallel, then are reassembled into a multi-page output or written one file per page
+MULTIPAGE_EXTENSIONS = {'.pdf', '.tif', '.tiff'}
+MULTIPAGE_OUTPUT_EXTENSIONS = {'.pdf', '.tif', '.tiff'}
+PAGES_PER_RANGE = 8
+PDF_DENSITY = 150               # dpi PDF pages are rasterized at for "original size"
+PDF_DENSITY_RANGE = (36, 600)
+
+# Encoder speed / compression trade-off: level -> (AVIF/HEIC heic:speed 0-9, WEBP webp:method 0-6,
+# JXL effort 1-9). An empty level leaves the encoder defaults.
+ENCODER_SPEEDS = {
+    'fast': (9, 1, 3),
+    'balanced': (6, 4, 7),
+    'best': (2, 6, 9),
+}
+# JXL can be encoded by libjxl's cjxl instead of the ImageMagick coder (use_cjxl)
+CJXL_THREADS = int(os.getenv('IMAGUICK_CJXL_THREADS', '0'))     # 0 = the worker's thread allowance
+
+# Formats whose files can be passed through untouched when a request changes nothing:
+# output extension -> PIL header format it must already have
+PASSTHROUGH_FORMATS = {
+    '.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP',
+    '.gif': 'GIF', '.tif': 'TIFF', '.tiff': 'TIFF', '.bmp': 'BMP',
+}
+
 # Formats that require potrace (raster-to-vector delegate)
 POTRACE_FORMATS = {'SVG', 'EPS', 'AI', 'PDF', 'WMF', 'EMF'}
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+# CPU cores shared by this process's conversions. Each file gets 1..CPU_CORES ImageMagick (OpenMP)
+# threads out of this budget; IMAGUICK_WORKERS caps how many files run at once. Both settings
+# are for the whole machine and divided between the SERVER_PROCESSES.
+MACHINE_CORES = int(os.getenv('IMAGUICK_THREADS', str(os.cpu_count() or 4)))
+CPU_CORES = max(1, MACHINE_CORES // SERVER_PROCESSES)
+MAX_CONCURRENT_CONVERSIONS = max(1, int(os.getenv('IMAGUICK_WORKERS', str(MACHINE_CORES))) // SERVER_PROCESSES)
+MP_PER_THREAD = 6    # megapixels per ImageMagick thread: below this a file stays single-threaded
+# Workers kept free of batch work so single-image requests never queue behind a big batch
+INTERACTIVE_RESERVED_WORKERS = int(os.getenv('IMAGUICK_INTERACTIVE_WORKERS', '1'))
+# Workers thumbnail rendering may hold at once (out of the batch share)
+PREVIEW_WORKERS = int(os.getenv('IMAGUICK_PREVIEW_WORKERS', '1'))
+CONVERSION_TIMEOUT = 300
+# RAM one conversion may use for pixels before large-image mode kicks in
+CONVERSION_MEMORY = max(64 * 1024 ** 2, MEMORY_BUDGET // MAX_CONCURRENT_CONVERSIONS)
+LARGE_IMAGE_PIXELS = CONVERSION_MEMORY // BYTES_PER_PIXEL
+LARGE_IMAGE_TIMEOUT = int(os.getenv('IMAGUICK_LARGE_TIMEOUT', '1800'))   # disk-backed conversions are slower
+INTERACTIVE_TIMEOUT = CONVERSION_TIMEOUT + 60   # conversion plus worst-case wait for a free worker
+# Batches nobody has polled for this long are cancelled automatically (0 disables)
+JOB_ABANDON_TIMEOUT = int(os.getenv('IMAGUICK_ABANDON_TIMEOUT', '600'))
+# Sweep the expiry index from a thread of this process; set to 0 when cleanup.py --daemon runs instead
+CLEANUP_IN_PROCESS = os.getenv('IMAGUICK_CLEANUP_IN_PROCESS', '1') == '1'
+# Set by imaguick.py and benchmark.py: the module is used as a library, with no web server state
+HEADLESS = os.getenv('IMAGUICK_HEADLESS', '0') == '1'
+FINISHED_JOB_STATUSES = {'complete', 'cancelled'}
+
+# Admission control — new batches get 429 + Retry-After once the queue is saturated. The counters
+# live in this process, so like the CPU and memory budgets the limits are for the whole server and
+# divided between the SERVER_PROCESSES (a client's batches may land on different processes).
+MAX_QUEUED_MEGAPIXELS = float(os.getenv('IMAGUICK_MAX_QUEUED_MP', '4000')) / SERVER_PROCESSES
+MAX_ACTIVE_JOBS = max(1, int(os.getenv('IMAGUICK_MAX_ACTIVE_JOBS', '16')) // SERVER_PROCESSES)
+MAX_JOBS_PER_CLIENT = max(1, int(os.getenv('IMAGUICK_MAX_JOBS_PER_CLIENT', '2')) // SERVER_PROCESSES)
+# Per-client window on the batch lane: by default one client can keep every batch worker busy, no more
+MAX_FILES_IN_FLIGHT_PER_CLIENT = int(os.getenv('IMAGUICK_MAX_FILES_PER_CLIENT',
+                                               str(max(1, MAX_CONCURRENT_CONVERSIONS - INTERACTIVE_RESERVED_WORKERS))))
+TRUST_PROXY_HEADERS = os.getenv('IMAGUICK_TRUST_PROXY', '0') == '1'
+DEFAULT_MP_PER_SECOND = 20.0   # throughput assumed until real conversions have been measured
+RETRY_AFTER_BOUNDS = (5, 300)
+
+# Resumable chunked uploads
+UPLOAD_CHUNK_MAX_SIZE = 64 * 1024 * 1024     # largest single PATCH body
+PRESCALE_EDGES = (1080, 1920)    # longest edges the browser may shrink photos to before uploading them
+UPLOAD_SESSION_TIMEOUT = int(os.getenv('IMAGUICK_UPLOAD_TIMEOUT', str(24 * 3600)))   # idle partial uploads expire
+UPLOAD_FINISH_WAIT = 60         # seconds a repeated final chunk waits for the first one to finish the upload
+# Seconds a request may hold an upload's 'finishing' claim: beyond any archive extraction, so
+# a claim left by a process that died is released even when its pid has been reused
+UPLOAD_FINISH_LEASE = 3600
+
+# Archive uploads (ZIP/TAR), extracted member by member into the upload folder
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+MAX_ARCHIVE_MEMBERS = int(os.getenv('IMAGUICK_MAX_ARCHIVE_MEMBERS', '10000'))
+MAX_ARCHIVE_EXTRACTED_SIZE = int(os.getenv('IMAGUICK_MAX_ARCHIVE_EXTRACTED_MB', str(8 * 1024))) * 1024 * 1024
+MAX_COMPRESSION_RATIO = 100     # expanded/compressed size beyond which a member (or archive) is treated as a bomb
+
+# URL import
+URL_FETCH_WORKERS = int(os.getenv('IMAGUICK_URL_FETCH_WORKERS', '8'))   # concurrent downloads, all hosts
+URL_FETCH_PER_HOST = 4          # concurrent downloads (and pooled connections) per host
+URL_FETCH_TIMEOUT = 30
+DNS_CACHE_TTL = 300             # seconds a validated (or rejected) DNS resolution is reused
+MAX_URLS_PER_IMPORT = 500
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
-app.config['UPLOAD_EXTENSIONS'] = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.tiff', '.bmp', '.arw', '.jxl', '.dng', '.cr2', '.cr3', '.nef', '.raf', '.rw2', '.heic', '.avif', '.apng', '.bmp']
+app.config['UPLOAD_EXTENSIONS'] = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.tiff', '.bmp', '.arw', '.jxl', '.dng', '.cr2', '.cr3', '.nef', '.raf', '.rw2', '.heic', '.avif', '.apng', '.bmp', '.tif', '.pdf']
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-insecure-key-change-in-prod')
 app.logger.setLevel(logging.INFO)
 
+# --- Conversion scheduler ---
+LANE_INTERACTIVE = 'interactive'
+LANE_PREVIEW = 'preview'
+LANE_BATCH = 'batch'
+
+
+# Threads the current worker may give ImageMagick / cjxl (read by run_command via magick_threads())
+worker_state = threading.local()
+
+
+def magick_threads():
+    """Thread allowance of the calling worker; 1 outside the scheduler."""
+    return getattr(worker_state, 'threads', 1)
+
+
+class ConversionScheduler:
+    """Fixed pool of conversion workers fed from three priority lanes.
+
+    Interactive tasks always dequeue before the others, and preview and batch tasks
+    together may occupy at most `workers - reserved` workers, so a single-image request
+    waits for at most other interactive requests while total concurrency stays at
+    `workers`. Preview tasks (thumbnails for the options pages) go ahead of batch tasks
+    but never hold more than `previews` workers, so a page full of thumbnails can
+    neither starve conversions nor wait behind a whole batch.
+
+    Workers also share `cores` CPU cores. When a task starts it is given between 1 and
+    `cores` threads (see _threads_for): its size, in megapixels, sets how many it could
+    use, and the queue behind it sets how many it may take. A deep queue of small
+    images runs one file per core, single-threaded; a few giant images run fewer files,
+    each multi-threaded. Batch tasks wait for a free core; interactive ones never do."""
+
+    def __init__(self, workers, reserved=1, cores=None, previews=1):
+        self.workers = max(1, workers)
+        self.batch_limit = max(1, self.workers - max(0, reserved))
+        self.preview_limit = max(1, min(previews, self.batch_limit))
+        self.cores = max(1, cores or self.workers)
+        self._free_cores = self.cores
+        self._cond = threading.Condition()
+        self._lanes = {LANE_INTERACTIVE: deque(), LANE_PREVIEW: deque(), LANE_BATCH: deque()}
+        self._running = {LANE_INTERACTIVE: 0, LANE_PREVIEW: 0, LANE_BATCH: 0}
+        self._started = False
+
+    def submit(self, lane, fn, *args, megapixels=0.0, **kwargs):
+        """Queue fn(*args, **kwargs) on a lane. megapixels sizes the task's thread
+        allowance. Returns a concurrent.futures.Future. The worker threads start with
+        the first task, so importing the module starts none."""
+        future = Future()
+        with self._cond:
+            if not self._started:
+                for i in range(self.workers):
+                    threading.Thread(target=self._worker, name=f'imaguick-worker-{i}', daemon=True).start()
+                self._started = True
+            self._lanes[lane].append((future, fn, args, kwargs, megapixels or 0.0))
+            self._cond.notify_all()
+        return future
+
+    def _next_task(self):
+        """Block until a task may run. Caller holds self._cond."""
+        while True:
+            if self._lanes[LANE_INTERACTIVE]:
+                return LANE_INTERACTIVE, self._lanes[LANE_INTERACTIVE].popleft()
+            background = self._running[LANE_PREVIEW] + self._running[LANE_BATCH]
+            if background < self.batch_limit and self._free_cores >= 1:
+                if self._lanes[LANE_PREVIEW] and self._running[LANE_PREVIEW] < self.preview_limit:
+                    return LANE_PREVIEW, self._lanes[LANE_PREVIEW].popleft()
+                if self._lanes[LANE_BATCH]:
+                    return LANE_BATCH, self._lanes[LANE_BATCH].popleft()
+            self._cond.wait()
+
+    def _threads_for(self, megapixels):
+        """Threads for a task that is starting now. Caller holds self._cond.
+        Free cores are split evenly between this task and every task still queued
+        (capped by the free workers), and the task takes no more than its size can use."""
+        useful = min(self.cores, max(1, math.ceil(megapixels / MP_PER_THREAD)))
+        waiting = sum(len(q) for q in self._lanes.values())
+        idle_workers = self.workers - sum(self._running.values())
+        share = self._free_cores // (1 + min(waiting, max(0, idle_workers - 1)))
+        return max(1, min(useful, share))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                lane, (future, fn, args, kwargs, megapixels) = self._next_task()
+                threads = self._threads_for(megapixels)
+                self._running[lane] += 1
+                self._free_cores -= threads
+            worker_state.threads = threads
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                worker_state.threads = 1
+                with self._cond:
+                    self._running[lane] -= 1
+                    self._free_cores += threads
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'cores': self.cores,
+                'free_cores': self._free_cores,
+                'queued': {lane: len(q) for lane, q in self._lanes.items()},
+                'running': dict(self._running),
+            }
+
+
 # --- Async batch processing state ---
 jobs = {}
 jobs_lock = threading.Lock()
-_processing_semaphore = threading.BoundedSemaphore(4)
-executor = ThreadPoolExecutor(max_workers=16)
+# Signalled when files are attached to an open job or a job is cancelled
+jobs_changed = threading.Condition(jobs_lock)
+# Running child processes per job (or single-image token), so cancel_job() can terminate them
+job_processes = {}
+# Single-image tokens whose request timed out while converting: their children are killed on sight
+abandoned_conversions = set()
+scheduler = ConversionScheduler(MAX_CONCURRENT_CONVERSIONS, INTERACTIVE_RESERVED_WORKERS, CPU_CORES,
+                                previews=PREVIEW_WORKERS)
+# Expiry of every upload, output and temp file; swept by cleanup.py (see run_sweeper).
+# Opened by start_web_app(): headless use records nothing
+expiry_index = NullIndex()
+# Stored copies of uploads and outputs, and where they are downloaded from (storage.py)
+storage = open_storage()
+
+# Admission state, guarded by jobs_lock
+queued_megapixels = 0.0
+measured_mp_per_second = None
+client_file_slots = {}
+
+# JSON API idempotency: (client, Idempotency-Key) -> {'job_id', 'fingerprint', 'created'}
+IDEMPOTENCY_TTL = 24 * 3600
+idempotency_keys = {}
+idempotency_lock = threading.Lock()
 
 # Server-side upload sessions: maps a short key -> list of saved filenames.
 # Avoids embedding long filename lists in redirect URLs (Gunicorn 4094-char limit).
 upload_sessions = {}
 upload_sessions_lock = threading.Lock()
+# Resumable uploads by id; the finished file is stored as '<id>_<name>', so the
+# record (and its background probe result) can be found from the filename alone.
+# The records live on disk next to the data (see _save_chunked_upload): this is
+# each worker process's copy, plus the in-process 'busy' flag.
+chunked_uploads = {}
+# Header probes of stored uploads, taken while the data was being written:
+# filename -> (probe, created). Reused by the options page and admission.
+upload_probes = {}
+# Uploads the browser downscaled before sending, and the bytes that saved (see probe_upload)
+prescale_stats = {'files': 0, 'original_bytes': 0, 'uploaded_bytes': 0}
+# Preview renders queued or running, by upload path, so each upload is decoded once
+# however many pages ask for its thumbnail (see request_previews)
+preview_futures = {}
+preview_lock = threading.Lock()
+# Returned by upload_previews() while a render is still queued or running
+PREVIEW_PENDING = object()
+
+# URL import: shared download pool, validated DNS answers and one pinned Session per host
+url_fetch_pool = ThreadPoolExecutor(max_workers=URL_FETCH_WORKERS, thread_name_prefix='imaguick-fetch')
+dns_cache = {}        # hostname -> (public IPs or None, expiry)
+host_sessions = {}    # (scheme, hostname, port) -> (pinned IP, Session, semaphore, last used)
+url_fetch_lock = threading.Lock()
 
 
 @app.errorhandler(413)
@@ -102,50 +417,121 @@ def secure_path(filepath):
 
 
 def is_valid_tmp_path(filepath):
-    """Check if a path is a valid imaguick-generated temp file in /tmp."""
+    """Check if a path is a valid imaguick-generated temp file, in /tmp or in the
+    tmp/ directory of a job or single-image work tree."""
     basename = os.path.basename(filepath)
+    directory = os.path.dirname(filepath)
     return (
-        filepath.startswith('/tmp/imaguick_') and
-        re.match(r'^imaguick_[a-f0-9]{32}\.(png|tiff)$', basename) is not None
+        re.match(r'^imaguick_[a-f0-9]{32}\.(png|tiff)$', basename) is not None and
+        (directory == TEMP_FOLDER or (os.path.basename(directory) == 'tmp' and secure_path(filepath) is not None))
     )
 
 
+# --- Storage layout ---
+# uploads/<aa>/<bb>/<uuid>_<name>              one upload (or <uuid>.part while it arrives)
+# uploads/<aa>/<bb>/<uuid>.upload.json         a resumable upload's record, shared by the worker processes
+# output/jobs/<aa>/<bb>/<job_id>/{in,tmp,out}  one batch job: sources, decoder temps, outputs + its ZIP
+# output/single/<aa>/<bb>/<token>/             one single-image conversion: output + tmp/
+# <aa>/<bb> are the first hex digits of the uuid, so no directory grows past a few hundred entries.
+
+def _shard(root, key):
+    return os.path.join(root, key[:2], key[2:4])
+
+
+def upload_path(filename, create=False):
+    """Path of a stored upload, sharded by the uuid its name starts with."""
+    directory = _shard(app.config['UPLOAD_FOLDER'], filename)
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def job_dir(job_id):
+    """Work tree of a batch job; removing it removes everything the job owns."""
+    return os.path.join(_shard(os.path.join(app.config['OUTPUT_FOLDER'], 'jobs'), job_id), job_id)
+
+
+def single_dir(token):
+    """Work tree of one single-image conversion, so concurrent requests for files with
+    the same name never share an output path."""
+    return os.path.join(_shard(os.path.join(app.config['OUTPUT_FOLDER'], 'single'), token), token)
+
+
+def stored_upload(filename):
+    """Local path of a stored upload, fetched from the storage backend when another node
+    received it. None if the upload does not exist."""
+    filepath = secure_path(upload_path(filename))
+    if not filepath:
+        return None
+    if not os.path.isfile(filepath):
+        if not storage.fetch(filepath):
+            return None
+        expiry_index.track(filepath)
+    return filepath
+
+
 # RAW formats that require dcraw pre-processing before ImageMagick
 RAW_FORMATS_DCRAW = {'.arw', '.dng', '.cr2', '.cr3', '.nef', '.raf', '.rw2'}
 
-def prepare_input_file(filepath):
+def prepare_input_file(filepath, job_id=None, temp_dir=None):
     """Decode special formats to a temp file before passing to ImageMagick.
     - JXL: decoded to PNG via djxl
     - RAW (ARW, DNG, CR2, CR3, NEF, RAF, RW2): decoded to TIFF via dcraw
+    Decoders run through run_command() so a cancelled job_id terminates them. The temp is
+    written to temp_dir (a work tree's tmp/) or, by default, TEMP_FOLDER.
     Returns (input_path, tmp_path). tmp_path is None if no temp was created.
-    Caller is responsible for deleting tmp_path (use try/finally)."""
+    Caller is responsible for deleting tmp_path (use try/finally) and forgetting it in
+    expiry_index, where it is recorded so a crash cannot leak it."""
     ext = os.path.splitext(filepath)[1].lower()
+    temp_dir = temp_dir or TEMP_FOLDER
+    if ext == '.jxl' or ext in RAW_FORMATS_DCRAW:
+        os.makedirs(temp_dir, exist_ok=True)
 
     if ext == '.jxl':
         validated = secure_path(filepath)
         if not validated:
             raise ValueError(f"Insecure JXL path: {filepath}")
-        tmp_path = f'/tmp/imaguick_{uuid.uuid4().hex}.png'
-        subprocess.run(['djxl', '--', validated, tmp_path], check=True, timeout=60)
+        tmp_path = os.path.join(temp_dir, f'imaguick_{uuid.uuid4().hex}.png')
+        expiry_index.track(tmp_path, max_age=TEMP_MAX_AGE)
+        try:
+            run_command(['djxl', '--', validated, tmp_path], job_id=job_id, timeout=60)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            expiry_index.forget(tmp_path)
+            raise
         return tmp_path, tmp_path
 
     if ext in RAW_FORMATS_DCRAW:
         validated = secure_path(filepath)
         if not validated:
             raise ValueError(f"Insecure RAW path: {filepath}")
-        tmp_path = f'/tmp/imaguick_{uuid.uuid4().hex}.tiff'
+        tmp_path = os.path.join(temp_dir, f'imaguick_{uuid.uuid4().hex}.tiff')
+        expiry_index.track(tmp_path, max_age=TEMP_MAX_AGE)
         # -T: output TIFF, -w: camera white balance, -6: 16-bit, -c: write to stdout
         # Pipe stdout to the temp file — dcraw does not support -O or -- separator
-        with open(tmp_path, 'wb') as out_f:
-            subprocess.run(
-                ['dcraw', '-T', '-w', '-6', '-c', validated],
-                stdout=out_f, check=True, timeout=120
-            )
+        try:
+            with open(tmp_path, 'wb') as out_f:
+                run_command(['dcraw', '-T', '-w', '-6', '-c', validated],
+                            job_id=job_id, timeout=120, stdout=out_f)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            expiry_index.forget(tmp_path)
+            raise
         return tmp_path, tmp_path
 
     return filepath, None
 
 
+def check_dimensions(width, height):
+    """Raise ValueError unless width x height is within MAX_DIMENSION and MAX_MEGAPIXELS."""
+    if not (0 < width <= MAX_DIMENSION and 0 < height <= MAX_DIMENSION):
+        raise ValueError(f"Image dimensions ({width}x{height}) exceed maximum allowed ({MAX_DIMENSION}px)")
+    if width * height > MAX_MEGAPIXELS * 1_000_000:
+        raise ValueError(f"Image of {width * height / 1e6:.0f} MP exceeds maximum allowed ({MAX_MEGAPIXELS} MP)")
+
+
 def get_image_dimensions(filepath):
     """Get image dimensions using appropriate tool based on file type."""
     try:
@@ -168,8 +554,7 @@ def get_image_dimensions(filepath):
                     try:
                         width = int(dimensions[0])
                         height = int(dimensions[1])
-                        if not (0 < width <= MAX_DIMENSION and 0 < height <= MAX_DIMENSION):
-                            raise ValueError(f"Image dimensions ({width}x{height}) exceed maximum allowed ({MAX_DIMENSION}px)")
+                        check_dimensions(width, height)
                         app.logger.info(f"Successfully parsed dimensions: {width}x{height}")
                         return width, height
                     except ValueError:
@@ -179,7 +564,8 @@ def get_image_dimensions(filepath):
             return None, None
         else:
             app.logger.info(f"Getting dimensions for non-ARW file")
-            cmd = ['magick', 'identify', secure_file_path]
+            # -ping reads the header only; the first frame is enough for the size
+            cmd = ['magick', 'identify', '-ping', f'{secure_file_path}[0]']
             app.logger.info(f"Running ImageMagick command")
             result = subprocess.run(cmd, capture_output=True, text=True, shell=False, timeout=30)
             if result.returncode != 0:
@@ -189,8 +575,7 @@ def get_image_dimensions(filepath):
             if match:
                 width = int(match.group(1))
                 height = int(match.group(2))
-                if not (0 < width <= MAX_DIMENSION and 0 < height <= MAX_DIMENSION):
-                    raise ValueError(f"Image dimensions ({width}x{height}) exceed maximum allowed ({MAX_DIMENSION}px)")
+                check_dimensions(width, height)
                 app.logger.info(f"Successfully parsed dimensions: {width}x{height}")
                 return width, height
             else:
@@ -362,24 +747,39 @@ def get_available_formats(filepath=None):
 
 
 def _analyze_with_pil(filepath):
-    """Analyze image with PIL and return type dict."""
-    with Image.open(filepath) as img:
+    """Analyze image with PIL and return type dict.
+    Images over LARGE_IMAGE_PIXELS are not decoded in full: JPEGs are sampled from a
+    reduced-scale decode (draft), other formats are judged from their mode alone."""
+    try:
+        img = Image.open(filepath)
+    except Image.DecompressionBombError:
+        # Past PIL's pixel limit, which stays on to guard its decodes: judged from the header
+        header = identify_header(filepath)
+        return {'has_transparency': header['alpha'], 'is_photo': True, 'original_format': header['format']}
+    with img:
+        original_format = img.format
         has_transparency = 'A' in img.getbands()
         is_photo = True
+        large = img.width * img.height > LARGE_IMAGE_PIXELS
+        if large and original_format == 'JPEG':
+            img.draft('RGB', (ANALYSIS_PROXY_SIZE, ANALYSIS_PROXY_SIZE))
+            img.thumbnail((ANALYSIS_PROXY_SIZE, ANALYSIS_PROXY_SIZE), Image.NEAREST)
+            large = False
         if img.mode in ('P', '1', 'L'):
             is_photo = False
-        elif img.mode in ('RGB', 'RGBA'):
-            pixels = list(img.getdata())
+        elif img.mode in ('RGB', 'RGBA') and not large:
+            data = img.tobytes()
+            pixel_size = len(img.getbands())
+            pixel_count = img.width * img.height
             # Sample spread across the whole image, not just the top-left
             # corner, which is often a uniform sky/background region.
-            step = max(1, len(pixels) // 1000)
-            sample = pixels[::step][:1000]
-            unique_colors = len(set(sample))
-            is_photo = unique_colors > 100
+            step = max(1, pixel_count // 1000)
+            sample = {data[i:i + pixel_size] for i in range(0, pixel_count * pixel_size, step * pixel_size)[:1000]}
+            is_photo = len(sample) > 100
         return {
             'has_transparency': has_transparency,
             'is_photo': is_photo,
-            'original_format': img.format
+            'original_format': original_format
         }
 
 
@@ -395,7 +795,7 @@ def analyze_image_type(filepath):
             return {'has_transparency': False, 'is_photo': True, 'original_format': 'ARW'}
 
         if validated_path.lower().endswith('.jxl'):
-            tmp_path = f'/tmp/imaguick_{uuid.uuid4().hex}.png'
+            tmp_path = os.path.join(TEMP_FOLDER, f'imaguick_{uuid.uuid4().hex}.png')
             try:
                 subprocess.run(['djxl', '--', validated_path, tmp_path], check=True, timeout=60)
                 return _analyze_with_pil(tmp_path)
@@ -422,11 +822,17 @@ def flash_error(message):
 def extract_processing_params(form):
     """Extract all image processing parameters from a form."""
     raw_format = form.get('format', '').upper().strip()
-    output_format = raw_format if raw_format in ALLOWED_OUTPUT_FORMATS else ''
+    output_format = raw_format if raw_format in ALLOWED_OUTPUT_FORMATS or raw_format == AUTO_FORMAT else ''
 
     raw_sharpen = form.get('sharpen_level', 'standard').strip().lower()
     sharpen_level = raw_sharpen if raw_sharpen in ALLOWED_SHARPEN_LEVELS else 'standard'
 
+    raw_speed = str(form.get('encoder_speed', '')).strip().lower()
+    encoder_speed = raw_speed if raw_speed in ENCODER_SPEEDS else ''
+
+    raw_max_size = str(form.get('max_size_kb', '')).strip()
+    max_size_kb = int(raw_max_size) if raw_max_size.isdigit() and int(raw_max_size) > 0 else None
+
     return {
         'width': form.get('width', DEFAULTS['width']),
         'height': form.get('height', DEFAULTS['height']),
@@ -440,14 +846,20 @@ def extract_processing_params(form):
         'use_1920p': form.get('use_1920p') == 'on',
         'use_sharpen': form.get('use_sharpen') == 'on',
         'sharpen_level': sharpen_level,
+        'max_size_kb': max_size_kb,
+        'encoder_speed': encoder_speed,
+        'use_cjxl': form.get('use_cjxl') == 'on',
     }
 
 
 def build_imagemagick_command(filepath, output_path, width, height, percentage, quality, keep_ratio,
                               auto_level=False, auto_gamma=False, use_1080p=False, use_1920p=False,
-                              use_sharpen=False, sharpen_level='standard'):
+                              use_sharpen=False, sharpen_level='standard', encoder_speed='', input_options=None,
+                              animation=False):
     """Build ImageMagick command for resizing and formatting.
-    filepath must already be decoded (JXL → PNG via prepare_input_file before calling this)."""
+    filepath must already be decoded (JXL → PNG via prepare_input_file before calling this).
+    input_options go before the input file (resource limits, decoder hints). With animation,
+    frames are coalesced and de-duplicated before processing and re-optimized after."""
     if not (secure_path(filepath) or is_valid_tmp_path(filepath)):
         app.logger.error("Insecure input file path detected")
         return None
@@ -463,7 +875,10 @@ def build_imagemagick_command(filepath, output_path, width, height, percentage,
             app.logger.error(f"Output format {ext} requires potrace which is not installed")
             return None
 
-    command = ['magick', filepath]
+    command = ['magick', *(input_options or []), filepath]
+    if animation:
+        # Full frames, so resizing and filters see whole images; identical neighbours merged
+        command.extend(['-coalesce', '-layers', 'RemoveDups'])
 
     if auto_gamma:
         command.append('-auto-gamma')
@@ -522,126 +937,1885 @@ def build_imagemagick_command(filepath, output_path, width, height, percentage,
         except ValueError:
             return None
 
+    if animation:
+        if ext == 'GIF':
+            # One shared palette for every frame, then changed-region frames with transparency
+            command.extend(['+remap', '-layers', 'Optimize'])
+        else:
+            command.extend(['-layers', 'OptimizeFrame'])
+
+    command.extend(encoder_defines(output_path, encoder_speed))
     command.append(output_path)
     return command
 
 
+def _resize_scale(width, height, params):
+    """Factor by which the requested resize shrinks a width x height image, or None when
+    the request sets no size (or an unparsable one)."""
+    scales = []
+    if params['use_1920p']:
+        scales.append(min(1.0, 1920 / max(width, height)))
+    if params['use_1080p']:
+        scales.append(min(1.0, 1080 / max(width, height)))
+    else:
+        try:
+            if params['percentage']:
+                scales.append(float(params['percentage']) / 100)
+            elif params['width'] and params['height']:
+                scales.append(min(int(params['width']) / width, int(params['height']) / height))
+            elif params['width']:
+                scales.append(int(params['width']) / width)
+            elif params['height']:
+                scales.append(int(params['height']) / height)
+        except ValueError:
+            return None
+    return min(scales) if scales else None
+
+
+def large_image_options(filepath, params, header=None):
+    """Input options for images over LARGE_IMAGE_PIXELS (all frames together), [] for ordinary ones.
+    Resource limits hold ImageMagick's pixel cache to CONVERSION_MEMORY of RAM; beyond
+    that it is memory-mapped from, then read and written to, files in PIXEL_CACHE_DIR,
+    so RAM stays bounded whatever the image size. JPEGs being shrunk also get a jpeg:size
+    hint: libjpeg then decodes at the smallest 1/2..1/8 DCT scale that stays at least twice
+    the output size, and the full-resolution raster never exists."""
+    header = header or probe_header(filepath)
+    width, height = header.get('width'), header.get('height')
+    if not width or not height or width * height * header.get('frames', 1) <= LARGE_IMAGE_PIXELS:
+        return []
+    memory_mb = CONVERSION_MEMORY // 1024 ** 2
+    options = ['-limit', 'memory', f'{memory_mb}MiB', '-limit', 'map', f'{2 * memory_mb}MiB',
+               '-define', f'registry:temporary-path={PIXEL_CACHE_DIR}']
+    scale = _resize_scale(width, height, params)
+    if header.get('format') == 'JPEG' and scale and scale < 0.5:
+        options.extend(['-define', f'jpeg:size={math.ceil(2 * width * scale)}x{math.ceil(2 * height * scale)}'])
+    return options
+
+
+def encoder_defines(output_path, encoder_speed):
+    """ImageMagick -define options for an ENCODER_SPEEDS level and the output's coder."""
+    if encoder_speed not in ENCODER_SPEEDS:
+        return []
+    heic_speed, webp_method, jxl_effort = ENCODER_SPEEDS[encoder_speed]
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext in ('.avif', '.heic'):
+        return ['-define', f'heic:speed={heic_speed}']
+    if ext == '.webp':
+        return ['-define', f'webp:method={webp_method}']
+    if ext == '.jxl':
+        return ['-define', f'jxl:effort={jxl_effort}']
+    return []
+
+
+def encode_with_cjxl(command, output_path, quality, encoder_speed, job_id=None, timeout=CONVERSION_TIMEOUT):
+    """Run an ImageMagick command that targets a .jxl file through libjxl's cjxl instead:
+    ImageMagick renders an uncompressed PAM next to the output, which cjxl then encodes
+    with its multithreaded encoder (cjxl quality / effort from the same params)."""
+    intermediate = os.path.splitext(output_path)[0] + '.cjxl.pam'
+    cjxl = ['cjxl', intermediate, output_path]
+    if quality and quality != '100':
+        cjxl.extend(['-q', quality])
+    if encoder_speed in ENCODER_SPEEDS:
+        cjxl.extend(['-e', str(ENCODER_SPEEDS[encoder_speed][2])])
+    cjxl.append(f'--num_threads={CJXL_THREADS or magick_threads()}')
+    deadline = time.monotonic() + timeout
+    # jxl:effort means nothing to the PAM coder
+    render = [arg for arg in command[:-1] if not arg.startswith('jxl:')]
+    if render[-1] == '-define':
+        render.pop()
+    try:
+        run_command(render + [intermediate], job_id=job_id, timeout=timeout)
+        run_command(cjxl, job_id=job_id, timeout=max(0.1, deadline - time.monotonic()))
+    finally:
+        if os.path.exists(intermediate):
+            os.remove(intermediate)
+
+
+def run_encode(command, output_path, params, job_id=None, timeout=CONVERSION_TIMEOUT):
+    """Run a built ImageMagick command, handing JXL output to cjxl when params ask for it
+    and cjxl is installed."""
+    if params.get('use_cjxl') and output_path.lower().endswith('.jxl'):
+        if shutil.which('cjxl'):
+            return encode_with_cjxl(command, output_path, params['quality'], params.get('encoder_speed', ''),
+                                    job_id, timeout)
+        app.logger.warning("use_cjxl requested but cjxl is not installed, using the ImageMagick JXL coder")
+    run_command(command, job_id=job_id, timeout=timeout)
+
+
+# --- Admission control ---
+
+def client_id():
+    """Identify the submitting client for per-client limits."""
+    if TRUST_PROXY_HEADERS and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+
+def estimate_megapixels(filepath):
+    """Cheap megapixel estimate from the image header (no pixel decode), all frames / pages.
+    Falls back to ~1 byte per pixel for formats PIL cannot open (RAW, JXL, PDF, ...)."""
+    try:
+        with Image.open(filepath) as img:
+            return img.width * img.height * getattr(img, 'n_frames', 1) / 1e6
+    except Image.DecompressionBombError:
+        header = probe_header(filepath)
+        if header:
+            return header['width'] * header['height'] * header['frames'] / 1e6
+        return os.path.getsize(filepath) / 1e6
+    except Exception:
+        try:
+            return os.path.getsize(filepath) / 1e6
+        except OSError:
+            return 0.0
+
+
+def _retry_after(megapixels):
+    """Seconds until roughly `megapixels` of queued work has drained. Caller holds jobs_lock."""
+    rate = measured_mp_per_second or DEFAULT_MP_PER_SECOND
+    low, high = RETRY_AFTER_BOUNDS
+    return int(min(high, max(low, megapixels / rate)))
+
+
+def admit_job(client, batch_mp):
+    """Reserve queue capacity for a batch. Caller holds jobs_lock.
+    Returns None when admitted, otherwise a dict describing why and when to retry."""
+    global queued_megapixels
+    active = [j for j in jobs.values() if j.get('status') not in FINISHED_JOB_STATUSES]
+    client_jobs = [j for j in active if j.get('client') == client]
+
+    if len(client_jobs) >= MAX_JOBS_PER_CLIENT:
+        client_mp = sum(j['remaining_mp'] for j in client_jobs)
+        return {'reason': 'client_limit', 'retry_after': _retry_after(client_mp), 'position': len(client_jobs)}
+    if len(active) >= MAX_ACTIVE_JOBS:
+        return {'reason': 'busy', 'retry_after': _retry_after(queued_megapixels / max(1, len(active))),
+                'position': len(active)}
+    # A single oversized batch is still admitted onto an idle queue so it can't be starved forever
+    if active and queued_megapixels + batch_mp > MAX_QUEUED_MEGAPIXELS:
+        excess = queued_megapixels + batch_mp - MAX_QUEUED_MEGAPIXELS
+        return {'reason': 'busy', 'retry_after': _retry_after(excess), 'position': len(active)}
+
+    queued_megapixels += batch_mp
+    return None
+
+
+def release_megapixels(job, file_info, elapsed=None):
+    """Return a finished file's megapixels to the admission budget. Caller holds jobs_lock."""
+    global queued_megapixels, measured_mp_per_second
+    mp = file_info.get('megapixels') or 0.0
+    queued_megapixels = max(0.0, queued_megapixels - mp)
+    job['remaining_mp'] = max(0.0, job['remaining_mp'] - mp)
+    if elapsed and mp:
+        # Per-worker rate scaled by worker count, smoothed so one outlier doesn't swing Retry-After
+        rate = mp / elapsed * scheduler.batch_limit
+        measured_mp_per_second = rate if measured_mp_per_second is None else 0.8 * measured_mp_per_second + 0.2 * rate
+
+
+def client_slots(client):
+    """Per-client semaphore bounding how many of its files sit in the batch lane at once."""
+    with jobs_lock:
+        slots = client_file_slots.get(client)
+        if slots is None:
+            slots = client_file_slots[client] = threading.BoundedSemaphore(MAX_FILES_IN_FLIGHT_PER_CLIENT)
+        return slots
+
+
+def too_busy_response(decision, form, form_action=None):
+    """429 with Retry-After: JSON for scripts, an auto-retrying queue page for browsers
+    that re-posts `form` to form_action (default: the current route)."""
+    headers = {'Retry-After': str(decision['retry_after'])}
+    if request.accept_mimetypes.accept_html and not request.headers.get('X-Requested-With'):
+        body = render_template('busy.html',
+                               retry_after=decision['retry_after'],
+                               position=decision['position'],
+                               reason=decision['reason'],
+                               form_action=form_action or request.path,
+                               form_fields=[(k, v) for k in form for v in form.getlist(k)])
+        return body, 429, headers
+    return {'error': 'Server busy, retry later', **decision}, 429, headers
+
+
+# --- Child processes and cancellation ---
+
+def _kill_process_group(proc):
+    """Kill a child started by run_command() together with any delegates it spawned."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def conversion_cancelled(job_id):
+    """Whether work registered under job_id is being stopped: its batch was cancelled, or
+    (for a single-image token) its request stopped waiting. Its processes get killed, so
+    their failures are expected rather than errors."""
+    if not job_id:
+        return False
+    with jobs_lock:
+        return bool(jobs.get(job_id, {}).get('cancelled')) or job_id in abandoned_conversions
+
+
+def log_magick_error(log_prefix, fname, error, job_id=None):
+    """Log a failed ImageMagick run at ERROR, or at INFO when it was killed on purpose."""
+    if conversion_cancelled(job_id):
+        app.logger.info(f"{log_prefix}{fname}: stopped, conversion cancelled")
+    else:
+        app.logger.error(f"{log_prefix}ImageMagick error for {fname}: {error.stderr}")
+
+
+def run_command(command, job_id=None, timeout=CONVERSION_TIMEOUT, stdout=subprocess.PIPE):
+    """subprocess.run(check=True) equivalent that registers the child against job_id.
+    The child gets its own process group so cancelling a job also stops the
+    delegates ImageMagick forks (ghostscript, potrace, ...). ImageMagick is held to
+    the calling worker's thread allowance (MAGICK_THREAD_LIMIT, i.e. -limit thread)."""
+    env = {**os.environ, 'MAGICK_THREAD_LIMIT': str(magick_threads())} if command[0] == 'magick' else None
+    proc = subprocess.Popen(command, stdout=stdout, stderr=subprocess.PIPE, text=True, start_new_session=True,
+                            env=env)
+    if job_id:
+        with jobs_lock:
+            job_processes.setdefault(job_id, set()).add(proc)
+        if conversion_cancelled(job_id):
+            _kill_process_group(proc)
+    try:
+        out, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_group(proc)
+        proc.communicate()
+        raise
+    finally:
+        if job_id:
+            with jobs_lock:
+                job_processes.get(job_id, set()).discard(proc)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command, out, err)
+    return subprocess.CompletedProcess(command, proc.returncode, out, err)
+
+
+def convert_single(token, filepath, output_path, params, **kwargs):
+    """convert_file() for a single-image request, with its children registered under the
+    request's token so that resize_image() can kill them when it stops waiting."""
+    try:
+        return convert_file(filepath, output_path, params, job_id=token, **kwargs)
+    finally:
+        with jobs_lock:
+            job_processes.pop(token, None)
+            abandoned_conversions.discard(token)
+
+
+def abandon_single(token, future):
+    """Stop a single-image conversion nobody waits for any more: drop it if still queued,
+    otherwise kill its running processes, and any it starts later."""
+    if future.cancel():
+        return
+    with jobs_lock:
+        if future.done():
+            return
+        abandoned_conversions.add(token)
+        procs = list(job_processes.get(token, ()))
+    for proc in procs:
+        _kill_process_group(proc)
+
+
+def cancel_job(job_id, reason='user'):
+    """Stop a batch: drop queued files, kill running children, free worker slots.
+    process_job() removes partial outputs once the running files have unwound.
+    Returns False if the job is unknown or already finished."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job or job.get('cancelled') or job.get('status') in FINISHED_JOB_STATUSES:
+            return False
+        job['cancelled'] = True
+        job['cancel_reason'] = reason
+        job['status'] = 'cancelling'
+        jobs_changed.notify_all()
+        for fi in job['files']:
+            if fi['status'] == 'queued':
+                fi['status'] = 'cancelled'
+                release_megapixels(job, fi)
+        futures = list(job.get('futures', ()))
+        procs = list(job_processes.get(job_id, ()))
+
+    for future in futures:
+        future.cancel()
+    for proc in procs:
+        _kill_process_group(proc)
+    app.logger.info(f"Job {job_id} cancelled ({reason}): {len(procs)} running process(es) killed")
+    return True
+
+
+def _discard_job_files(job):
+    """Remove a cancelled job's work tree: partial outputs, temps and remaining sources."""
+    shutil.rmtree(job['job_dir'], ignore_errors=True)
+
+
+def _reap_abandoned_jobs():
+    """Background loop: cancel batches no client has polled for JOB_ABANDON_TIMEOUT seconds."""
+    while True:
+        time.sleep(30)
+        cutoff = time.time() - JOB_ABANDON_TIMEOUT
+        with jobs_lock:
+            abandoned = [
+                job_id for job_id, job in jobs.items()
+                if job.get('status') not in FINISHED_JOB_STATUSES
+                and not job.get('cancelled')
+                and job.get('last_seen', time.time()) < cutoff
+            ]
+        for job_id in abandoned:
+            cancel_job(job_id, reason='abandoned')
+
+
+web_app_lock = threading.Lock()
+web_app_started = False
+
+
+def start_web_app():
+    """Set up what only the web server needs: the upload and output folders, the expiry
+    index and, with CLEANUP_IN_PROCESS, its sweeper, and the reaper of abandoned
+    batches. Runs once, before the first request
+    (or from `python app.py`), so importing the module, as the CLI does, leaves the working
+    directory alone and records no files that nothing would sweep."""
+    global web_app_started, expiry_index
+    with web_app_lock:
+        if web_app_started or HEADLESS:
+            return
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+        if SERVER_PROCESSES > 1:
+            app.logger.warning(f"Running as one of {SERVER_PROCESSES} processes: jobs are only reachable "
+                               f"from the process that created them and admission limits are per process "
+                               f"({MAX_ACTIVE_JOBS} batches, {MAX_JOBS_PER_CLIENT} per client, "
+                               f"{MAX_QUEUED_MEGAPIXELS:.0f} MP)")
+        expiry_index = ExpiryIndex()
+        if CLEANUP_IN_PROCESS:
+            # Indexed entries only: the full-tree reconciliation is left to cleanup.py
+            threading.Thread(target=run_sweeper, args=(expiry_index,), kwargs={'scan_interval': 0},
+                             name='imaguick-cleanup', daemon=True).start()
+        if JOB_ABANDON_TIMEOUT > 0:
+            threading.Thread(target=_reap_abandoned_jobs, name='imaguick-reaper', daemon=True).start()
+        web_app_started = True
+
+
+@app.before_request
+def _start_web_app():
+    if not web_app_started:
+        start_web_app()
+
+
 # --- Async batch processing functions ---
 
-def process_job(job_id):
-    """Process all files for a batch job. Runs in a background daemon thread."""
+def process_job(job_id, file_list=None):
+    """Process all files for a batch job. Runs in a background daemon thread.
+    Open jobs keep accepting files (attach_upload_to_job) until they are closed.
+    With file_list (a retry, see retry_job), only those entries are processed, and
+    their outputs are added to the existing archive."""
+    retry = file_list is not None
     with jobs_lock:
         job = jobs.get(job_id)
         if not job:
             return
-        file_list = job['files']
+        file_list = job['files'] if file_list is None else file_list
         params = job['params']
         batch_folder = job['batch_folder']
+        work_dir = job['job_dir']
         timestamp = job['timestamp']
-
-    futures = {
-        executor.submit(process_single_file, job_id, file_info, params, batch_folder): file_info
-        for file_info in file_list
-    }
+        client = job['client']
+
+    # Feed the batch lane through a per-client window so one heavy uploader's
+    # thousands of files can't queue ahead of everyone else's.
+    slots = client_slots(client)
+    futures = []
+    index = 0
+    while True:
+        with jobs_lock:
+            while (index >= len(file_list) and (job.get('open') or job['pending_uploads'])
+                   and not job.get('cancelled')):
+                jobs_changed.wait(timeout=5)
+            if index >= len(file_list) or job.get('cancelled'):
+                break
+            file_info = file_list[index]
+        index += 1
+        slots.acquire()
+        with jobs_lock:
+            if job.get('cancelled'):
+                slots.release()
+                break
+            future = scheduler.submit(LANE_BATCH, process_single_file, job_id, file_info, params, batch_folder,
+                                      megapixels=file_info.get('megapixels'))
+            job['futures'].append(future)
+        future.add_done_callback(lambda _f: slots.release())
+        futures.append(future)
 
     for future in as_completed(futures):
+        if future.cancelled():
+            continue
         try:
             future.result()
         except Exception as e:
             app.logger.error(f"Unexpected error in batch future for job {job_id}: {e}")
 
-    # Create ZIP from all successfully processed files
     with jobs_lock:
-        done = jobs[job_id]['done']
+        cancelled = job.get('cancelled')
+        job['futures'] = []
+        job_processes.pop(job_id, None)
+
+    if cancelled and retry:
+        # Cancelling a retry only stops the retry: the job's earlier results stay
+        with jobs_lock:
+            job['cancelled'] = False
+            job.pop('cancel_reason', None)
+            for fi in file_list:
+                if fi['status'] in ('queued', 'cancelled'):
+                    fi['status'] = 'error'
+                    fi['error'] = 'Retry cancelled'
+                    job['errors'] += 1
+        app.logger.info(f"Job {job_id}: retry cancelled")
+    elif cancelled:
+        _discard_job_files(job)
+        expiry_index.forget_job(job_id)
+        with jobs_lock:
+            job['status'] = 'cancelled'
+            job['finished_at'] = time.time()
+        app.logger.info(f"Job {job_id} cancelled: partial outputs removed")
+        return
 
-    if done > 0:
-        zip_filename = f'ImaGUIck_{timestamp}.zip'
-        zip_path = os.path.join(app.config['OUTPUT_FOLDER'], zip_filename)
+    # Add this run's outputs to the ZIP: created by the first run, appended to by retries
+    with jobs_lock:
+        zip_filename = job.get('zip') or f'ImaGUIck_{timestamp}_{job_id[:8]}.zip'
+        new_outputs = [item for fi in file_list if fi['status'] == 'done' for item in output_files(fi)]
+    if new_outputs:
+        zip_path = os.path.join(work_dir, zip_filename)
         try:
-            with ZipFile(zip_path, 'w') as zipf:
-                with jobs_lock:
-                    for fi in jobs[job_id]['files']:
-                        if fi.get('output') and os.path.exists(fi['output']):
-                            zipf.write(fi['output'], os.path.basename(fi['output']))
+            with ZipFile(zip_path, 'a' if os.path.exists(zip_path) else 'w') as zipf:
+                for path, name in new_outputs:
+                    zipf.write(path, name)
+            storage.save(zip_path)
             with jobs_lock:
-                jobs[job_id]['zip'] = zip_filename
-            app.logger.info(f"ZIP created for job {job_id}: {zip_filename}")
+                job['zip'] = zip_filename
+            app.logger.info(f"ZIP {'updated' if retry else 'created'} for job {job_id}: {zip_filename} "
+                            f"(+{len(new_outputs)} file(s))")
         except Exception as e:
             app.logger.error(f"Error creating ZIP for job {job_id}: {e}")
 
+    # The work tree (outputs, ZIP, failed sources) now expires MAX_AGE_HOURS from completion
+    expiry_index.release_job(job_id)
+
     with jobs_lock:
         jobs[job_id]['status'] = 'complete'
+        jobs[job_id]['finished_at'] = time.time()
         final_done = jobs[job_id]['done']
         final_errors = jobs[job_id]['errors']
 
     app.logger.info(f"Job {job_id} complete: {final_done} done, {final_errors} errors")
 
 
-def process_single_file(job_id, file_info, params, batch_folder):
-    """Process one file within a batch job. Acquires semaphore before ImageMagick."""
-    with _processing_semaphore:
-        with jobs_lock:
-            file_info['status'] = 'processing'
+def output_files(file_info):
+    """(path, archive name) of each file a batch entry produced: its output, or for
+    per-page conversions every page in its output directory, as '<dir>/<page>'."""
+    output = file_info.get('output')
+    if not output or not os.path.exists(output):
+        return []
+    if not os.path.isdir(output):
+        return [(output, os.path.basename(output))]
+    return [(os.path.join(output, page), f'{os.path.basename(output)}/{page}')
+            for page in sorted(os.listdir(output))]
 
-        filepath = file_info['path']
-        fname = file_info['original']
 
+def probe_header(filepath):
+    """Width, height, container format and frame count from the image header (no pixel
+    decode), or {}."""
+    try:
+        with Image.open(filepath) as img:
+            return {'width': img.width, 'height': img.height, 'format': img.format,
+                    'frames': getattr(img, 'n_frames', 1)}
+    except Image.DecompressionBombError:
         try:
-            output_format = params['output_format']
-            if output_format:
-                output_filename = f'{os.path.splitext(fname)[0]}_imaGUIck.{output_format.lower()}'
+            return identify_header(filepath)
+        except (ValueError, OSError, subprocess.SubprocessError):
+            return {}
+    except Exception:
+        return {}
+
+
+def identify_header(filepath):
+    """probe_header() fields (plus 'alpha') from `magick identify -ping`, for images past
+    PIL's decompression-bomb limit. That limit is left at its default so PIL never decodes
+    such an image, while ImageMagick, held to its own resource limits, reads just the header."""
+    result = run_command(['magick', 'identify', '-ping', '-format', '%w %h %m %n %A\n', filepath], timeout=30)
+    width, height, fmt, frames, alpha = result.stdout.splitlines()[0].split()
+    return {'width': int(width), 'height': int(height), 'format': fmt, 'frames': int(frames),
+            'alpha': alpha.lower() not in ('false', 'undefined')}
+
+
+def without_fitting_presets(params, header):
+    """params without the 1080p / 1920p presets an image already fits inside. With
+    1080p set, the other size fields are ignored (see build_imagemagick_command), so
+    they are dropped along with it."""
+    longest = max(header['width'], header['height'])
+    if params['use_1080p'] and longest <= 1080:
+        return {**params, 'use_1080p': False, 'use_1920p': False, 'percentage': '', 'width': '', 'height': ''}
+    if params['use_1920p'] and longest <= 1920:
+        return {**params, 'use_1920p': False}
+    return params
+
+
+def prescale_shortfall(params, header, max_edge):
+    """Why params need more pixels than an upload the browser shrank to max_edge has, or
+    None when they don't. Only a resize to at most the shrunk size is served from it:
+    no resize or a percentage means the original size, and anything larger would be
+    an upscale of the shrunk copy."""
+    message = f"Shrunk to {max_edge} px before upload; these settings need the original"
+    preset_edges = [edge for edge, on in ((1080, params['use_1080p']), (1920, params['use_1920p'])) if on]
+    if preset_edges:
+        return None if min(preset_edges) <= max_edge else message
+    if params['percentage']:
+        return message
+    if not (params['width'] or params['height']):
+        return message
+    width, height = header['width'], header['height']
+    try:
+        if params['keep_ratio']:
+            fits = _resize_scale(width, height, params) <= 1.0
+        else:
+            fits = (int(params['width'] or 0) <= width) and (int(params['height'] or 0) <= height)
+    except (TypeError, ValueError):
+        return None   # an unparsable size fails the conversion itself
+    return None if fits else message
+
+
+def is_noop_conversion(filepath, output_path, params, header=None):
+    """True when running ImageMagick would only re-encode the input: the output extension
+    names the format the file already has, it is inside every requested bound, quality is
+    100 and no filters are set. Such files are passed through."""
+    if params['auto_level'] or params['auto_gamma'] or params['use_sharpen']:
+        return False
+    if params['quality'] not in ('', '100'):
+        return False
+    target_format = PASSTHROUGH_FORMATS.get(os.path.splitext(output_path)[1].lower())
+    if not target_format:
+        return False
+    header = header or probe_header(filepath)
+    if header.get('format') != target_format:
+        return False
+
+    width, height = header['width'], header['height']
+    if params['use_1920p'] and max(width, height) > 1920:
+        return False
+    if params['use_1080p'] and max(width, height) > 1080:
+        return False
+    if params['use_1080p']:
+        # build_imagemagick_command ignores percentage / width / height with the 1080p preset
+        return True
+    try:
+        if params['percentage']:
+            return float(params['percentage']) == 100.0
+        want_w = int(params['width']) if params['width'] else None
+        want_h = int(params['height']) if params['height'] else None
+    except ValueError:
+        return False
+    if want_w and want_h:
+        if params['keep_ratio']:
+            return width <= want_w and height <= want_h
+        return (width, height) == (want_w, want_h)
+    if want_w:
+        return width == want_w
+    if want_h:
+        return height == want_h
+    return True
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst (same filesystem), falling back to a copy. Returns the method used."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        shutil.copy2(src, dst)
+        return 'copy'
+
+
+def convert_file(filepath, output_path, params, log_prefix='', job_id=None, header=None, image_type=None,
+                 trace=None, temp_dir=None):
+    """Decode special formats, build and run the ImageMagick command for one file.
+    Inputs that already satisfy the request are hardlinked or copied instead (see
+    is_noop_conversion); header / image_type can carry cached probe results.
+    Animated inputs go through convert_animation(), PDFs and multi-page TIFFs through
+    convert_pages(). With the AUTO format the output extension is decided by convert_auto();
+    with max_size_kb the quality is searched by convert_to_size(). trace, a dict, collects
+    per-file details (animation frames, pages); temp_dir is where decoder temps go.
+    Returns (output_path, method), method being 'hardlink', 'copy', 'magick', 'animation',
+    'pages:<N>', 'auto:<FORMAT>' or 'size:q<QUALITY>'. For pages written one file each,
+    output_path is the directory holding them.
+    Raises ValueError if no safe command can be built, RuntimeError if conversion fails."""
+    fname = os.path.basename(filepath)
+    source = secure_path(filepath)
+    header = header or (probe_header(source) if source else {})
+    multi_frame = header.get('frames', 1) > 1
+    animated = multi_frame and header.get('format') in ('GIF', 'WEBP', 'PNG')
+    in_ext = os.path.splitext(filepath)[1].lower()
+    paged = in_ext == '.pdf' or (multi_frame and in_ext in MULTIPAGE_EXTENSIONS)
+    if (animated or paged) and params['output_format'] == AUTO_FORMAT:
+        output_path = os.path.splitext(output_path)[0] + SEQUENCE_AUTO_EXTENSION
+    if paged or (animated and os.path.splitext(output_path)[1].lower() in ANIMATED_OUTPUT_EXTENSIONS):
+        if secure_path(output_path) and is_noop_conversion(source, output_path, params, header):
+            method = link_or_copy(source, output_path)
+            app.logger.info(f"{log_prefix}{fname} already matches the request: {method} instead of re-encoding")
+            return output_path, method
+        if paged:
+            return convert_pages(source, output_path, params, header, log_prefix, job_id, trace)
+        return convert_animation(source, output_path, params, header, log_prefix, job_id, trace)
+    if params['output_format'] == AUTO_FORMAT:
+        return convert_auto(filepath, output_path, params, log_prefix, job_id, image_type, temp_dir)
+    if params.get('max_size_kb') and os.path.splitext(output_path)[1].lower() in SIZE_TARGET_EXTENSIONS:
+        return convert_to_size(filepath, output_path, params, log_prefix, job_id, temp_dir)
+    if source and secure_path(output_path) and is_noop_conversion(source, output_path, params, header):
+        method = link_or_copy(source, output_path)
+        app.logger.info(f"{log_prefix}{fname} already matches the request: {method} instead of re-encoding")
+        return output_path, method
+
+    input_path, tmp_path = prepare_input_file(filepath, job_id=job_id, temp_dir=temp_dir)
+    try:
+        input_options = large_image_options(input_path, params, header if input_path == filepath else None)
+        if input_options:
+            app.logger.info(f"{log_prefix}{fname} is over {LARGE_IMAGE_PIXELS / 1e6:.0f} MP: "
+                            f"disk-backed pixel cache")
+        command = build_imagemagick_command(
+            filepath=input_path,
+            output_path=output_path,
+            width=params['width'],
+            height=params['height'],
+            percentage=params['percentage'],
+            quality=params['quality'],
+            keep_ratio=params['keep_ratio'],
+            auto_level=params['auto_level'],
+            auto_gamma=params['auto_gamma'],
+            use_1080p=params['use_1080p'],
+            use_1920p=params['use_1920p'],
+            use_sharpen=params['use_sharpen'],
+            sharpen_level=params['sharpen_level'],
+            encoder_speed=params.get('encoder_speed', ''),
+            input_options=input_options,
+        )
+        if not command:
+            raise ValueError(f"Could not build ImageMagick command for {fname}")
+
+        app.logger.info(f"{log_prefix}Executing: {' '.join(command)}")
+        run_encode(command, output_path, params, job_id=job_id,
+                   timeout=LARGE_IMAGE_TIMEOUT if input_options else CONVERSION_TIMEOUT)
+        return output_path, 'magick'
+    except subprocess.CalledProcessError as e:
+        log_magick_error(log_prefix, fname, e, job_id)
+        raise RuntimeError(f"Image processing failed for {fname}")
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Image processing timed out for {fname}")
+    finally:
+        if tmp_path and is_valid_tmp_path(tmp_path) and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+            expiry_index.forget(tmp_path)
+
+
+def convert_animation(filepath, output_path, params, header, log_prefix='', job_id=None, trace=None):
+    """Animated GIF / WEBP / APNG input to an animated output. Frames are coalesced,
+    consecutive duplicates dropped (their delays merged), resized and filtered, then
+    re-optimized for the output: a shared palette and transparent changed-region frames
+    for GIF, changed-region frames elsewhere. Frame pixels count towards large-image mode,
+    so long animations spill to the disk pixel cache instead of RAM.
+    Frame counts and the encode time go into trace. Returns (output_path, 'animation')."""
+    fname = os.path.basename(filepath)
+    input_options = large_image_options(filepath, params, header)
+    command = build_imagemagick_command(
+        filepath=filepath,
+        output_path=output_path,
+        width=params['width'],
+        height=params['height'],
+        percentage=params['percentage'],
+        quality=params['quality'],
+        keep_ratio=params['keep_ratio'],
+        auto_level=params['auto_level'],
+        auto_gamma=params['auto_gamma'],
+        use_1080p=params['use_1080p'],
+        use_1920p=params['use_1920p'],
+        use_sharpen=params['use_sharpen'],
+        sharpen_level=params['sharpen_level'],
+        encoder_speed=params.get('encoder_speed', ''),
+        input_options=input_options,
+        animation=True,
+    )
+    if not command:
+        raise ValueError(f"Could not build ImageMagick command for {fname}")
+
+    app.logger.info(f"{log_prefix}Executing: {' '.join(command)}")
+    started = time.monotonic()
+    try:
+        run_command(command, job_id=job_id, timeout=LARGE_IMAGE_TIMEOUT if input_options else CONVERSION_TIMEOUT)
+        encode_seconds = time.monotonic() - started
+        result = run_command(['magick', 'identify', '-ping', '-format', '%n\n', output_path],
+                             job_id=job_id, timeout=60)
+    except subprocess.CalledProcessError as e:
+        log_magick_error(log_prefix, fname, e, job_id)
+        raise RuntimeError(f"Image processing failed for {fname}")
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Image processing timed out for {fname}")
+
+    counts = result.stdout.split()
+    frames_out = int(counts[0]) if counts and counts[0].isdigit() else None
+    app.logger.info(f"{log_prefix}{fname}: {header['frames']} frames -> {frames_out} in {encode_seconds:.2f}s")
+    if trace is not None:
+        trace.update({'frames': header['frames'], 'frames_out': frames_out,
+                      'encode_seconds': round(encode_seconds, 3)})
+    return output_path, 'animation'
+
+
+def pdf_density(filepath, params, job_id=None):
+    """Page count of a PDF and the density to rasterize it at: PDF_DENSITY, scaled so the
+    first page comes out at the requested output size (1920p, width, percentage, ...)
+    and no larger. Returns (pages, dpi)."""
+    result = run_command(['magick', 'identify', '-ping', '-format', '%n %w %h\n', filepath],
+                         job_id=job_id, timeout=60)
+    pages, width_pt, height_pt = (int(v) for v in result.stdout.split('\n', 1)[0].split())
+    scale = _resize_scale(width_pt * PDF_DENSITY / 72, height_pt * PDF_DENSITY / 72, params) or 1.0
+    low, high = PDF_DENSITY_RANGE
+    return pages, int(min(high, max(low, round(PDF_DENSITY * scale))))
+
+
+def convert_pages(filepath, output_path, params, header, log_prefix='', job_id=None, trace=None):
+    """PDF or multi-page TIFF input. The pages are split into ranges of PAGES_PER_RANGE,
+    converted in parallel (one ImageMagick process per range, as many at once as the
+    worker's thread allowance), then either reassembled into output_path when its format
+    holds pages (PDF, TIFF) or written one file per page into a directory named after
+    output_path's stem (page-001.jpg, ...). A single-page PDF is written to output_path.
+    PDFs are rasterized at pdf_density().
+    Returns (output_path or the page directory, 'pages:<N>')."""
+    fname = os.path.basename(filepath)
+    out_stem, out_ext = os.path.splitext(output_path)
+    assemble = out_ext.lower() in MULTIPAGE_OUTPUT_EXTENSIONS
+    try:
+        if filepath.lower().endswith('.pdf'):
+            pages, density = pdf_density(filepath, params, job_id)
+            input_options = ['-density', str(density)]
+        else:
+            pages, density = header['frames'], None
+            input_options = large_image_options(filepath, params, {**header, 'frames': PAGES_PER_RANGE})
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError):
+        raise RuntimeError(f"Could not read the pages of {fname}")
+    ranges = [(first, min(first + PAGES_PER_RANGE, pages) - 1) for first in range(0, pages, PAGES_PER_RANGE)]
+    per_page = not assemble and pages > 1
+
+    if assemble:
+        targets = [f'{out_stem}.part{i:04d}.miff' for i in range(len(ranges))]
+    elif not per_page:
+        targets = [output_path]
+    else:
+        shutil.rmtree(out_stem, ignore_errors=True)
+        os.makedirs(out_stem)
+        targets = [os.path.join(out_stem, f'page-%03d{out_ext}')] * len(ranges)
+
+    commands = []
+    for (first, last), target in zip(ranges, targets):
+        command = build_imagemagick_command(
+            filepath=f'{filepath}[{first}-{last}]',
+            output_path=target,
+            width=params['width'],
+            height=params['height'],
+            percentage=params['percentage'],
+            quality='' if assemble else params['quality'],
+            keep_ratio=params['keep_ratio'],
+            auto_level=params['auto_level'],
+            auto_gamma=params['auto_gamma'],
+            use_1080p=params['use_1080p'],
+            use_1920p=params['use_1920p'],
+            use_sharpen=params['use_sharpen'],
+            sharpen_level=params['sharpen_level'],
+            encoder_speed=params.get('encoder_speed', ''),
+            input_options=input_options,
+        )
+        if not command:
+            raise ValueError(f"Could not build ImageMagick command for {fname}")
+        if per_page:
+            # Page files are numbered from 1 across all ranges
+            command[-1:-1] = ['-scene', str(first + 1)]
+        commands.append(command)
+
+    started = time.monotonic()
+    timeout = LARGE_IMAGE_TIMEOUT if input_options and not density else CONVERSION_TIMEOUT
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(commands), magick_threads())),
+                                thread_name_prefix='imaguick-pages') as pool:
+            for future in [pool.submit(run_command, command, job_id, timeout) for command in commands]:
+                future.result()
+        if assemble:
+            command = ['magick', *targets]
+            if params['quality'] and params['quality'] != '100':
+                command.extend(['-quality', params['quality']])
+            run_command(command + [output_path], job_id=job_id, timeout=CONVERSION_TIMEOUT)
+    except subprocess.CalledProcessError as e:
+        log_magick_error(log_prefix, fname, e, job_id)
+        raise RuntimeError(f"Image processing failed for {fname}")
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Image processing timed out for {fname}")
+    finally:
+        if assemble:
+            for target in targets:
+                if os.path.exists(target):
+                    os.remove(target)
+
+    elapsed = time.monotonic() - started
+    app.logger.info(f"{log_prefix}{fname}: {pages} pages in {len(ranges)} ranges, {elapsed:.2f}s"
+                    + (f" at {density} dpi" if density else ''))
+    if trace is not None:
+        trace.update({'pages': pages, 'ranges': len(ranges), 'encode_seconds': round(elapsed, 3)})
+        if density:
+            trace['density'] = density
+    return (out_stem if per_page else output_path), f'pages:{pages}'
+
+
+def render_reference(filepath, stem, params, log_prefix='', job_id=None, temp_dir=None):
+    """Decode the input once and apply the requested resize / filters into an MPC file:
+    ImageMagick's raw pixel cache, which later commands memory-map instead of decoding.
+    Every re-encode (AUTO candidates, size search) starts from it. Returns its path."""
+    reference = f'{stem}.ref.mpc'
+    convert_file(filepath, reference, {**params, 'output_format': '', 'quality': '100', 'max_size_kb': None},
+                 log_prefix, job_id, temp_dir=temp_dir)
+    return reference
+
+
+def remove_reference(reference):
+    """Delete an MPC reference and its .cache pixel file."""
+    for path in (reference, os.path.splitext(reference)[0] + '.cache'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def encode_reference(reference, output_path, quality, params, job_id=None, timeout=CONVERSION_TIMEOUT):
+    """Encode an MPC reference at one quality, with the encoder options from params.
+    Returns the output size in bytes."""
+    command = build_imagemagick_command(reference, output_path, width='', height='', percentage='',
+                                        quality=quality, keep_ratio=False,
+                                        encoder_speed=params.get('encoder_speed', ''))
+    if not command:
+        raise ValueError(f"Could not build command for {os.path.basename(output_path)}")
+    run_encode(command, output_path, {**params, 'quality': quality}, job_id=job_id, timeout=timeout)
+    return os.path.getsize(output_path)
+
+
+def convert_to_size(filepath, output_path, params, log_prefix='', job_id=None, temp_dir=None):
+    """Encode at the highest quality whose output fits in params['max_size_kb'].
+
+    The input is decoded once (render_reference); the search then only re-encodes. Output
+    size is modelled as exponential in quality: each step fits log(size) linearly between
+    the closest encodes on either side of the target and jumps to the predicted quality
+    (bisection after a single miss, extrapolation after two), so most files converge in 3-5 encodes.
+    If even the lowest quality is too large, that smallest encode is kept and logged.
+    Returns (output_path, 'size:q<QUALITY>')."""
+    fname = os.path.basename(filepath)
+    target = params['max_size_kb'] * 1024
+    stem, ext = os.path.splitext(output_path)
+    low, high = SIZE_TARGET_QUALITY_RANGE
+    if params['quality'] and params['quality'].isdigit() and 0 < int(params['quality']) < 100:
+        high = max(low, int(params['quality']))
+
+    reference = render_reference(filepath, stem, params, log_prefix, job_id, temp_dir)
+    sizes = {}
+
+    def encode(quality):
+        sizes[quality] = encode_reference(reference, f'{stem}.q{quality}{ext}', str(quality), params, job_id)
+        return sizes[quality]
+
+    try:
+        fits, too_big = None, None      # best quality known to fit / lowest known not to
+        quality = high
+        for _ in range(SIZE_TARGET_MAX_ENCODES):
+            if encode(quality) <= target:
+                fits = quality
+            else:
+                too_big = quality
+            if fits == high or too_big == low or (fits is not None and too_big is not None and too_big - fits <= 1):
+                break
+            if fits is not None and too_big is not None:
+                # log-linear interpolation inside the bracket, kept strictly inside it
+                span = (math.log(target) - math.log(sizes[fits])) / (math.log(sizes[too_big]) - math.log(sizes[fits]))
+                quality = min(too_big - 1, max(fits + 1, round(fits + span * (too_big - fits))))
+            elif too_big is not None and len(sizes) > 1:
+                # both encodes too large: extrapolate the slope they give, towards `low`
+                above = sorted(sizes)[1]
+                slope = (math.log(sizes[above]) - math.log(sizes[too_big])) / (above - too_big)
+                step = (math.log(target) - math.log(sizes[too_big])) / slope if slope > 0 else -too_big
+                quality = min(too_big - 1, max(low, round(too_big + step)))
+            elif too_big is not None:
+                quality = (low + too_big) // 2
             else:
-                output_filename = f'{os.path.splitext(fname)[0]}_imaGUIck{os.path.splitext(fname)[1]}'
-            output_path = os.path.join(batch_folder, output_filename)
+                break
+        chosen = fits if fits is not None else min(sizes)
+        if fits is None:
+            app.logger.warning(f"{log_prefix}{fname}: {sizes[chosen] // 1024} KB at quality {chosen} "
+                               f"is still over the {params['max_size_kb']} KB target")
+        os.replace(f'{stem}.q{chosen}{ext}', output_path)
+        app.logger.info(f"{log_prefix}{fname}: quality {chosen} -> {sizes[chosen] // 1024} KB "
+                        f"(target {params['max_size_kb']} KB, {len(sizes)} encodes)")
+        return output_path, f'size:q{chosen}'
+    except subprocess.CalledProcessError as e:
+        log_magick_error(log_prefix, fname, e, job_id)
+        raise RuntimeError(f"Image processing failed for {fname}")
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Image processing timed out for {fname}")
+    finally:
+        remove_reference(reference)
+        for quality in sizes:
+            if os.path.exists(f'{stem}.q{quality}{ext}'):
+                os.remove(f'{stem}.q{quality}{ext}')
+
+
+def _encode_candidate(reference, candidate_path, output_format, params, deadline, job_id=None, threads=1):
+    """Encode one AUTO candidate from the reference and score it, with threads ImageMagick
+    threads (pool threads don't inherit the worker's allowance). Returns (bytes, DSSIM or None)."""
+    worker_state.threads = threads
+    size = encode_reference(reference, candidate_path, AUTO_QUALITY[output_format], params, job_id,
+                            timeout=max(0.1, deadline - time.monotonic()))
+    try:
+        # compare exits 1 when the images differ at all; the metric is printed on stderr either way
+        result = run_command(['magick', 'compare', '-metric', 'DSSIM', reference, candidate_path, 'null:'],
+                             job_id=job_id, timeout=max(0.1, deadline - time.monotonic()))
+        report = result.stderr
+    except subprocess.CalledProcessError as e:
+        if e.returncode != 1:
+            raise
+        report = e.stderr
+    match = re.match(r'\s*([0-9.eE+-]+)', report or '')
+    return size, float(match.group(1)) if match else None
+
+
+def convert_auto(filepath, output_path, params, log_prefix='', job_id=None, image_type=None, temp_dir=None):
+    """AUTO output format. The requested resize / filters are rendered once to a lossless
+    MPC reference; the candidate formats for the image type are then encoded from it
+    concurrently, as many at a time as the worker's thread allowance covers, each scored
+    against it (DSSIM), and the smallest candidate within AUTO_MAX_DSSIM wins. Encoders still running when AUTO_TIME_BUDGET runs out are killed
+    and dropped, so slow AVIF encodes cannot stall a batch.
+    output_path's extension is replaced by the winner's. Returns (output_path, 'auto:<FORMAT>')."""
+    fname = os.path.basename(filepath)
+    stem = os.path.splitext(output_path)[0]
+    image_type = image_type or analyze_image_type(filepath) or {}
+    photo = image_type.get('is_photo') and not image_type.get('has_transparency')
+    candidates = AUTO_CANDIDATES_PHOTO if photo else AUTO_CANDIDATES_GRAPHIC
+
+    reference = render_reference(filepath, stem, params, log_prefix, job_id, temp_dir)
+    results = {}
+    try:
+        deadline = time.monotonic() + AUTO_TIME_BUDGET
+        threads = magick_threads()
+        pool_size = max(1, min(len(candidates), threads))
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='imaguick-auto') as pool:
+            futures = {
+                pool.submit(_encode_candidate, reference, f'{stem}.auto-{fmt.lower()}{AUTO_EXTENSIONS[fmt]}',
+                            fmt, params, deadline, job_id, threads // pool_size): fmt
+                for fmt in candidates
+            }
+            for future in as_completed(futures):
+                fmt = futures[future]
+                try:
+                    results[fmt] = future.result()
+                except subprocess.TimeoutExpired:
+                    app.logger.info(f"{log_prefix}AUTO {fname}: {fmt} dropped, over the {AUTO_TIME_BUDGET:g}s budget")
+                except (subprocess.CalledProcessError, ValueError, OSError) as e:
+                    if not conversion_cancelled(job_id):
+                        app.logger.warning(f"{log_prefix}AUTO {fname}: {fmt} failed: {e}")
+    finally:
+        remove_reference(reference)
 
-            input_path, tmp_path = prepare_input_file(filepath)
-            try:
-                command = build_imagemagick_command(
-                    filepath=input_path,
-                    output_path=output_path,
-                    width=params['width'],
-                    height=params['height'],
-                    percentage=params['percentage'],
-                    quality=params['quality'],
-                    keep_ratio=params['keep_ratio'],
-                    auto_level=params['auto_level'],
-                    auto_gamma=params['auto_gamma'],
-                    use_1080p=params['use_1080p'],
-                    use_1920p=params['use_1920p'],
-                    use_sharpen=params['use_sharpen'],
-                    sharpen_level=params['sharpen_level'],
-                )
-                if not command:
-                    raise RuntimeError(f"Could not build ImageMagick command for {fname}")
-
-                app.logger.info(f"[Job {job_id}] Executing: {' '.join(command)}")
-                subprocess.run(command, check=True, capture_output=True, text=True, timeout=300)
-            except subprocess.CalledProcessError as e:
-                app.logger.error(f"[Job {job_id}] ImageMagick error for {fname}: {e.stderr}")
-                raise RuntimeError(f"Image processing failed for {fname}")
-            finally:
-                if tmp_path and os.path.exists(tmp_path):
-                    os.remove(tmp_path)
+    try:
+        if not results:
+            raise RuntimeError(f"Image processing failed for {fname}: no AUTO candidate finished")
+        passing = [fmt for fmt, (_, dssim) in results.items() if dssim is None or dssim <= AUTO_MAX_DSSIM]
+        if passing:
+            winner = min(passing, key=lambda fmt: results[fmt][0])
+        else:
+            # Nothing met the target: keep the most faithful encode rather than the smallest
+            winner = min(results, key=lambda fmt: results[fmt][1])
+        final_path = stem + AUTO_EXTENSIONS[winner]
+        os.replace(f'{stem}.auto-{winner.lower()}{AUTO_EXTENSIONS[winner]}', final_path)
+        summary = ', '.join(f"{fmt} {size // 1024} KB (DSSIM {dssim if dssim is None else round(dssim, 4)})"
+                            for fmt, (size, dssim) in sorted(results.items()))
+        app.logger.info(f"{log_prefix}AUTO {fname}: kept {winner} — {summary}")
+        return final_path, f'auto:{winner}'
+    finally:
+        for fmt in candidates:
+            leftover = f'{stem}.auto-{fmt.lower()}{AUTO_EXTENSIONS[fmt]}'
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def claim_output_stem(job, file_info):
+    """Output name (without extension) of a batch entry, unique within its job: archive
+    members from different folders (a/x.png, b/x.png) and repeated uploads share a basename,
+    and would overwrite each other's output. Later ones get '-2', '-3'... Names are compared
+    case-insensitively, as the ZIP may be unpacked on a case-insensitive filesystem.
+    A retried entry keeps its name. Caller holds jobs_lock."""
+    if 'output_stem' not in file_info:
+        base = f"{os.path.splitext(file_info['original'])[0]}_imaGUIck"
+        stem, count = base, 1
+        while stem.lower() in job['output_stems']:
+            count += 1
+            stem = f'{base}-{count}'
+        job['output_stems'].add(stem.lower())
+        file_info['output_stem'] = stem
+    return file_info['output_stem']
+
+
+def process_single_file(job_id, file_info, params, batch_folder):
+    """Process one file within a batch job. Runs on a scheduler worker (batch lane)."""
+    with jobs_lock:
+        job = jobs[job_id]
+        if job.get('cancelled'):
+            return
+        file_info['status'] = 'processing'
+        output_stem = claim_output_stem(job, file_info)
+
+    filepath = file_info['path']
+    fname = file_info['original']
+    started = time.monotonic()
+
+    shortfall = None
+    if file_info.get('prescaled') and file_info.get('header'):
+        shortfall = prescale_shortfall(params, file_info['header'], file_info['prescaled'])
+    if shortfall:
+        with jobs_lock:
+            release_megapixels(job, file_info)
+            file_info['status'] = 'error'
+            file_info['error'] = shortfall
+            job['errors'] += 1
+        app.logger.warning(f"[Job {job_id}] {fname}: {shortfall}")
+        return
+
+    try:
+        output_format = params['output_format']
+        if output_format:
+            output_filename = f'{output_stem}.{output_format.lower()}'
+        else:
+            output_filename = f'{output_stem}{os.path.splitext(fname)[1]}'
+        output_path = os.path.join(batch_folder, output_filename)
+
+        trace = {}
+        if file_info.get('prescaled') and file_info.get('header'):
+            # Shrunk by the browser: no resize step for the size presets it already fits
+            params = without_fitting_presets(params, file_info['header'])
+            trace['prescaled'] = file_info['prescaled']
+        output_path, method = convert_file(filepath, output_path, params, log_prefix=f"[Job {job_id}] ",
+                                           job_id=job_id, header=file_info.get('header'),
+                                           image_type=file_info.get('image_type'), trace=trace,
+                                           temp_dir=os.path.join(job_dir(job_id), 'tmp'))
+        storage.save(output_path)
+
+        # Clean up source file after successful processing
+        try:
+            src = secure_path(filepath)
+            if src and os.path.exists(src):
+                os.remove(src)
+        except Exception:
+            pass
 
-            # Clean up source file after successful processing
+        with jobs_lock:
+            file_info['status'] = 'done'
+            file_info['output'] = output_path
+            file_info['method'] = method
+            file_info['trace'] = {'seconds': round(time.monotonic() - started, 3), **trace}
+            jobs[job_id]['done'] += 1
+            release_megapixels(jobs[job_id], file_info, time.monotonic() - started)
+
+    except Exception as e:
+        with jobs_lock:
+            release_megapixels(job, file_info)
+            if job.get('cancelled'):
+                file_info['status'] = 'cancelled'
+                return
+            file_info['status'] = 'error'
+            file_info['error'] = 'Processing error'
+            job['errors'] += 1
+        app.logger.error(f"[Job {job_id}] Error processing {fname}: {e}")
+
+
+def save_uploaded_file(file):
+    """Validate and store one uploaded FileStorage in the upload folder.
+    Returns (unique_name, None) on success or (None, error_message)."""
+    if not allowed_file(file.filename):
+        return None, f"Unsupported format: {secure_filename(file.filename)}"
+    unique_name = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    filepath = upload_path(unique_name, create=True)
+    file.save(filepath)
+    # Per-file size check after saving
+    if os.path.getsize(filepath) > PER_FILE_MAX_SIZE:
+        os.remove(filepath)
+        return None, (
+            f"{secure_filename(file.filename)} exceeds the per-file limit of "
+            f"{PER_FILE_MAX_SIZE // 1024 // 1024} MB"
+        )
+    try:
+        storage.save(filepath)
+    except StorageError as e:
+        os.remove(filepath)
+        app.logger.error(f"Upload not stored: {e}")
+        return None, f"{secure_filename(file.filename)} could not be stored, please retry"
+    expiry_index.track(filepath)
+    return unique_name, None
+
+
+def store_uploaded_files(files):
+    """Save uploaded FileStorages, unpacking archives into their images.
+    Returns (stored filenames, error messages)."""
+    stored, errors = [], []
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if is_archive(file.filename):
+            # Werkzeug spools request files to disk, so the stream can be sized and seeked
+            file.stream.seek(0, os.SEEK_END)
+            archive_size = file.stream.tell()
+            file.stream.seek(0)
+            extracted, archive_errors = extract_archive(file.stream, file.filename, archive_size)
+            stored.extend(extracted)
+            errors.extend(archive_errors)
+            continue
+        unique_name, error = save_uploaded_file(file)
+        if error:
+            errors.append(error)
+        else:
+            stored.append(unique_name)
+    return stored, errors
+
+
+def is_archive(filename):
+    """True for the ZIP/TAR containers accepted alongside images."""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _zip_members(fileobj):
+    """(path, size, compressed size, opener) for each file in a ZIP; opener is None for
+    encrypted members. Needs a seekable file."""
+    with ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if info.flag_bits & 0x1:
+                yield info.filename, info.file_size, info.compress_size, None   # encrypted
+                continue
+            yield info.filename, info.file_size, info.compress_size, lambda info=info: zf.open(info)
+
+
+def _tar_members(fileobj):
+    """(path, size, None, opener) for each regular file in a TAR, read strictly front to back
+    (compression auto-detected). Links and device nodes are never extracted."""
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+        for member in tf:
+            if member.isfile():
+                yield member.name, member.size, None, lambda member=member: tf.extractfile(member)
+
+
+def extract_archive(fileobj, archive_name, archive_size):
+    """Unpack a ZIP/TAR archive member by member straight into the upload folder, probing
+    each image as it lands. Non-image members are skipped; members over PER_FILE_MAX_SIZE or
+    expanding more than MAX_COMPRESSION_RATIO times are rejected, and extraction stops at
+    MAX_ARCHIVE_MEMBERS files or once the archive as a whole expands past its budget.
+    Returns (stored filenames, error messages)."""
+    label = secure_filename(os.path.basename(archive_name))
+    stored, errors = [], []
+    budget = min(MAX_ARCHIVE_EXTRACTED_SIZE, max(archive_size, 1) * MAX_COMPRESSION_RATIO)
+    extracted = 0
+    members = _zip_members(fileobj) if archive_name.lower().endswith('.zip') else _tar_members(fileobj)
+    try:
+        for count, (path, size, compressed_size, open_member) in enumerate(members, 1):
+            if count > MAX_ARCHIVE_MEMBERS:
+                errors.append(f"{label}: more than {MAX_ARCHIVE_MEMBERS} files, the rest was skipped")
+                break
+            parts = path.replace('\\', '/').split('/')
+            name = secure_filename(parts[-1])
+            if not name or parts[-1].startswith('.') or '__MACOSX' in parts or not allowed_file(name):
+                continue
+            if open_member is None:
+                errors.append(f"{label}/{name} is encrypted, skipped")
+                continue
+            if size > PER_FILE_MAX_SIZE:
+                errors.append(f"{label}/{name} exceeds the per-file limit of {PER_FILE_MAX_SIZE // 1024 // 1024} MB")
+                continue
+            if compressed_size is not None and size > 1024 * 1024 and size > compressed_size * MAX_COMPRESSION_RATIO:
+                errors.append(f"{label}/{name}: suspicious compression ratio, skipped")
+                continue
+
+            unique_name = f"{uuid.uuid4().hex}_{name}"
+            filepath = upload_path(unique_name, create=True)
+            written = 0
+            # Sizes in the archive headers are only hints: the limits apply to the bytes actually produced
+            with open_member() as src, open(filepath, 'wb') as dst:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > PER_FILE_MAX_SIZE or extracted + written > budget:
+                        break
+                    dst.write(chunk)
+            if extracted + written > budget:
+                os.remove(filepath)
+                errors.append(f"{label}: expands beyond the allowed size, extraction stopped")
+                break
+            if written > PER_FILE_MAX_SIZE:
+                os.remove(filepath)
+                errors.append(f"{label}/{name} exceeds the per-file limit of {PER_FILE_MAX_SIZE // 1024 // 1024} MB")
+                continue
+            extracted += written
             try:
-                src = secure_path(filepath)
-                if src and os.path.exists(src):
-                    os.remove(src)
-            except Exception:
-                pass
+                storage.save(filepath)
+            except StorageError as e:
+                os.remove(filepath)
+                app.logger.error(f"Upload not stored: {e}")
+                errors.append(f"{label}/{name} could not be stored, please retry")
+                continue
+            expiry_index.track(filepath)
+            probe_upload(unique_name, filepath)
+            stored.append(unique_name)
+    except (BadZipFile, tarfile.TarError, ValueError, EOFError, OSError) as e:
+        errors.append(f"{label}: unreadable archive ({e})")
+
+    if not stored and not errors:
+        errors.append(f"{label} contains no supported images")
+    app.logger.info(f"Extracted {len(stored)} image(s) from {label} ({extracted / 1e6:.1f} MB)")
+    return stored, errors
+
+
+def uploads_destination(filenames, preset=None):
+    """Next page for a set of stored uploads: the single-image or batch options page or,
+    with a preset, the progress page of a batch job started right away.
+    Returns (url, None), or (None, admission_decision) when the job was refused."""
+    if preset:
+        job_id, decision = start_job(build_file_list(filenames), PRESETS[preset], client_id())
+        if decision:
+            return None, decision
+        return url_for('job_progress', job_id=job_id), None
+    if len(filenames) == 1:
+        return url_for('resize_options', filename=filenames[0]), None
+    # Store filenames server-side to avoid URL length limit (Gunicorn 4094 chars)
+    upload_key = uuid.uuid4().hex
+    with upload_sessions_lock:
+        upload_sessions[upload_key] = filenames
+    return url_for('resize_batch_options', upload_key=upload_key), None
+
+
+def preset_retry_form(filenames, preset):
+    """Form the queue page re-posts to /resize_batch for a preset batch that was refused."""
+    return MultiDict({'filenames': ','.join(filenames), **PRESETS[preset]})
+
+
+def build_file_list(filenames):
+    """Turn stored upload names into job file entries, dropping anything missing or unsafe."""
+    file_list = []
+    for fname in filenames:
+        fname = secure_filename(os.path.basename(fname))
+        fpath = stored_upload(fname)
+        if fpath:
+            # Strip UUID prefix (32 hex chars + underscore) to restore original filename
+            original_name = re.sub(r'^[a-f0-9]{32}_', '', fname)
+            probe = cached_probe(fname)
+            file_list.append({
+                'original': original_name,
+                'path': fpath,
+                'output': None,
+                'status': 'queued',
+                'error': None,
+                'megapixels': probe.get('megapixels') or estimate_megapixels(fpath),
+                'header': probe.get('header'),
+                'image_type': probe.get('image_type'),
+                'prescaled': probe.get('prescaled'),
+            })
+    return file_list
 
-            with jobs_lock:
-                file_info['status'] = 'done'
-                file_info['output'] = output_path
-                jobs[job_id]['done'] += 1
 
-        except Exception as e:
-            app.logger.error(f"[Job {job_id}] Error processing {fname}: {e}")
+def attach_upload_to_job(job_id, filename, reserved=False):
+    """Queue a finished upload on an open job so it converts while the rest are still uploading.
+    reserved: the upload holds one of the job's pending_uploads (see reserve_job_upload),
+    released here, and is accepted even if the job was closed in the meantime.
+    Returns an error message, or None once attached."""
+    global queued_megapixels
+    entries = build_file_list([filename])
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job and reserved:
+            job['pending_uploads'] -= 1
+            jobs_changed.notify_all()
+        if not job or not (job.get('open') or reserved) or job.get('cancelled'):
+            return 'Job is not accepting files'
+        if not entries:
+            return 'Upload not found'
+        move_into_job(job_id, entries)
+        # Admitted with the job: account for the file's work without a second admission check
+        queued_megapixels += entries[0]['megapixels']
+        job['remaining_mp'] += entries[0]['megapixels']
+        job['files'].append(entries[0])
+        job['total'] += 1
+        job['last_seen'] = time.time()
+        jobs_changed.notify_all()
+    return None
+
+
+def reserve_job_upload(job_id):
+    """Hold an open job for a finished upload that is still being probed: the job waits
+    for it even if it is closed first. Returns an error message, or None once reserved."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job or not job.get('open') or job.get('cancelled'):
+            return 'Job is not accepting files'
+        job['pending_uploads'] += 1
+    return None
+
+
+def probe_and_attach(upload_id, job_id, filename, filepath, prescaled=None):
+    """Batch-lane task for a finished upload: probe it, then queue it on its job (if any).
+    Attaching only after the probe means the file is still where the probe reads it,
+    and the job's entry carries the probe's results (prescaled)."""
+    try:
+        probe_upload(filename, filepath, prescaled)
+    except Exception as e:
+        app.logger.warning(f"Could not probe upload {filename}: {e}")
+    if job_id:
+        error = attach_upload_to_job(job_id, filename, reserved=True)
+        if error:
+            app.logger.warning(f"Upload {upload_id} not attached to job {job_id}: {error}")
+            expiry_index.track(filepath)
+
+
+def move_into_job(job_id, file_list):
+    """Move the sources of job entries from the upload shards into the job's in/ directory
+    (a rename on the same volume), so the job's whole tree lives and expires together."""
+    in_dir = os.path.join(job_dir(job_id), 'in')
+    os.makedirs(in_dir, exist_ok=True)
+    for entry in file_list:
+        target = os.path.join(in_dir, os.path.basename(entry['path']))
+        try:
+            os.replace(entry['path'], target)
+        except OSError as e:
+            app.logger.warning(f"[Job {job_id}] Could not move {entry['original']} into the job: {e}")
+            continue
+        expiry_index.forget(entry['path'])
+        entry['path'] = target
+
+
+def close_job(job_id):
+    """Stop an open job from accepting files; it finishes once the queued ones are done."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job or not job.get('open'):
+            return False
+        job['open'] = False
+        jobs_changed.notify_all()
+    return True
+
+
+def retry_job(job_id, form=None):
+    """Requeue only the failed files of a completed job, with the settings of form if
+    given (otherwise the job's own). Their sources are still in the job's in/ directory: only successful
+    files delete theirs. Outputs that already succeeded are kept, and the retry's
+    outputs are appended to the existing archive.
+    Returns (files requeued, None) or (0, admission_decision); raises ValueError when
+    the job cannot be retried."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job:
+            raise ValueError('Job not found')
+        if job.get('status') != 'complete':
+            raise ValueError('Job was cancelled' if job.get('status') == 'cancelled' else 'Job still processing')
+        failed = [fi for fi in job['files'] if fi['status'] == 'error' and os.path.exists(fi['path'])]
+        if not failed:
+            raise ValueError('No failed files left to retry')
+        retry_mp = sum(fi['megapixels'] for fi in failed)
+        decision = admit_job(job['client'], retry_mp)
+        if decision:
+            return 0, decision
+        for fi in failed:
+            fi.update(status='queued', error=None, output=None, trace=None)
+        job['errors'] -= len(failed)
+        job['remaining_mp'] += retry_mp
+        if form is not None:
+            job['form'] = form
+            job['params'] = extract_processing_params(form)
+        job['status'] = 'processing'
+        job['retries'] = job.get('retries', 0) + 1
+        job['last_seen'] = time.time()
+        job.pop('finished_at', None)
+
+    # Pinned again until the retry finishes, like a new job
+    expiry_index.pin_job(job_id, job['job_dir'])
+    threading.Thread(target=process_job, args=(job_id, failed), daemon=True).start()
+    app.logger.info(f"Job {job_id}: retrying {len(failed)} failed file(s)")
+    return len(failed), None
+
+
+def start_job(file_list, form, client, open_job=False):
+    """Admit and launch a batch job processed with the settings of form (request fields,
+    as extract_processing_params reads them). Returns (job_id, None) or (None, admission_decision).
+    An open job starts with whatever files it has and keeps waiting for more until close_job()."""
+    params = extract_processing_params(form)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    job_id = uuid.uuid4().hex
+    work_dir = job_dir(job_id)
+    batch_folder = os.path.join(work_dir, 'out')
+    batch_mp = sum(f['megapixels'] for f in file_list)
+    with jobs_lock:
+        decision = admit_job(client, batch_mp)
+        if decision:
+            app.logger.warning(f"Rejected batch from {client} ({batch_mp:.1f} MP): {decision['reason']}")
+            return None, decision
+        jobs[job_id] = {
+            'files': file_list,
+            'form': dict(form),
+            'params': params,
+            'job_dir': work_dir,
+            'batch_folder': batch_folder,
+            'timestamp': timestamp,
+            'zip': None,
+            'total': len(file_list),
+            'done': 0,
+            'errors': 0,
+            'status': 'processing',
+            'client': client,
+            'remaining_mp': batch_mp,
+            'futures': [],
+            'cancelled': False,
+            'open': open_job,
+            'pending_uploads': 0,
+            'output_stems': set(),
+            'last_seen': time.time(),
+        }
+
+    os.makedirs(batch_folder, exist_ok=True)
+    # Pinned until process_job() finishes: cleanup never removes a running job's files
+    expiry_index.pin_job(job_id, work_dir)
+    move_into_job(job_id, file_list)
+    t = threading.Thread(target=process_job, args=(job_id,), daemon=True)
+    t.start()
+    return job_id, None
+
+
+def job_status_payload(job):
+    """Status snapshot shared by the SSE stream and the JSON API. Caller holds jobs_lock."""
+    return {
+        'total': job['total'],
+        'done': job['done'],
+        'errors': job['errors'],
+        'retries': job.get('retries', 0),
+        'files': [
+            {
+                'name': f['original'],
+                'status': f['status'],
+                'error': f.get('error'),
+                'trace': f.get('trace')
+            }
+            for f in job['files']
+        ],
+        'zip': job.get('zip'),
+        'cancelled': job.get('cancelled', False),
+        'complete': job.get('status') in FINISHED_JOB_STATUSES
+    }
+
+
+def stream_job_status(job_id):
+    """SSE response emitting job_status_payload() every 0.5 s until the job finishes."""
+    def generate():
+        while True:
             with jobs_lock:
-                file_info['status'] = 'error'
-                file_info['error'] = 'Processing error'
-                jobs[job_id]['errors'] += 1
+                job = jobs.get(job_id)
+                if not job:
+                    yield 'data: {"error": "job not found"}\n\n'
+                    return
+                job['last_seen'] = time.time()
+                payload = job_status_payload(job)
+            yield f'data: {json.dumps(payload)}\n\n'
+            if payload['complete']:
+                return
+            time.sleep(0.5)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def cached_probe(filename):
+    """Probe result recorded when an upload was stored, or {} if there is none (yet)."""
+    with upload_sessions_lock:
+        entry = upload_probes.get(filename)
+    return entry[0] if entry else {}
+
+
+def probe_upload(filename, filepath, prescaled=None):
+    """Header-level probe of a freshly stored upload, so the options page and
+    admission don't have to re-read every file when the batch is submitted.
+    prescaled describes an upload the browser downscaled (see create_chunked_upload).
+    Once the header confirms it, the probe records its edge and the upload is counted
+    in prescale_stats."""
+    probe = {'megapixels': estimate_megapixels(filepath), 'image_type': analyze_image_type(filepath),
+             'header': probe_header(filepath)}
+    header = probe['header']
+    now = time.time()
+    if prescaled and header and max(header['width'], header['height']) <= prescaled['max_edge']:
+        probe['prescaled'] = prescaled['max_edge']
+        with upload_sessions_lock:
+            prescale_stats['files'] += 1
+            prescale_stats['original_bytes'] += prescaled['original_size']
+            prescale_stats['uploaded_bytes'] += os.path.getsize(filepath)
+    elif prescaled:
+        app.logger.warning(f"{filename} exceeds the {prescaled['max_edge']} px it was prescaled to; "
+                           f"converting it as an original")
+    with upload_sessions_lock:
+        for name in [n for n, (_, created) in upload_probes.items() if now - created > UPLOAD_SESSION_TIMEOUT]:
+            del upload_probes[name]
+        upload_probes[filename] = (probe, now)
+
+
+def preview_paths(filepath):
+    """(thumbnail, proxy) cached next to an upload: a THUMBNAIL_SIZE WEBP for the options
+    pages and a PREVIEW_PROXY_SIZE PNG that live previews are rendered from."""
+    return f'{filepath}.thumb.webp', f'{filepath}.proxy.png'
+
+
+def extract_raw_preview(filepath):
+    """The JPEG a camera embeds in a RAW file, copied to TEMP_FOLDER with the RAW's
+    orientation, or None when there is none. Far cheaper than demosaicing with dcraw."""
+    validated = secure_path(filepath)
+    if not validated:
+        raise ValueError(f"Insecure RAW path: {filepath}")
+    tmp_path = os.path.join(TEMP_FOLDER, f'imaguick_{uuid.uuid4().hex}.jpg')
+    expiry_index.track(tmp_path, max_age=TEMP_MAX_AGE)
+    try:
+        for tag in ('-JpgFromRaw', '-PreviewImage'):
+            with open(tmp_path, 'wb') as out_f:
+                run_command(['exiftool', '-b', tag, validated], timeout=30, stdout=out_f)
+            if os.path.getsize(tmp_path) > 0:
+                run_command(['exiftool', '-q', '-overwrite_original', '-TagsFromFile', validated,
+                             '-Orientation', tmp_path], timeout=30)
+                return tmp_path
+    except Exception as e:
+        app.logger.warning(f"No embedded preview in {filepath}: {e}")
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    expiry_index.forget(tmp_path)
+    return None
+
+
+def make_previews(filepath):
+    """Render an upload's thumbnail and proxy (see preview_paths) from one decode of its
+    first frame or page. JPEGs are decoded at a reduced DCT scale (jpeg:size) and RAW
+    files from their embedded JPEG, so the full-resolution raster is rarely built."""
+    thumb_path, proxy_path = preview_paths(filepath)
+    if os.path.exists(thumb_path) and os.path.exists(proxy_path):
+        return thumb_path, proxy_path
+
+    tmp_path = None
+    if os.path.splitext(filepath)[1].lower() in RAW_FORMATS_DCRAW:
+        tmp_path = extract_raw_preview(filepath)
+    if tmp_path:
+        input_path = tmp_path
+    else:
+        input_path, tmp_path = prepare_input_file(filepath)
+    thumb_part = f'{thumb_path}.{uuid.uuid4().hex}.part'
+    proxy_part = f'{proxy_path}.{uuid.uuid4().hex}.part'
+    expiry_index.track(thumb_part, proxy_part, max_age=TEMP_MAX_AGE)
+    try:
+        fit = {'use_1920p': False, 'use_1080p': False, 'percentage': '',
+               'width': str(PREVIEW_PROXY_SIZE), 'height': str(PREVIEW_PROXY_SIZE)}
+        options = large_image_options(input_path, fit)
+        if not any(o.startswith('jpeg:size=') for o in options):
+            options.extend(['-define', f'jpeg:size={2 * PREVIEW_PROXY_SIZE}x{2 * PREVIEW_PROXY_SIZE}'])
+        run_command(['magick', *options, f'{input_path}[0]', '-auto-orient',
+                     '-thumbnail', f'{PREVIEW_PROXY_SIZE}x{PREVIEW_PROXY_SIZE}>',
+                     '-define', 'png:compression-level=1', '-write', f'PNG:{proxy_part}',
+                     '-thumbnail', f'{THUMBNAIL_SIZE}x{THUMBNAIL_SIZE}>', '-quality', '75',
+                     f'WEBP:{thumb_part}'], timeout=PREVIEW_TIMEOUT)
+        os.replace(proxy_part, proxy_path)
+        os.replace(thumb_part, thumb_path)
+        expiry_index.track(thumb_path, proxy_path)
+    finally:
+        for path in (thumb_part, proxy_part, tmp_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        expiry_index.forget(thumb_part, proxy_part, *([tmp_path] if tmp_path else []))
+    return thumb_path, proxy_path
+
+
+def request_previews(filename, filepath):
+    """Future of make_previews(filepath), queued on the preview lane at most once
+    while it is pending, or already resolved when the previews are cached."""
+    paths = preview_paths(filepath)
+    if all(os.path.exists(p) for p in paths):
+        future = Future()
+        future.set_result(paths)
+        return future
+    with preview_lock:
+        future = preview_futures.get(filepath)
+        if future is None:
+            future = scheduler.submit(LANE_PREVIEW, make_previews, filepath,
+                                      megapixels=cached_probe(filename).get('megapixels', 0.0))
+            preview_futures[filepath] = future
+            future.add_done_callback(lambda _: _forget_preview_future(filepath))
+    return future
+
+
+def _forget_preview_future(filepath):
+    with preview_lock:
+        preview_futures.pop(filepath, None)
+
+
+def upload_previews(filename):
+    """(thumbnail, proxy) of an upload, rendered on first use. The cache outlives the
+    upload itself once a batch has taken it. PREVIEW_PENDING while the render is queued
+    or running (request threads never wait for it), None if there is nothing to render from."""
+    filepath = secure_path(upload_path(filename))
+    if not filepath:
+        return None
+    paths = preview_paths(filepath)
+    if all(os.path.exists(p) for p in paths):
+        return paths
+    if not stored_upload(filename):
+        return None
+    future = request_previews(filename, filepath)
+    if not future.done():
+        return PREVIEW_PENDING
+    try:
+        return future.result()
+    except Exception as e:
+        app.logger.warning(f"No preview for {filename}: {e}")
+        return None
+
+
+def preview_pending_response():
+    """202 asking the page to come back for a preview that is still being rendered."""
+    return Response('Preview is being rendered', status=202,
+                    headers={'Retry-After': str(PREVIEW_RETRY_AFTER), 'Cache-Control': 'no-store'})
+
+
+def render_live_preview(filepath, proxy_path, params):
+    """WEBP bytes of params applied to an upload's preview proxy: the same filters and
+    quality, and the requested resize scaled to the proxy (only ever shrinking it).
+    The proxy bounds the work, so this runs in the request thread instead of waiting
+    for a conversion worker."""
+    header = probe_header(filepath)
+    original = (header.get('width'), header.get('height'))
+    if not all(original):
+        original = get_image_dimensions(filepath)
+    with Image.open(proxy_path) as img:
+        proxy_width, proxy_height = img.size
+    width = height = ''
+    scale = _resize_scale(*original, params) if all(original) else None
+    if scale and original[0] * scale < proxy_width:
+        width = str(max(1, round(original[0] * scale)))
+        height = str(max(1, round(original[1] * scale)))
+
+    output_path = f'{filepath}.{uuid.uuid4().hex}.live.webp'
+    expiry_index.track(output_path, max_age=TEMP_MAX_AGE)
+    try:
+        command = build_imagemagick_command(
+            proxy_path, output_path, width, height, '', params['quality'], True,
+            auto_level=params['auto_level'], auto_gamma=params['auto_gamma'],
+            use_sharpen=params['use_sharpen'], sharpen_level=params['sharpen_level'])
+        if not command:
+            raise ValueError("Invalid preview parameters")
+        run_command(command, timeout=PREVIEW_TIMEOUT)
+        with open(output_path, 'rb') as f:
+            return f.read()
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        expiry_index.forget(output_path)
+
+
+def _chunked_upload_record_path(upload_id):
+    """The record of a resumable upload, kept in the upload shards next to its data."""
+    return upload_path(f'{upload_id}.upload.json')
+
+
+def _save_chunked_upload(upload_id, record):
+    """Write a resumable upload's record to disk, where every Gunicorn worker process finds
+    it: the parallel chunk streams and a resume after a reload can reach any of them.
+    Caller holds upload_sessions_lock."""
+    path = _chunked_upload_record_path(upload_id)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({key: value for key, value in record.items() if key != 'busy'}, f)
+    os.replace(tmp_path, path)
+
+
+def _prune_chunked_uploads(now):
+    """Forget resumable uploads idle for UPLOAD_SESSION_TIMEOUT and delete their partial data.
+    Caller holds upload_sessions_lock."""
+    for upload_id, record in list(chunked_uploads.items()):
+        if now - record['updated'] <= UPLOAD_SESSION_TIMEOUT:
+            continue
+        record_path = _chunked_upload_record_path(upload_id)
+        try:
+            if now - os.path.getmtime(record_path) <= UPLOAD_SESSION_TIMEOUT:
+                continue    # Still receiving chunks through another worker process
+            os.remove(record_path)
+        except OSError:
+            pass
+        expiry_index.forget(record_path)
+        del chunked_uploads[upload_id]
+        if record['filename'] is None and os.path.exists(record['path']):
+            os.remove(record['path'])
+            expiry_index.forget(record['path'])
+
+
+# Tells this process apart from an earlier one that had the same pid (see finish_lease)
+PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def finish_lease():
+    """Claim on finishing an upload, stored in its record as 'finishing': the owning
+    process and when it took the claim, so a claim whose owner died can be released."""
+    return {'pid': os.getpid(), 'process': PROCESS_TOKEN, 'since': time.time()}
+
+
+def _finish_lease_expired(lease):
+    """True once the process holding a finishing claim is gone or its lease has run out."""
+    if not isinstance(lease, dict) or time.time() - lease['since'] > UPLOAD_FINISH_LEASE:
+        return True
+    if lease['pid'] == os.getpid():
+        return lease['process'] != PROCESS_TOKEN
+    try:
+        os.kill(lease['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass    # Alive, owned by another user
+    return False
+
+
+def _release_stale_finish(upload_id, record):
+    """Drop the finishing claim of a process that died while finishing the upload, so the
+    final chunk can be sent again. If it got as far as moving the data away, the upload is
+    lost and its record deleted. Returns the record, or None. Caller holds upload_sessions_lock."""
+    if record['filename'] is not None or not record.get('finishing'):
+        return record
+    if not _finish_lease_expired(record['finishing']):
+        return record
+    record_path = _chunked_upload_record_path(upload_id)
+    if not os.path.exists(record['path']):
+        app.logger.warning(f"Upload {upload_id} was lost while being finished by a process that died")
+        chunked_uploads.pop(upload_id, None)
+        os.remove(record_path)
+        expiry_index.forget(record_path)
+        return None
+    app.logger.warning(f"Released upload {upload_id}: the process finishing it is gone")
+    record['finishing'] = None
+    record['updated'] = time.time()
+    _save_chunked_upload(upload_id, record)
+    return record
+
+
+def _chunked_upload_for_request(upload_id):
+    """The caller's resumable upload record, or None. The copy on disk is authoritative:
+    it is reloaded whenever another worker process has updated it since this one last did.
+    Caller holds upload_sessions_lock."""
+    if not re.fullmatch(r'[a-f0-9]{32}', upload_id):
+        return None
+    try:
+        with open(_chunked_upload_record_path(upload_id)) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        chunked_uploads.pop(upload_id, None)
+        return None
+    record = chunked_uploads.get(upload_id)
+    if record is None:
+        record = chunked_uploads[upload_id] = {**stored, 'busy': False}
+    elif stored['updated'] > record['updated']:
+        record.update(stored)
+    if record['client'] != client_id():
+        return None
+    return _release_stale_finish(upload_id, record)
+
+
+def finish_chunked_upload(upload_id, record):
+    """Move a fully received upload to its final name (or unpack it, for an archive),
+    probe it and, when it belongs to an open job, queue it for conversion straight away.
+    The probe decodes the image, so it runs on the batch lane, and a single file joins
+    its job once probed (see probe_and_attach).
+    Returns (stored filenames, error message or None)."""
+    filename = f"{upload_id}_{record['name']}"
+    final_path = upload_path(filename)
+    os.replace(record['path'], final_path)
+    expiry_index.forget(record['path'])
+    errors = []
+    attach_error = None
+    if is_archive(record['name']):
+        with open(final_path, 'rb') as f:
+            filenames, errors = extract_archive(f, record['name'], record['length'])
+        os.remove(final_path)
+    else:
+        filenames = [filename]
+        try:
+            storage.save(final_path)
+        except StorageError as e:
+            os.remove(final_path)
+            app.logger.error(f"Upload {upload_id} not stored: {e}")
+            filenames, errors = [], [f"{record['name']} could not be stored, please retry"]
+        else:
+            job_id = record['job_id']
+            attach_error = reserve_job_upload(job_id) if job_id else None
+            if attach_error:
+                app.logger.warning(f"Upload {upload_id} not attached to job {job_id}: {attach_error}")
+                job_id = None
+            # A file on its way into a job stays pinned until probe_and_attach has moved it there
+            expiry_index.track(final_path, pinned=bool(job_id), lease=UPLOAD_SESSION_TIMEOUT)
+            scheduler.submit(LANE_BATCH, probe_and_attach, upload_id, job_id, filename, final_path,
+                             record.get('prescaled'))
+    with upload_sessions_lock:
+        record['filename'] = filename
+        record['path'] = final_path
+        record['files'] = filenames
+        record['errors'] = errors
+        record['updated'] = time.time()
+        _save_chunked_upload(upload_id, record)
+    # The record outlives the upload (repeated final chunks, /uploads/complete) like any file
+    expiry_index.track(_chunked_upload_record_path(upload_id))
+    if attach_error:
+        return filenames, attach_error
+    if record['job_id'] and is_archive(record['name']):
+        for name in filenames:
+            error = attach_upload_to_job(record['job_id'], name)
+            if error:
+                app.logger.warning(f"Upload {upload_id} not attached to job {record['job_id']}: {error}")
+                return filenames, error
+    return filenames, (errors[0] if errors and not filenames else None)
+
+
+def _await_finished_upload(upload_id):
+    """Wait for the request finishing an upload (in this process or another) and return
+    its record with the stored result, or None if the upload went away. Returns the record
+    still unfinished after UPLOAD_FINISH_WAIT, or once a finishing process that died has
+    been found out (see _release_stale_finish)."""
+    deadline = time.time() + UPLOAD_FINISH_WAIT
+    while True:
+        with upload_sessions_lock:
+            record = _chunked_upload_for_request(upload_id)
+            if not record or record['filename'] is not None or not record.get('finishing') \
+                    or time.time() > deadline:
+                return record
+        time.sleep(0.2)
+
+
+def chunked_upload_state(upload_id, record):
+    """JSON body and tus-style headers describing a resumable upload."""
+    body = {
+        'id': upload_id,
+        'offset': record['offset'],
+        'length': record['length'],
+        'complete': record['filename'] is not None,
+        'filename': record['filename'],
+        'files': record.get('files', []),
+        'errors': record.get('errors', []),
+        'job_id': record['job_id'],
+    }
+    headers = {
+        'Upload-Offset': str(record['offset']),
+        'Upload-Length': str(record['length']),
+        'Cache-Control': 'no-store',
+    }
+    return body, headers
 
 
 # --- Routes ---
@@ -649,20 +2823,27 @@ def process_single_file(job_id, file_info, params, batch_folder):
 @app.route('/')
 def index():
     """Homepage with upload options."""
-    return render_template('index.html')
+    return render_template('index.html', presets=sorted(PRESETS))
 
 
 @app.route('/health')
 def health():
     """Health check endpoint."""
     with jobs_lock:
-        active = sum(1 for j in jobs.values() if j.get('status') != 'complete')
-    return {'status': 'ok', 'active_jobs': active}, 200
+        active = sum(1 for j in jobs.values() if j.get('status') not in FINISHED_JOB_STATUSES)
+        queued_mp = round(queued_megapixels, 1)
+    with upload_sessions_lock:
+        prescaled = dict(prescale_stats)
+    prescaled['bytes_saved'] = prescaled['original_bytes'] - prescaled['uploaded_bytes']
+    return {'status': 'ok', 'active_jobs': active, 'queued_megapixels': queued_mp,
+            'scheduler': scheduler.stats(), 'prescaled_uploads': prescaled}, 200
 
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handle file uploads. Supports both regular form POST and XHR (returns JSON)."""
+    """Handle file uploads. Supports both regular form POST and XHR (returns JSON).
+    ZIP/TAR archives are unpacked into individual uploads; with a `preset` field the
+    files go straight into a batch job."""
     is_xhr = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
     def _error(msg, status=400):
@@ -678,26 +2859,11 @@ def upload_file():
     if not files or all(f.filename == '' for f in files):
         return _error('Please select at least one file')
 
-    uploaded_files = []
-    errors = []
-    for file in files:
-        if not file or not file.filename:
-            continue
-        if not allowed_file(file.filename):
-            errors.append(f"Unsupported format: {secure_filename(file.filename)}")
-            continue
-        unique_name = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
-        file.save(filepath)
-        # Per-file size check after saving
-        if os.path.getsize(filepath) > PER_FILE_MAX_SIZE:
-            os.remove(filepath)
-            errors.append(
-                f"{secure_filename(file.filename)} exceeds the per-file limit of "
-                f"{PER_FILE_MAX_SIZE // 1024 // 1024} MB"
-            )
-            continue
-        uploaded_files.append(unique_name)
+    preset = request.form.get('preset', '')
+    if preset and preset not in PRESETS:
+        return _error(f'Unknown preset: {preset}')
+
+    uploaded_files, errors = store_uploaded_files(files)
 
     for err in errors:
         flash(err, 'error')
@@ -706,20 +2872,248 @@ def upload_file():
         msg = errors[0] if errors else 'No valid file'
         return _error(msg)
 
-    if len(uploaded_files) == 1:
-        redirect_url = url_for('resize_options', filename=uploaded_files[0])
-    else:
-        # Store filenames server-side to avoid URL length limit (Gunicorn 4094 chars)
-        upload_key = uuid.uuid4().hex
-        with upload_sessions_lock:
-            upload_sessions[upload_key] = uploaded_files
-        redirect_url = url_for('resize_batch_options', upload_key=upload_key)
+    redirect_url, decision = uploads_destination(uploaded_files, preset)
+    if decision:
+        return too_busy_response(decision, preset_retry_form(uploaded_files, preset),
+                                 form_action=url_for('resize_batch'))
 
     if is_xhr:
         return {'redirect': redirect_url}
     return redirect(redirect_url)
 
 
+@app.route('/uploads', methods=['POST'])
+def create_chunked_upload():
+    """Start a resumable upload. JSON body: {"filename", "size", "job_id"?, "prescaled"?}.
+    Chunks are then sent with PATCH /uploads/<id> and an Upload-Offset header.
+    "prescaled" ({"max_edge", "original_size"}) marks a photo the browser shrank to one
+    of PRESCALE_EDGES before sending it."""
+    body = request.get_json(silent=True) or {}
+    name = secure_filename(str(body.get('filename', '')))
+    try:
+        length = int(body.get('size', request.headers.get('Upload-Length', '')))
+    except (TypeError, ValueError):
+        return {'error': 'Upload size required'}, 400
+    if not name or not (allowed_file(name) or is_archive(name)):
+        return {'error': f"Unsupported format: {name or 'unnamed file'}"}, 400
+    if length <= 0:
+        return {'error': f"{name} is empty"}, 400
+    # Archives are bounded like a whole /upload request; their members by the per-file limit
+    size_limit = MAX_FILE_SIZE if is_archive(name) else PER_FILE_MAX_SIZE
+    if length > size_limit:
+        return {'error': f"{name} exceeds the per-file limit of {size_limit // 1024 // 1024} MB"}, 413
+    prescaled = body.get('prescaled')
+    if prescaled is not None:
+        try:
+            prescaled = {'max_edge': int(prescaled['max_edge']), 'original_size': int(prescaled['original_size'])}
+        except (TypeError, KeyError, ValueError):
+            return {'error': 'Invalid prescaled description'}, 400
+        if prescaled['max_edge'] not in PRESCALE_EDGES or prescaled['original_size'] < length or is_archive(name):
+            return {'error': 'Invalid prescaled description'}, 400
+
+    client = client_id()
+    job_id = body.get('job_id')
+    if job_id:
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if not job or job['client'] != client or not job.get('open') or job.get('cancelled'):
+                return {'error': 'Job is not accepting files'}, 409
+
+    upload_id = uuid.uuid4().hex
+    path = upload_path(f'{upload_id}.part', create=True)
+    open(path, 'wb').close()
+    # Pinned while it arrives, so disk-pressure eviction never takes a live upload; each chunk renews it
+    expiry_index.track(path, _chunked_upload_record_path(upload_id), pinned=True, lease=UPLOAD_SESSION_TIMEOUT)
+    now = time.time()
+    with upload_sessions_lock:
+        _prune_chunked_uploads(now)
+        record = chunked_uploads[upload_id] = {
+            'name': name,
+            'length': length,
+            'offset': 0,
+            'path': path,
+            'filename': None,
+            'job_id': job_id,
+            'client': client,
+            'prescaled': prescaled,
+            'busy': False,
+            'updated': now,
+        }
+        _save_chunked_upload(upload_id, record)
+        body, headers = chunked_upload_state(upload_id, record)
+    headers['Location'] = url_for('chunked_upload_status', upload_id=upload_id)
+    return body, 201, headers
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Current offset of a resumable upload (also answers HEAD, as tus clients expect)."""
+    with upload_sessions_lock:
+        record = _chunked_upload_for_request(upload_id)
+        if not record:
+            return {'error': 'Upload not found'}, 404
+        return chunked_upload_state(upload_id, record)
+
+
+@app.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_chunked_upload(upload_id):
+    """Append one chunk at Upload-Offset. The body is streamed straight to disk, so a
+    worker thread is only held for one chunk rather than the whole file."""
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return {'error': 'Upload-Offset header required'}, 400
+    if (request.content_length or 0) > UPLOAD_CHUNK_MAX_SIZE:
+        return {'error': f'Chunks are limited to {UPLOAD_CHUNK_MAX_SIZE // 1024 // 1024} MB'}, 413
+
+    with upload_sessions_lock:
+        record = _chunked_upload_for_request(upload_id)
+        if not record:
+            return {'error': 'Upload not found'}, 404
+        finishing = record['filename'] is None and record.get('finishing')
+        if record['filename'] is not None:
+            return chunked_upload_state(upload_id, record)
+        if not finishing and (record['busy'] or offset != record['offset']):
+            # Another request is writing, or the client's view is stale: it should GET the offset and resume
+            body, headers = chunked_upload_state(upload_id, record)
+            return {**body, 'error': 'Offset mismatch'}, 409, headers
+        if not finishing:
+            record['busy'] = True
+            path = record['path']
+            remaining = record['length'] - offset
+    if finishing:
+        # A repeated final chunk: answer with the result of the request finishing the upload
+        return _finished_upload_response(upload_id)
+
+    written = 0
+    too_long = conflict = complete = False
+    try:
+        with open(path, 'r+b') as f:
+            try:
+                # The same upload may have a request running in another worker process
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                conflict = True
+            else:
+                # The data received so far is what counts, whichever process wrote it
+                conflict = f.seek(0, os.SEEK_END) != offset
+            while not conflict:
+                chunk = request.stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                if written + len(chunk) > remaining:
+                    too_long = True
+                    break
+                f.seek(offset + written)
+                f.write(chunk)
+                written += len(chunk)
+            if not conflict:
+                # Anything past a short read (dropped connection) is discarded, so the offset stays exact
+                f.truncate(offset + written)
+                expiry_index.track(path, _chunked_upload_record_path(upload_id), pinned=True,
+                                   lease=UPLOAD_SESSION_TIMEOUT)
+                # Still under the flock: a repeated final chunk in another process sees 'finishing'
+                with upload_sessions_lock:
+                    _chunked_upload_for_request(upload_id)
+                    record['offset'] = offset + written
+                    record['updated'] = time.time()
+                    received = record['offset'] == record['length']
+                    finishing = received and record.get('finishing')
+                    complete = received and not finishing
+                    if complete:
+                        record['finishing'] = finish_lease()
+                    _save_chunked_upload(upload_id, record)
+    finally:
+        with upload_sessions_lock:
+            record['busy'] = False
+
+    if conflict:
+        with upload_sessions_lock:
+            body, headers = chunked_upload_state(upload_id, record)
+        return {**body, 'error': 'Offset mismatch'}, 409, headers
+    if finishing:
+        return _finished_upload_response(upload_id)
+
+    if record['job_id']:
+        with jobs_lock:
+            job = jobs.get(record['job_id'])
+            if job:
+                job['last_seen'] = time.time()
+
+    if too_long:
+        with upload_sessions_lock:
+            body, headers = chunked_upload_state(upload_id, record)
+        return {**body, 'error': 'Chunk runs past the declared upload size'}, 413, headers
+
+    attach_error = None
+    if complete:
+        try:
+            filenames, attach_error = finish_chunked_upload(upload_id, record)
+        except Exception:
+            with upload_sessions_lock:
+                record['finishing'] = None
+                _save_chunked_upload(upload_id, record)
+            raise
+        with upload_sessions_lock:
+            record['attach_error'] = attach_error
+            _save_chunked_upload(upload_id, record)
+        app.logger.info(f"Resumable upload {upload_id} complete: {len(filenames)} file(s)")
+    with upload_sessions_lock:
+        body, headers = chunked_upload_state(upload_id, record)
+    if attach_error:
+        body['error'] = attach_error
+    return body, 200, headers
+
+
+def _finished_upload_response(upload_id):
+    """Response to a final chunk that arrived again while (or after) another request
+    finished the upload: the stored result, as the finishing request answered."""
+    record = _await_finished_upload(upload_id)
+    if not record:
+        return {'error': 'Upload not found'}, 404
+    with upload_sessions_lock:
+        body, headers = chunked_upload_state(upload_id, record)
+    if record['filename'] is None:
+        # Still being finished, or released by a finishing process that died: resend the final chunk
+        return {**body, 'error': 'Upload is still being finished'}, 409, headers
+    if record.get('attach_error'):
+        body['error'] = record['attach_error']
+    return body, 200, headers
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """Abandon a resumable upload and delete what was received."""
+    with upload_sessions_lock:
+        record = _chunked_upload_for_request(upload_id)
+        if not record or record['busy']:
+            return {'error': 'Upload not found'}, 404
+        del chunked_uploads[upload_id]
+        record_path = _chunked_upload_record_path(upload_id)
+        os.remove(record_path)
+    if os.path.exists(record['path']):
+        os.remove(record['path'])
+    expiry_index.forget(record['path'], record_path)
+    return '', 204
+
+
+@app.route('/uploads/complete', methods=['POST'])
+def complete_chunked_uploads():
+    """Hand a set of finished resumable uploads to the options page, like /upload does."""
+    ids = (request.get_json(silent=True) or {}).get('ids') or []
+    filenames = []
+    with upload_sessions_lock:
+        for upload_id in ids:
+            record = _chunked_upload_for_request(str(upload_id))
+            if record and record['filename']:
+                filenames.extend(record['files'])
+    if not filenames:
+        return {'error': 'No completed uploads'}, 400
+
+    redirect_url, _ = uploads_destination(filenames)
+    return {'redirect': redirect_url}
+
+
 @app.route('/upload_url', methods=['POST'])
 def upload_url():
     """Handle image upload from a URL."""
@@ -733,61 +3127,68 @@ def upload_url():
         flash('Invalid or unsafe URL', 'error')
         return redirect(url_for('index'))
 
-    # Reconstruct URL from parsed components so that only the validated
-    # scheme/host/path are forwarded — no fragment, no unexpected schemes.
-    _parsed = urlparse(url)
-    safe_url = urlunparse((
-        _parsed.scheme.lower(), _parsed.netloc, _parsed.path,
-        _parsed.params, _parsed.query, ''
-    ))
+    unique_name, error = fetch_url_to_upload(url)
+    if error:
+        flash(f'Error downloading image: {error}', 'error')
+        return redirect(url_for('index'))
+    return redirect(url_for('resize_options', filename=unique_name))
 
+
+@app.route('/upload_urls', methods=['POST'])
+def upload_urls():
+    """Bulk import: download a pasted list or uploaded manifest of URLs concurrently,
+    then continue to the batch options page, or straight to processing with a preset."""
+    text = request.form.get('urls', '')
+    manifest = request.files.get('manifest')
+    if manifest and manifest.filename:
+        text += '\n' + manifest.read(1024 * 1024).decode('utf-8', errors='replace')
     try:
-        response = requests.get(safe_url, timeout=30, stream=True, allow_redirects=False)
-        response.raise_for_status()
-
-        content_type = response.headers.get('content-type', '').lower()
-        if not content_type.startswith('image/'):
-            raise ValueError('Not an image file')
-
-        filename = secure_filename(os.path.basename(url.split('?')[0]))
-        if not filename or not allowed_file(filename):
-            raise ValueError('Invalid file type')
-
-        unique_name = f"{uuid.uuid4().hex}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
-
-        downloaded = 0
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=65536):
-                downloaded += len(chunk)
-                if downloaded > MAX_FILE_SIZE:
-                    f.close()
-                    os.remove(filepath)
-                    raise ValueError(f'File too large (max {MAX_FILE_SIZE // 1024 // 1024} MB)')
-                f.write(chunk)
+        urls = parse_url_list(text)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('index'))
+    if not urls:
+        flash('No URL provided', 'error')
+        return redirect(url_for('index'))
 
-        return redirect(url_for('resize_options', filename=unique_name))
+    preset = request.form.get('preset', '')
+    if preset and preset not in PRESETS:
+        flash(f'Unknown preset: {preset}', 'error')
+        return redirect(url_for('index'))
 
-    except Exception as e:
-        flash(f'Error downloading image: {str(e)}', 'error')
+    filenames, errors = fetch_urls(urls)
+    for err in errors[:10]:
+        flash(f'Error downloading image: {err}', 'error')
+    if len(errors) > 10:
+        flash(f'{len(errors) - 10} more URLs could not be downloaded', 'error')
+    if not filenames:
         return redirect(url_for('index'))
 
+    redirect_url, decision = uploads_destination(filenames, preset)
+    if decision:
+        # The downloads are kept: the queue page resubmits them as a regular batch
+        return too_busy_response(decision, preset_retry_form(filenames, preset),
+                                 form_action=url_for('resize_batch'))
+    return redirect(redirect_url)
+
 
 @app.route('/resize_options/<filename>')
 def resize_options(filename):
     """Resize options page for a single image."""
     sanitized_filename = secure_filename(os.path.basename(filename))
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], sanitized_filename)
-    if not os.path.exists(filepath):
+    filepath = stored_upload(sanitized_filename)
+    if not filepath:
         flash_error("File not found.")
         return redirect(url_for('index'))
 
     dimensions = get_image_dimensions(filepath)
     if not dimensions or dimensions == (None, None):
-        flash('Image too large or unsupported (max 10000px per side)', 'error')
+        flash(f'Image too large or unsupported (max {MAX_DIMENSION}px per side, {MAX_MEGAPIXELS} MP)', 'error')
         return redirect(url_for('index'))
 
     formats = get_available_formats(filepath)
+    # Under way by the time the page asks for its thumbnail
+    request_previews(sanitized_filename, filepath)
 
     app.logger.info(f"Formats passed to template: {formats}")
     return render_template('resize.html',
@@ -798,6 +3199,35 @@ def resize_options(filename):
                            defaults=DEFAULTS)
 
 
+@app.route('/thumbnail/<filename>')
+def thumbnail(filename):
+    """Cached WEBP thumbnail of an upload."""
+    previews = upload_previews(secure_filename(os.path.basename(filename)))
+    if previews is PREVIEW_PENDING:
+        return preview_pending_response()
+    if not previews:
+        return Response('Thumbnail unavailable', status=404)
+    return send_file(previews[0], mimetype='image/webp', max_age=24 * 3600)
+
+
+@app.route('/preview/<filename>', methods=['POST'])
+def live_preview(filename):
+    """Low-resolution WEBP of the options form applied to an upload."""
+    filename = secure_filename(os.path.basename(filename))
+    filepath = stored_upload(filename)
+    previews = upload_previews(filename) if filepath else None
+    if previews is PREVIEW_PENDING:
+        return preview_pending_response()
+    if not previews:
+        return Response('Preview unavailable', status=404)
+    try:
+        data = render_live_preview(filepath, previews[1], extract_processing_params(request.form))
+    except (ValueError, OSError, subprocess.SubprocessError) as e:
+        app.logger.warning(f"Live preview of {filename} failed: {e}")
+        return Response('Preview failed', status=422)
+    return Response(data, mimetype='image/webp', headers={'Cache-Control': 'no-store'})
+
+
 @app.route('/resize/<filename>', methods=['POST'])
 def resize_image(filename):
     """Handle resizing or format conversion for a single image."""
@@ -809,23 +3239,18 @@ def resize_image(filename):
                                title='Error',
                                return_url=url_for('index'))
     try:
-        width = request.form.get('width', '')
-        height = request.form.get('height', '')
-        keep_ratio = request.form.get('keep_ratio') == 'on'
-        raw_format = request.form.get('format', '').upper().strip()
-        output_format = raw_format if raw_format in ALLOWED_OUTPUT_FORMATS else ''
-        auto_level = request.form.get('auto_level') == 'on'
-        auto_gamma = request.form.get('auto_gamma') == 'on'
-        use_sharpen = request.form.get('use_sharpen') == 'on'
-        raw_sharpen = request.form.get('sharpen_level', 'standard').strip().lower()
-        sharpen_level = raw_sharpen if raw_sharpen in ALLOWED_SHARPEN_LEVELS else 'standard'
+        params = extract_processing_params(request.form)
+        width = params['width']
+        height = params['height']
+        keep_ratio = params['keep_ratio']
+        output_format = params['output_format']
 
         app.logger.info(f"Processing resize request for {filename}")
-        app.logger.info(f"Sharpening: enabled={use_sharpen}, level={sharpen_level}")
+        app.logger.info(f"Sharpening: enabled={params['use_sharpen']}, level={params['sharpen_level']}")
         app.logger.info(f"Initial parameters: width={width}, height={height}, keep_ratio={keep_ratio}")
 
         if keep_ratio and (width.isdigit() or height.isdigit()):
-            filepath = secure_path(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            filepath = stored_upload(filename)
             original_dimensions = get_image_dimensions(filepath) if filepath else None
             if original_dimensions and original_dimensions[0] and original_dimensions[1]:
                 original_width, original_height = original_dimensions
@@ -837,17 +3262,28 @@ def resize_image(filename):
                     new_height = int(height)
                     width = str(round(new_height * original_width / original_height))
                     app.logger.info(f"Calculated proportional width: {width}")
+        params['width'], params['height'] = width, height
 
         app.logger.info(f"Final parameters: width={width}, height={height}, format={output_format}")
 
-        filepath = secure_path(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        if not filepath or not os.path.exists(filepath):
+        filepath = stored_upload(filename)
+        if not filepath:
             flash('File not found')
             return render_template('result.html',
                                    success=False,
                                    title='Error',
                                    return_url=url_for('resize_options', filename=filename))
 
+        probe = cached_probe(filename)
+        if probe.get('prescaled') and probe.get('header'):
+            shortfall = prescale_shortfall(params, probe['header'], probe['prescaled'])
+            if shortfall:
+                flash(shortfall)
+                return render_template('result.html',
+                                       success=False,
+                                       title='Error',
+                                       return_url=url_for('resize_options', filename=filename))
+
         # Strip UUID prefix (32 hex chars + underscore) to restore original filename
         clean_name = re.sub(r'^[a-f0-9]{32}_', '', filename)
         base_name = os.path.splitext(clean_name)[0]
@@ -857,51 +3293,51 @@ def resize_image(filename):
             output_filename = f"{base_name}_imaGUIck{os.path.splitext(clean_name)[1]}"
 
         output_filename = secure_filename(output_filename)
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+        token = uuid.uuid4().hex
+        work_dir = single_dir(token)
+        os.makedirs(work_dir)
+        expiry_index.track(work_dir)
+        output_path = os.path.join(work_dir, output_filename)
         app.logger.info(f"Output path: {output_path}")
 
-        input_path, tmp_path = prepare_input_file(filepath)
+        # Run on the scheduler's interactive lane: bounded by the shared worker pool,
+        # but dequeued ahead of any batch work.
+        megapixels = estimate_megapixels(filepath)
+        future = scheduler.submit(LANE_INTERACTIVE, convert_single, token, filepath, output_path, params,
+                                  megapixels=megapixels, temp_dir=os.path.join(work_dir, 'tmp'))
+        timeout = INTERACTIVE_TIMEOUT
+        if megapixels * 1e6 > LARGE_IMAGE_PIXELS:
+            timeout += LARGE_IMAGE_TIMEOUT - CONVERSION_TIMEOUT
         try:
-            command = build_imagemagick_command(
-                filepath=input_path,
-                output_path=output_path,
-                width=width,
-                height=height,
-                percentage=request.form.get('percentage', DEFAULTS["percentage"]),
-                quality=request.form.get('quality', DEFAULTS["quality"]),
-                keep_ratio=keep_ratio,
-                auto_level=auto_level,
-                auto_gamma=auto_gamma,
-                use_1080p=request.form.get('use_1080p') == 'on',
-                use_1920p=request.form.get('use_1920p') == 'on',
-                use_sharpen=use_sharpen,
-                sharpen_level=sharpen_level
-            )
-
-            if not command:
-                flash('Error preparing resize command')
-                return render_template('result.html',
-                                       success=False,
-                                       title='Error',
-                                       return_url=url_for('resize_options', filename=filename))
-
-            app.logger.info(f"Executing command: {' '.join(command)}")
-            subprocess.run(command, check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            app.logger.error(f"ImageMagick error for {filename}: {e.stderr}")
+            output_path, _ = future.result(timeout=timeout)
+            if os.path.isdir(output_path):
+                # One file per page: hand the pages over as a single ZIP
+                page_dir = output_path
+                output_path = shutil.make_archive(page_dir, 'zip', page_dir)
+                shutil.rmtree(page_dir, ignore_errors=True)
+            storage.save(output_path)
+            expiry_index.track(work_dir)
+            output_filename = os.path.basename(output_path)
+        except ValueError:
+            flash('Error preparing resize command')
+            return render_template('result.html',
+                                   success=False,
+                                   title='Error',
+                                   return_url=url_for('resize_options', filename=filename))
+        except (RuntimeError, FutureTimeoutError) as e:
+            app.logger.error(f"Single-image conversion failed for {filename}: {e}")
+            abandon_single(token, future)
             flash('An error occurred while processing the image.')
             return render_template('result.html',
                                    success=False,
                                    title='Error',
                                    return_url=url_for('resize_options', filename=filename))
-        finally:
-            if tmp_path and is_valid_tmp_path(tmp_path) and os.path.exists(tmp_path):
-                os.remove(tmp_path)
 
         flash('Image processed successfully!')
         return render_template('result.html',
                                success=True,
                                title='Success',
+                               token=token,
                                filename=output_filename,
                                batch=False)
 
@@ -941,18 +3377,22 @@ def resize_batch_options(filenames=None):
     }
 
     image_types = []
+    thumbnails = []
     first_file_path = None
 
     for filename in filenames:
         filename = secure_filename(os.path.basename(filename))
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(filepath):
+        filepath = stored_upload(filename)
+        if not filepath:
             continue
 
         if first_file_path is None:
             first_file_path = filepath
+        if len(thumbnails) < PREVIEW_GRID_LIMIT:
+            request_previews(filename, filepath)
+            thumbnails.append(filename)
 
-        image_type = analyze_image_type(filepath)
+        image_type = cached_probe(filename).get('image_type') or analyze_image_type(filepath)
         if image_type:
             if image_type.get('has_transparency'):
                 batch_info['has_transparency'] = True
@@ -970,6 +3410,7 @@ def resize_batch_options(filenames=None):
 
     return render_template('resize_batch.html',
                            files=filenames,
+                           thumbnails=thumbnails,
                            formats=formats,
                            batch_info=batch_info,
                            image_types=image_types,
@@ -994,26 +3435,7 @@ def resize_batch():
                                title='Error',
                                return_url=url_for('index'))
 
-    params = extract_processing_params(request.form)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    batch_folder = os.path.join(app.config['OUTPUT_FOLDER'], f'batch_{timestamp}')
-    os.makedirs(batch_folder, exist_ok=True)
-
-    file_list = []
-    for fname in filenames:
-        fname = secure_filename(os.path.basename(fname))
-        fpath = secure_path(os.path.join(app.config['UPLOAD_FOLDER'], fname))
-        if fpath and os.path.isfile(fpath):
-            # Strip UUID prefix (32 hex chars + underscore) to restore original filename
-            original_name = re.sub(r'^[a-f0-9]{32}_', '', fname)
-            file_list.append({
-                'original': original_name,
-                'path': fpath,
-                'output': None,
-                'status': 'queued',
-                'error': None
-            })
-
+    file_list = build_file_list(filenames)
     if not file_list:
         flash('No valid files found')
         return render_template('result.html',
@@ -1021,22 +3443,9 @@ def resize_batch():
                                title='Error',
                                return_url=url_for('index'))
 
-    job_id = uuid.uuid4().hex
-    with jobs_lock:
-        jobs[job_id] = {
-            'files': file_list,
-            'params': params,
-            'batch_folder': batch_folder,
-            'timestamp': timestamp,
-            'zip': None,
-            'total': len(file_list),
-            'done': 0,
-            'errors': 0,
-            'status': 'processing'
-        }
-
-    t = threading.Thread(target=process_job, args=(job_id,), daemon=True)
-    t.start()
+    job_id, decision = start_job(file_list, request.form.to_dict(), client_id())
+    if decision:
+        return too_busy_response(decision, request.form)
 
     return redirect(url_for('job_progress', job_id=job_id))
 
@@ -1046,71 +3455,76 @@ def job_progress(job_id):
     """Progress page for a batch job."""
     with jobs_lock:
         job = jobs.get(job_id)
+        if job:
+            job['last_seen'] = time.time()
     if not job:
         flash('Job not found', 'error')
         return redirect(url_for('index'))
     return render_template('progress.html', job_id=job_id, total=job['total'])
 
 
+@app.route('/job/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    """Cancel a running batch job."""
+    cancelled = cancel_job(job_id)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if not cancelled:
+            return {'error': 'Job not found or already finished'}, 409
+        return {'cancelled': True}
+    flash('Batch cancelled' if cancelled else 'Job not found or already finished', 'info' if cancelled else 'error')
+    return redirect(url_for('index'))
+
+
+@app.route('/job/<job_id>/retry', methods=['POST'])
+def job_retry(job_id):
+    """Reprocess the failed files of a completed batch with its original settings."""
+    try:
+        retried, decision = retry_job(job_id)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('job_progress', job_id=job_id))
+    if decision:
+        return too_busy_response(decision, request.form)
+    flash(f'Retrying {retried} file(s)', 'info')
+    return redirect(url_for('job_progress', job_id=job_id))
+
+
 @app.route('/job/<job_id>/status')
 def job_status(job_id):
     """SSE endpoint streaming real-time job status."""
-    def generate():
-        while True:
-            with jobs_lock:
-                job = jobs.get(job_id)
-                if not job:
-                    yield 'data: {"error": "job not found"}\n\n'
-                    return
-                payload = {
-                    'total': job['total'],
-                    'done': job['done'],
-                    'errors': job['errors'],
-                    'files': [
-                        {
-                            'name': f['original'],
-                            'status': f['status'],
-                            'error': f.get('error')
-                        }
-                        for f in job['files']
-                    ],
-                    'zip': job.get('zip'),
-                    'complete': job.get('status') == 'complete'
-                }
-            yield f'data: {json.dumps(payload)}\n\n'
-            if payload['complete']:
-                return
-            time.sleep(0.5)
-
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
-    )
+    return stream_job_status(job_id)
 
 
-@app.route('/download_batch/<filename>')
-def download_batch(filename):
+@app.route('/download_batch/<job_id>/<filename>')
+def download_batch(job_id, filename):
     """Serve the ZIP file for download."""
     safe_name = secure_filename(os.path.basename(filename))
-    if not safe_name or not re.match(r'^[\w\-.]+$', safe_name) or '..' in safe_name:
+    if (not safe_name or not re.match(r'^[\w\-.]+$', safe_name) or '..' in safe_name
+            or not re.fullmatch(r'[a-f0-9]{32}', job_id)):
         flash('Invalid filename', 'error')
         return redirect(url_for('index'))
-    zip_path = secure_path(os.path.join(app.config['OUTPUT_FOLDER'], safe_name))
+    zip_path = secure_path(os.path.join(job_dir(job_id), safe_name))
+    url = storage.download_url(zip_path, safe_name) if zip_path else None
+    if url:
+        return redirect(url)
     if not zip_path or not os.path.exists(zip_path):
         flash('File not found', 'error')
         return redirect(url_for('index'))
     return send_file(zip_path, as_attachment=True)
 
 
-@app.route('/download/<filename>')
-def download(filename):
+@app.route('/download/<token>/<filename>')
+def download(token, filename):
     """Serve a single file for download."""
     safe_name = secure_filename(os.path.basename(filename))
-    if not safe_name or not re.match(r'^[\w\-.]+$', safe_name) or '..' in safe_name:
+    if (not safe_name or not re.match(r'^[\w\-.]+$', safe_name) or '..' in safe_name
+            or not re.fullmatch(r'[a-f0-9]{32}', token)):
         flash('Invalid filename', 'error')
         return redirect(url_for('index'))
-    filepath = secure_path(os.path.join(app.config['OUTPUT_FOLDER'], safe_name))
+    filepath = secure_path(os.path.join(single_dir(token), safe_name))
+    url = storage.download_url(filepath, safe_name) if filepath else None
+    if url:
+        return redirect(url)
     if not filepath or not os.path.exists(filepath):
         flash('File not found', 'error')
         return redirect(url_for('index'))
@@ -1120,13 +3534,445 @@ def download(filename):
     return response
 
 
+# --- JSON API (v1) ---
+
+def api_error(message, status, headers=None, **extra):
+    if headers:
+        return {'error': message, **extra}, status, headers
+    return {'error': message, **extra}, status
+
+
+def api_job_representation(job_id, job):
+    """JSON view of a job with links to its outputs. Caller holds jobs_lock."""
+    payload = job_status_payload(job)
+    payload['id'] = job_id
+    payload['status'] = job['status']
+    payload['open'] = job.get('open', False)
+    for entry, fi in zip(payload['files'], job['files']):
+        if fi.get('output') and fi['status'] == 'done' and not job.get('cancelled'):
+            entry['output'] = os.path.basename(fi['output'])
+            names = [name for _, name in output_files(fi)]
+            if os.path.isdir(fi['output']):
+                entry['pages'] = [url_for('api_job_file', job_id=job_id, filename=name) for name in names]
+            else:
+                entry['url'] = url_for('api_job_file', job_id=job_id, filename=entry['output'])
+    payload['links'] = {
+        'self': url_for('api_get_job', job_id=job_id),
+        'events': url_for('api_job_events', job_id=job_id),
+        'archive': url_for('api_job_archive', job_id=job_id) if job.get('zip') else None,
+    }
+    return payload
+
+
+def _api_request_form(base=None):
+    """Processing fields from a JSON body or multipart form, with an optional named preset,
+    applied over base (a job's own form when retrying it)."""
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            raise ValueError("JSON body must be an object")
+        fields = body.get('params') or {}
+        if not isinstance(fields, dict):
+            raise ValueError("'params' must be an object")
+        preset = body.get('preset')
+        filenames = body.get('filenames') or []
+        if not isinstance(filenames, list) or not all(isinstance(name, str) for name in filenames):
+            raise ValueError("'filenames' must be a list of strings")
+        urls = body.get('urls') or []
+        urls = parse_url_list(urls if isinstance(urls, str) else '\n'.join(map(str, urls)))
+        open_job = body.get('open') is True
+    else:
+        fields = request.form.to_dict()
+        if fields.get('params'):
+            params = json.loads(fields.pop('params'))
+            if not isinstance(params, dict):
+                raise ValueError("'params' must be an object")
+            fields.update(params)
+        preset = fields.pop('preset', None)
+        filenames = [f.strip() for f in fields.pop('filenames', '').split(',') if f.strip()]
+        urls = parse_url_list(fields.pop('urls', ''))
+        open_job = fields.pop('open', '').lower() in ('1', 'true', 'on')
+    if preset and preset not in PRESETS:
+        raise ValueError(f"Unknown preset: {preset}")
+    form = dict(base or {})
+    form.update(PRESETS.get(preset, {}))
+    # JSON booleans map onto the HTML checkbox convention extract_processing_params expects
+    for key, value in fields.items():
+        if value is True:
+            form[key] = 'on'
+        elif value in (False, None):
+            form.pop(key, None)
+        else:
+            form[key] = str(value)
+    return form, filenames, urls, open_job
+
+
+def _request_fingerprint(form, filenames, files):
+    """Hash of what a submission asks for, to detect Idempotency-Key reuse with a different body."""
+    digest = hashlib.sha256(json.dumps([sorted(form.items()), sorted(filenames)]).encode())
+    for f in files:
+        f.stream.seek(0, os.SEEK_END)
+        digest.update(f'{f.filename}:{f.stream.tell()}'.encode())
+        f.stream.seek(0)
+    return digest.hexdigest()
+
+
+def _prune_idempotency_keys(now):
+    """Drop expired keys. Caller holds idempotency_lock."""
+    for key in [k for k, v in idempotency_keys.items() if now - v['created'] > IDEMPOTENCY_TTL]:
+        del idempotency_keys[key]
+
+
+@app.route('/api/v1/jobs', methods=['POST'])
+def api_create_job():
+    """Create a batch job in one request: files (multipart 'file') and/or previously
+    uploaded 'filenames', plus processing params. Honours the Idempotency-Key header."""
+    try:
+        form, filenames, urls, open_job = _api_request_form()
+    except (ValueError, TypeError) as e:
+        return api_error(str(e), 400)
+    files = [f for f in request.files.getlist('file') if f and f.filename]
+    if not files and not filenames and not urls and not open_job:
+        return api_error('No files provided', 400)
+
+    client = client_id()
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if len(key) > 255:
+        return api_error('Idempotency-Key too long', 400)
+    scoped_key = (client, key)
+    if key:
+        fingerprint = _request_fingerprint({**form, 'open': open_job}, filenames + urls, files)
+        now = time.time()
+        with idempotency_lock:
+            _prune_idempotency_keys(now)
+            existing = idempotency_keys.get(scoped_key)
+            if existing is None:
+                idempotency_keys[scoped_key] = {'job_id': None, 'fingerprint': fingerprint, 'created': now}
+        if existing:
+            if existing['fingerprint'] != fingerprint:
+                return api_error('Idempotency-Key reused with a different request', 422)
+            if existing['job_id'] is None:
+                return api_error('A request with this Idempotency-Key is still being processed', 409)
+            with jobs_lock:
+                job = jobs.get(existing['job_id'])
+                if job:
+                    return api_job_representation(existing['job_id'], job), 200
+
+    try:
+        uploaded, errors = store_uploaded_files(files)
+        if urls:
+            fetched, fetch_errors = fetch_urls(urls)
+            uploaded += fetched
+            errors += fetch_errors
+
+        file_list = build_file_list(uploaded + filenames)
+        job_id, decision = (None, None)
+        if file_list or open_job:
+            job_id, decision = start_job(file_list, form, client, open_job=open_job)
+    except Exception:
+        # Otherwise every retry with this key would get 409 until the key expires
+        if key:
+            with idempotency_lock:
+                idempotency_keys.pop(scoped_key, None)
+        raise
+
+    if not job_id:
+        # Nothing was queued: drop this request's uploads and free the key for a retry
+        for name in uploaded:
+            path = secure_path(upload_path(name))
+            if path and os.path.exists(path):
+                os.remove(path)
+                expiry_index.forget(path)
+        if key:
+            with idempotency_lock:
+                idempotency_keys.pop(scoped_key, None)
+        if decision:
+            return api_error('Server busy, retry later', 429, {'Retry-After': str(decision['retry_after'])}, **decision)
+        return api_error('No valid files', 400, details=errors)
+
+    if key:
+        with idempotency_lock:
+            idempotency_keys[scoped_key]['job_id'] = job_id
+    with jobs_lock:
+        body = api_job_representation(job_id, jobs[job_id])
+    if errors:
+        body['rejected'] = errors
+    return body, 202, {'Location': url_for('api_get_job', job_id=job_id)}
+
+
+@app.route('/api/v1/jobs/<job_id>', methods=['GET'])
+def api_get_job(job_id):
+    """Poll a job's status."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job:
+            return api_error('Job not found', 404)
+        job['last_seen'] = time.time()
+        return api_job_representation(job_id, job)
+
+
+@app.route('/api/v1/jobs/<job_id>', methods=['DELETE'])
+def api_cancel_job(job_id):
+    """Cancel a running job."""
+    if not cancel_job(job_id, reason='api'):
+        return api_error('Job not found or already finished', 409)
+    return {'id': job_id, 'cancelled': True}, 202
+
+
+@app.route('/api/v1/jobs/<job_id>/close', methods=['POST'])
+def api_close_job(job_id):
+    """Stop an open job from accepting further uploads."""
+    if not close_job(job_id):
+        return api_error('Job not found or not open', 409)
+    with jobs_lock:
+        return api_job_representation(job_id, jobs[job_id])
+
+
+@app.route('/api/v1/jobs/<job_id>/retry', methods=['POST'])
+def api_retry_job(job_id):
+    """Reprocess only the failed files of a completed job. Processing fields (or a preset)
+    in the body override those settings of the job for the retried files, the others are
+    kept; an empty body retries with the job's settings unchanged."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if not job:
+            return api_error('Job not found', 404)
+        job_form = job['form']
+    try:
+        form, _, _, _ = _api_request_form(base=job_form)
+    except (ValueError, TypeError) as e:
+        return api_error(str(e), 400)
+    try:
+        retried, decision = retry_job(job_id, form if form != job_form else None)
+    except ValueError as e:
+        return api_error(str(e), 409)
+    if decision:
+        return api_error('Server busy, retry later', 429, {'Retry-After': str(decision['retry_after'])}, **decision)
+    with jobs_lock:
+        body = api_job_representation(job_id, jobs[job_id])
+    body['retried'] = retried
+    return body, 202
+
+
+@app.route('/api/v1/jobs/<job_id>/events')
+def api_job_events(job_id):
+    """Server-Sent Events stream of the job status."""
+    return stream_job_status(job_id)
+
+
+@app.route('/api/v1/jobs/<job_id>/files/<path:filename>')
+def api_job_file(job_id, filename):
+    """Download one converted output of a job (or one page, as '<dir>/<page>')."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        outputs = {name: path for fi in (job['files'] if job else []) if fi['status'] == 'done'
+                   for path, name in output_files(fi)}
+    path = secure_path(outputs.get(filename, ''))
+    url = storage.download_url(path, os.path.basename(filename)) if path else None
+    if url:
+        return redirect(url)
+    if not path or not os.path.exists(path):
+        return api_error('File not found', 404)
+    return send_file(path, as_attachment=True)
+
+
+@app.route('/api/v1/jobs/<job_id>/archive')
+def api_job_archive(job_id):
+    """Download the job's ZIP archive once it has been built."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        zip_name = job.get('zip') if job else None
+        complete = job is not None and job.get('status') in FINISHED_JOB_STATUSES
+    if not job:
+        return api_error('Job not found', 404)
+    if not zip_name:
+        return api_error('Archive not available' if complete else 'Job still processing', 404 if complete else 409)
+    path = secure_path(os.path.join(job_dir(job_id), zip_name))
+    url = storage.download_url(path, zip_name) if path else None
+    if url:
+        return redirect(url)
+    if not path or not os.path.exists(path):
+        return api_error('Archive not found', 404)
+    return send_file(path, as_attachment=True)
+
+
+class PinnedIPAdapter(HTTPAdapter):
+    """Connects to one pre-validated IP while keeping the original Host header, TLS SNI
+    and certificate hostname, so a second DNS lookup can't be rebound to an internal address."""
+
+    def __init__(self, hostname, ip, **kwargs):
+        self.hostname = hostname
+        self.ip = ip
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['server_hostname'] = self.hostname
+        kwargs['assert_hostname'] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        parsed = urlparse(request.url)
+        host = f'[{self.ip}]' if ':' in self.ip else self.ip
+        request.headers['Host'] = f'{parsed.hostname}:{parsed.port}' if parsed.port else parsed.hostname
+        request.url = urlunparse(parsed._replace(netloc=f'{host}:{parsed.port}' if parsed.port else host))
+        return super().send(request, **kwargs)
+
+
+def resolve_public_ips(hostname):
+    """Resolve a hostname and return its addresses, or None if any of them is loopback,
+    link-local, private, multicast or otherwise reserved. Answers are cached for DNS_CACHE_TTL."""
+    now = time.monotonic()
+    with url_fetch_lock:
+        cached = dns_cache.get(hostname)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    try:
+        addr_infos = socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        addr_infos = []
+
+    ips = []
+    for addr_info in addr_infos:
+        ip_str = addr_info[4][0]
+        try:
+            ip = ipaddress.ip_address(ip_str)
+        except ValueError:
+            ips = []
+            break
+        if (ip.is_loopback or ip.is_link_local or ip.is_multicast
+                or ip.is_reserved or ip.is_unspecified or ip.is_private):
+            ips = []
+            break
+        if ip_str not in ips:
+            ips.append(ip_str)
+
+    with url_fetch_lock:
+        dropped = _prune_url_caches(now)
+        dns_cache[hostname] = (ips or None, now + DNS_CACHE_TTL)
+    # Downloads still streaming through a closed Session finish; its connections are not reused
+    for session in dropped:
+        session.close()
+    return ips or None
+
+
+def _prune_url_caches(now):
+    """Drop expired DNS answers and the Sessions of hosts unused for DNS_CACHE_TTL (their
+    pin would need a fresh lookup anyway), so neither cache grows with every host ever
+    imported from. Returns the dropped Sessions, for the caller to close outside the lock.
+    Caller holds url_fetch_lock."""
+    for hostname in [h for h, (_, expiry) in dns_cache.items() if expiry <= now]:
+        del dns_cache[hostname]
+    idle = [key for key, entry in host_sessions.items() if now - entry[3] > DNS_CACHE_TTL]
+    return [host_sessions.pop(key)[1] for key in idle]
+
+
+def host_session(parsed):
+    """Pooled Session pinned to a validated IP of the URL's host, plus the semaphore
+    bounding concurrent downloads from that host. Raises ValueError for unsafe hosts."""
+    ips = resolve_public_ips(parsed.hostname)
+    if not ips:
+        raise ValueError('Invalid or unsafe URL')
+    key = (parsed.scheme.lower(), parsed.hostname, parsed.port)
+    now = time.monotonic()
+    with url_fetch_lock:
+        entry = host_sessions.get(key)
+        if entry and entry[0] in ips:
+            host_sessions[key] = (*entry[:3], now)
+            return entry[1], entry[2]
+        session = requests.Session()
+        session.headers['User-Agent'] = 'ImaGUIck URL import'
+        adapter = PinnedIPAdapter(parsed.hostname, ips[0], pool_connections=1, pool_maxsize=URL_FETCH_PER_HOST)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        slots = entry[2] if entry else threading.BoundedSemaphore(URL_FETCH_PER_HOST)
+        host_sessions[key] = (ips[0], session, slots, now)
+    if entry:
+        entry[1].close()
+    return session, slots
+
+
+def fetch_url_to_upload(url):
+    """Stream one image URL into the upload folder through its host's pinned session.
+    Returns (unique_name, None) or (None, error_message)."""
+    if not is_safe_url(url):
+        return None, f'Invalid or unsafe URL: {url}'
+    # Reconstruct URL from parsed components so that only the validated
+    # scheme/host/path are forwarded — no fragment, no unexpected schemes.
+    parsed = urlparse(url)
+    safe_url = urlunparse((
+        parsed.scheme.lower(), parsed.netloc, parsed.path,
+        parsed.params, parsed.query, ''
+    ))
+    filename = secure_filename(os.path.basename(parsed.path))
+    if not filename or not allowed_file(filename):
+        return None, f'Invalid file type: {url}'
+
+    unique_name = f"{uuid.uuid4().hex}_{filename}"
+    filepath = upload_path(unique_name, create=True)
+    try:
+        session, slots = host_session(parsed)
+        with slots, session.get(safe_url, timeout=URL_FETCH_TIMEOUT, stream=True, allow_redirects=False) as response:
+            if response.status_code != 200:
+                raise ValueError(f'HTTP {response.status_code}')
+            content_type = response.headers.get('content-type', '').lower()
+            if not content_type.startswith('image/'):
+                raise ValueError('Not an image file')
+            limit_error = f'File too large (max {PER_FILE_MAX_SIZE // 1024 // 1024} MB)'
+            if int(response.headers.get('content-length') or 0) > PER_FILE_MAX_SIZE:
+                raise ValueError(limit_error)
+
+            downloaded = 0
+            with open(filepath, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    downloaded += len(chunk)
+                    if downloaded > PER_FILE_MAX_SIZE:
+                        raise ValueError(limit_error)
+                    f.write(chunk)
+        storage.save(filepath)
+    except (requests.RequestException, ValueError, OSError) as e:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return None, f'{url}: {e}'
+    expiry_index.track(filepath)
+    return unique_name, None
+
+
+def fetch_urls(urls):
+    """Download many URLs concurrently. Returns (filenames in input order, errors)."""
+    results = list(url_fetch_pool.map(fetch_url_to_upload, urls))
+    filenames = [name for name, _ in results if name]
+    errors = [error for _, error in results if error]
+    app.logger.info(f"URL import: {len(filenames)} downloaded, {len(errors)} failed")
+    return filenames, errors
+
+
+def parse_url_list(text):
+    """URLs from pasted text or a manifest: one per line ('#' comments allowed),
+    or a JSON array of strings / {"url": ...} objects. Duplicates are dropped."""
+    text = text.strip()
+    if text.startswith('['):
+        try:
+            entries = json.loads(text)
+        except json.JSONDecodeError:
+            raise ValueError('Invalid JSON manifest')
+        candidates = [e.get('url', '') if isinstance(e, dict) else str(e) for e in entries]
+    else:
+        candidates = [line for line in text.splitlines() if not line.lstrip().startswith('#')]
+    urls = list(dict.fromkeys(u.strip() for u in candidates if u.strip()))
+    if len(urls) > MAX_URLS_PER_IMPORT:
+        raise ValueError(f'Too many URLs (max {MAX_URLS_PER_IMPORT} per import)')
+    return urls
+
+
 def is_safe_url(url):
     """Validate URL safety: scheme, extension, and resolved-IP range checks.
 
     Resolves the hostname via DNS and rejects any address that falls within
     loopback, link-local, private, multicast, or otherwise reserved ranges.
     This prevents SSRF attacks including DNS-rebinding and cloud-metadata
-    endpoint abuse (169.254.169.254, etc.).
+    endpoint abuse (169.254.169.254, etc.). Downloads then connect to the
+    validated address itself (see PinnedIPAdapter).
     """
     try:
         ALLOWED_SCHEMES = {'http', 'https'}
@@ -1149,29 +3995,11 @@ def is_safe_url(url):
         if not any(path.endswith(ext) for ext in ALLOWED_EXTENSIONS):
             return False
 
-        # Resolve all DNS addresses and reject any private/reserved IP.
-        try:
-            addr_infos = socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)
-        except socket.gaierror:
-            return False
-
-        if not addr_infos:
-            return False
-
-        for addr_info in addr_infos:
-            ip_str = addr_info[4][0]
-            try:
-                ip = ipaddress.ip_address(ip_str)
-            except ValueError:
-                return False
-            if (ip.is_loopback or ip.is_link_local or ip.is_multicast
-                    or ip.is_reserved or ip.is_unspecified or ip.is_private):
-                return False
-
-        return True
+        return resolve_public_ips(hostname) is not None
     except Exception:
         return False
 
 
 if __name__ == '__main__':
+    start_web_app()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
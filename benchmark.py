@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""Reproducible benchmark suite for the ImaGUIck conversion pipeline.
+
+Generates synthetic inputs in a throw-away workspace, runs them through the
+pipeline building blocks and the full /resize_batch HTTP flow, and prints a
+machine-readable JSON report (throughput + p50/p95 latency per scenario) so
+results can be compared across commits:
+
+    python benchmark.py --output bench_before.json
+    python benchmark.py --compare bench_before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+from PIL import Image
+
+# Expired uploads and outputs are swept by the web server, not by headless runs
+os.environ.setdefault('IMAGUICK_CLEANUP_IN_PROCESS', '0')
+os.environ.setdefault('IMAGUICK_HEADLESS', '1')
+import app as imaguick
+
+# Configuration
+DEFAULT_SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+QUICK_SIZES = [(320, 240), (1280, 720)]
+DEFAULT_REPEAT = 3
+BATCH_TIMEOUT = 600
+SCENARIOS = ['prepare_input', 'analyze', 'dimensions', 'convert', 'encoder_speed', 'threading', 'resize_batch']
+# encoder_speed scenario: (label, output format, use cjxl) x ENCODER_SPEEDS levels ('' = encoder default)
+ENCODER_TARGETS = [('AVIF', 'AVIF', False), ('WEBP', 'WEBP', False), ('JXL', 'JXL', False), ('JXL-cjxl', 'JXL', True)]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+
+
+def _has_tool(name):
+    """Return True if an external binary is available on PATH."""
+    return shutil.which(name) is not None
+
+
+def _percentile(values, pct):
+    """Linear-interpolated percentile of a list of floats."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _summarize(name, samples, errors, elapsed, skipped=None):
+    """Build the JSON record for one scenario from (seconds, megapixels) samples."""
+    latencies = [s for s, _ in samples]
+    megapixels = sum(mp for _, mp in samples)
+    record = {
+        'scenario': name,
+        'count': len(samples),
+        'errors': errors,
+        'wall_s': round(elapsed, 4),
+        'images_per_s': round(len(samples) / elapsed, 3) if elapsed > 0 else None,
+        'mp_per_s': round(megapixels / elapsed, 3) if elapsed > 0 else None,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2) if latencies else None,
+    }
+    if skipped:
+        record['skipped'] = skipped
+    return record
+
+
+# --- Synthetic fixtures ---
+
+def _synthetic_image(width, height, alpha=False):
+    """Photo-like gradient with noise so encoders cannot trivially compress it."""
+    base = Image.radial_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge('RGB', (base, noise, Image.linear_gradient('L').resize((width, height))))
+    if alpha:
+        img.putalpha(Image.linear_gradient('L').rotate(90).resize((width, height)))
+    return img
+
+
+def _write_linear_dng(path, width, height):
+    """Write a minimal uncompressed LinearRaw DNG readable by exiftool and dcraw."""
+    pixels = _synthetic_image(width, height).tobytes()
+    data = struct.pack(f'<{len(pixels)}H', *(v * 257 for v in pixels))
+    model = b'ImaGUIck Synthetic\x00'
+    entries = []
+    extra = b''
+    header_len = 8
+    # Tag entries: (tag, type, count, value-or-bytes)
+    tags = [
+        (254, 4, 1, 0),
+        (256, 4, 1, width),
+        (257, 4, 1, height),
+        (258, 3, 3, struct.pack('<HHH', 16, 16, 16)),
+        (259, 3, 1, 1),
+        (262, 3, 1, 34892),
+        (273, 4, 1, None),  # StripOffsets, patched below
+        (277, 3, 1, 3),
+        (278, 4, 1, height),
+        (279, 4, 1, len(data)),
+        (284, 3, 1, 1),
+        (50706, 1, 4, bytes([1, 4, 0, 0])),
+        (50708, 2, len(model), model),
+        (50721, 10, 9, struct.pack('<18i', 1, 1, 0, 1, 0, 1, 0, 1, 1, 1, 0, 1, 0, 1, 0, 1, 1, 1)),
+        (50728, 5, 3, struct.pack('<6I', 1, 1, 1, 1, 1, 1)),
+    ]
+    ifd_len = 2 + len(tags) * 12 + 4
+    extra_offset = header_len + ifd_len
+    for tag, typ, count, value in tags:
+        if isinstance(value, bytes) and len(value) > 4:
+            entries.append(struct.pack('<HHII', tag, typ, count, extra_offset + len(extra)))
+            extra += value + (b'\x00' if len(value) % 2 else b'')
+        elif isinstance(value, bytes):
+            entries.append(struct.pack('<HHI', tag, typ, count) + value.ljust(4, b'\x00'))
+        elif typ == 3:
+            entries.append(struct.pack('<HHIHH', tag, typ, count, value or 0, 0))
+        else:
+            entries.append(struct.pack('<HHII', tag, typ, count, value or 0))
+    strip_offset = extra_offset + len(extra)
+    entries[6] = struct.pack('<HHII', 273, 4, 1, strip_offset)
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', header_len))
+        f.write(struct.pack('<H', len(tags)) + b''.join(entries) + struct.pack('<I', 0))
+        f.write(extra)
+        f.write(data)
+
+
+def generate_fixtures(folder, sizes):
+    """Create the synthetic input set. Returns a list of fixture dicts."""
+    fixtures = []
+    for width, height in sizes:
+        for alpha in (False, True):
+            img = _synthetic_image(width, height, alpha=alpha)
+            tag = f'{width}x{height}_{"rgba" if alpha else "rgb"}'
+            targets = [('png', 'PNG', {}), ('tiff', 'TIFF', {'compression': 'tiff_lzw'})]
+            if not alpha:
+                targets.append(('jpg', 'JPEG', {'quality': 90}))
+            for ext, fmt, opts in targets:
+                path = os.path.join(folder, f'bench_{tag}.{ext}')
+                img.save(path, fmt, **opts)
+                fixtures.append({'path': path, 'ext': ext, 'width': width, 'height': height, 'alpha': alpha})
+            if _has_tool('cjxl'):
+                png_path = os.path.join(folder, f'bench_{tag}.png')
+                jxl_path = os.path.join(folder, f'bench_{tag}.jxl')
+                result = subprocess.run(['cjxl', png_path, jxl_path, '-d', '1'], capture_output=True, timeout=120)
+                if result.returncode == 0:
+                    fixtures.append({'path': jxl_path, 'ext': 'jxl', 'width': width, 'height': height, 'alpha': alpha})
+
+    # A single small RAW fixture is enough to exercise the dcraw path
+    raw_w, raw_h = sizes[0]
+    dng_path = os.path.join(folder, f'bench_{raw_w}x{raw_h}_raw.dng')
+    _write_linear_dng(dng_path, raw_w, raw_h)
+    fixtures.append({'path': dng_path, 'ext': 'dng', 'width': raw_w, 'height': raw_h, 'alpha': False})
+    return fixtures
+
+
+# --- Scenarios ---
+
+def _timed(fn, *args, **kwargs):
+    """Run fn and return (elapsed_seconds, result)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _mp(fixture):
+    return fixture['width'] * fixture['height'] / 1e6
+
+
+def bench_prepare_input(fixtures, repeat):
+    """Time prepare_input_file (djxl / dcraw decode for JXL and RAW inputs)."""
+    targets = [f for f in fixtures if f['ext'] in ('jxl', 'dng')]
+    skipped = []
+    if not _has_tool('dcraw'):
+        targets = [f for f in targets if f['ext'] != 'dng']
+        skipped.append('dcraw not installed')
+    if not _has_tool('djxl'):
+        targets = [f for f in targets if f['ext'] != 'jxl']
+        skipped.append('djxl not installed')
+    samples, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fixture in targets:
+            try:
+                elapsed, (_, tmp_path) = _timed(imaguick.prepare_input_file, fixture['path'])
+                samples.append((elapsed, _mp(fixture)))
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            except Exception as e:
+                logging.error(f"prepare_input_file failed for {fixture['path']}: {e}")
+                errors += 1
+    return _summarize('prepare_input', samples, errors, time.perf_counter() - start, skipped)
+
+
+def bench_analyze(fixtures, repeat):
+    """Time _analyze_with_pil on every PIL-readable fixture."""
+    targets = [f for f in fixtures if f['ext'] in ('png', 'jpg', 'tiff')]
+    samples, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fixture in targets:
+            try:
+                elapsed, _ = _timed(imaguick._analyze_with_pil, fixture['path'])
+                samples.append((elapsed, _mp(fixture)))
+            except Exception as e:
+                logging.error(f"_analyze_with_pil failed for {fixture['path']}: {e}")
+                errors += 1
+    return _summarize('analyze', samples, errors, time.perf_counter() - start)
+
+
+def bench_dimensions(fixtures, repeat):
+    """Time get_image_dimensions (magick identify / exiftool)."""
+    if not _has_tool('magick'):
+        return _summarize('dimensions', [], 0, 0, ['magick not installed'])
+    targets = [f for f in fixtures if f['ext'] != 'dng' or _has_tool('exiftool')]
+    samples, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fixture in targets:
+            elapsed, dims = _timed(imaguick.get_image_dimensions, fixture['path'])
+            if dims == (None, None):
+                errors += 1
+                continue
+            samples.append((elapsed, _mp(fixture)))
+    return _summarize('dimensions', samples, errors, time.perf_counter() - start)
+
+
+def bench_convert(fixtures, repeat, output_folder, output_format, params):
+    """Time build_imagemagick_command + execution, including input preparation."""
+    if not _has_tool('magick'):
+        return _summarize('convert', [], 0, 0, ['magick not installed'])
+    skip_exts = set()
+    if not _has_tool('dcraw'):
+        skip_exts.add('dng')
+    if not _has_tool('djxl'):
+        skip_exts.add('jxl')
+    targets = [f for f in fixtures if f['ext'] not in skip_exts]
+    samples, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fixture in targets:
+            base = os.path.splitext(os.path.basename(fixture['path']))[0]
+            output_path = os.path.join(output_folder, f'{base}_{fixture["ext"]}.{output_format.lower()}')
+            t0 = time.perf_counter()
+            try:
+                input_path, tmp_path = imaguick.prepare_input_file(fixture['path'])
+                try:
+                    command = imaguick.build_imagemagick_command(input_path, output_path, **params)
+                    if not command:
+                        raise RuntimeError('could not build command')
+                    subprocess.run(command, check=True, capture_output=True, timeout=300)
+                finally:
+                    if tmp_path and os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                samples.append((time.perf_counter() - t0, _mp(fixture)))
+            except Exception as e:
+                logging.error(f"Conversion failed for {fixture['path']}: {e}")
+                errors += 1
+    return _summarize('convert', samples, errors, time.perf_counter() - start)
+
+
+def bench_encoder_speed(fixtures, repeat, output_folder, params):
+    """Time convert_file per output format and encoder speed level; one record per
+    combination, with the mean output size so speed can be weighed against compression."""
+    if not _has_tool('magick'):
+        return [_summarize('encoder_speed', [], 0, 0, ['magick not installed'])]
+    targets = [f for f in fixtures if f['ext'] in ('png', 'jpg')]
+    records = []
+    for label, output_format, use_cjxl in ENCODER_TARGETS:
+        for level in [''] + list(imaguick.ENCODER_SPEEDS):
+            name = f"encoder_speed:{label}:{level or 'default'}"
+            if use_cjxl and not _has_tool('cjxl'):
+                records.append(_summarize(name, [], 0, 0, ['cjxl not installed']))
+                continue
+            run_params = dict(params, output_format=output_format, encoder_speed=level, use_cjxl=use_cjxl,
+                              max_size_kb=None)
+            samples, sizes, errors = [], [], 0
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for fixture in targets:
+                    base = os.path.splitext(os.path.basename(fixture['path']))[0]
+                    output_path = os.path.join(output_folder, f'{base}_{fixture["ext"]}.{output_format.lower()}')
+                    t0 = time.perf_counter()
+                    try:
+                        imaguick.convert_file(fixture['path'], output_path, run_params)
+                        samples.append((time.perf_counter() - t0, _mp(fixture)))
+                        sizes.append(os.path.getsize(output_path))
+                        os.remove(output_path)
+                    except Exception as e:
+                        logging.error(f"{name} failed for {fixture['path']}: {e}")
+                        errors += 1
+            record = _summarize(name, samples, errors, time.perf_counter() - start)
+            record['output_kb'] = round(sum(sizes) / len(sizes) / 1024, 1) if sizes else None
+            records.append(record)
+    return records
+
+
+def bench_threading(fixtures, repeat, output_folder, output_format, params):
+    """Compare ways of spending the cores on one queue of identical images, per input size
+    and queue depth (2 files, or 2 per core): one single-threaded file per core ('files'),
+    one file at a time with every core ('threads'), and the ConversionScheduler's own
+    per-file allocation ('auto'). The crossover is where 'threads' overtakes 'files'."""
+    if not _has_tool('magick'):
+        return [_summarize('threading', [], 0, 0, ['magick not installed'])]
+    cores = imaguick.CPU_CORES
+    strategies = {
+        'files': (imaguick.ConversionScheduler(cores, 0, cores), lambda mp: 0.0),
+        'threads': (imaguick.ConversionScheduler(1, 0, cores), lambda mp: cores * imaguick.MP_PER_THREAD),
+        'auto': (imaguick.ConversionScheduler(cores, 0, cores), lambda mp: mp),
+    }
+
+    def convert(src, dst):
+        t0 = time.perf_counter()
+        imaguick.convert_file(src, dst, params)
+        os.remove(dst)
+        return time.perf_counter() - t0
+
+    records = []
+    for fixture in [f for f in fixtures if f['ext'] == 'png' and not f['alpha']]:
+        for depth in (2, 2 * cores):
+            for strategy, (pool, megapixels) in strategies.items():
+                name = f"threading:{fixture['width']}x{fixture['height']}:{depth}:{strategy}"
+                samples, errors = [], 0
+                start = time.perf_counter()
+                for round_ in range(repeat):
+                    futures = [pool.submit(imaguick.LANE_BATCH, convert, fixture['path'],
+                                           os.path.join(output_folder, f'thr_{round_}_{i}.{output_format.lower()}'),
+                                           megapixels=megapixels(_mp(fixture)))
+                               for i in range(depth)]
+                    for future in futures:
+                        try:
+                            samples.append((future.result(), _mp(fixture)))
+                        except Exception as e:
+                            logging.error(f"{name} failed: {e}")
+                            errors += 1
+                records.append(_summarize(name, samples, errors, time.perf_counter() - start))
+    return records
+
+
+def bench_resize_batch(fixtures, repeat, form):
+    """Time the full /resize_batch flow (submit → async processing → ZIP) via the Flask test client."""
+    if not _has_tool('magick'):
+        return _summarize('resize_batch', [], 0, 0, ['magick not installed'])
+    client = imaguick.app.test_client()
+    targets = [f for f in fixtures if f['ext'] in ('png', 'jpg', 'tiff')]
+    batch_mp = sum(_mp(f) for f in targets)
+    samples, errors = [], 0
+    image_count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # process_single_file deletes sources on success — stage fresh copies each round
+        names = []
+        for fixture in targets:
+            name = f'{os.urandom(16).hex()}_{os.path.basename(fixture["path"])}'
+            shutil.copy(fixture['path'], imaguick.upload_path(name, create=True))
+            names.append(name)
+        t0 = time.perf_counter()
+        response = client.post('/resize_batch', data=dict(form, filenames=','.join(names)))
+        location = response.headers.get('Location', '')
+        if response.status_code != 302 or '/job/' not in location:
+            logging.error(f"/resize_batch returned {response.status_code}")
+            errors += len(names)
+            continue
+        job_id = location.rstrip('/').split('/')[-2]
+        deadline = time.monotonic() + BATCH_TIMEOUT
+        while time.monotonic() < deadline:
+            with imaguick.jobs_lock:
+                job = imaguick.jobs.get(job_id)
+                if job and job['status'] == 'complete':
+                    errors += job['errors']
+                    break
+            time.sleep(0.05)
+        else:
+            logging.error(f"Batch job {job_id} timed out")
+            errors += len(names)
+            continue
+        samples.append((time.perf_counter() - t0, batch_mp))
+        image_count += len(names)
+    elapsed = time.perf_counter() - start
+    record = _summarize('resize_batch', samples, errors, elapsed)
+    # Latencies are per batch here; throughput is reported per image
+    record['batch_size'] = len(targets)
+    record['images_per_s'] = round(image_count / elapsed, 3) if elapsed > 0 else None
+    return record
+
+
+# --- Report ---
+
+def _tool_version(cmd):
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        return (result.stdout or result.stderr).strip().splitlines()[0]
+    except Exception:
+        return None
+
+
+def environment_info():
+    """Describe the machine and commit so reports can be compared meaningfully."""
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        pass
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'imagemagick': _tool_version(['magick', '-version']) if _has_tool('magick') else None,
+        'cjxl': _tool_version(['cjxl', '--version']) if _has_tool('cjxl') else None,
+    }
+
+
+def compare_reports(baseline, current):
+    """Return per-scenario relative deltas between two reports (positive = faster)."""
+    base = {r['scenario']: r for r in baseline.get('results', [])}
+    deltas = {}
+    for record in current.get('results', []):
+        old = base.get(record['scenario'])
+        if not old:
+            continue
+        delta = {}
+        for key in ('images_per_s', 'mp_per_s'):
+            if old.get(key) and record.get(key):
+                delta[key] = round(record[key] / old[key] - 1, 4)
+        for key in ('p50_ms', 'p95_ms'):
+            if old.get(key) and record.get(key):
+                delta[key] = round(old[key] / record[key] - 1, 4)
+        deltas[record['scenario']] = delta
+    return deltas
+
+
+def run(sizes, repeat, scenarios, output_format, form):
+    """Run the selected scenarios in an isolated workspace and return the report dict."""
+    workspace = tempfile.mkdtemp(prefix='imaguick_bench_')
+    upload_folder = os.path.join(workspace, 'uploads')
+    output_folder = os.path.join(workspace, 'output')
+    os.makedirs(upload_folder)
+    os.makedirs(output_folder)
+    saved_config = (imaguick.app.config['UPLOAD_FOLDER'], imaguick.app.config['OUTPUT_FOLDER'])
+    # secure_path() confines the pipeline to these two roots
+    imaguick.app.config['UPLOAD_FOLDER'] = upload_folder
+    imaguick.app.config['OUTPUT_FOLDER'] = output_folder
+    try:
+        logging.info(f"Generating fixtures in {upload_folder}")
+        fixtures = generate_fixtures(upload_folder, sizes)
+        params = imaguick.extract_processing_params(dict(form, format=output_format))
+        command_params = {k: v for k, v in params.items()
+                          if k not in ('output_format', 'max_size_kb', 'use_cjxl')}
+        results = []
+        for scenario in scenarios:
+            logging.info(f"Running scenario {scenario}")
+            if scenario == 'prepare_input':
+                results.append(bench_prepare_input(fixtures, repeat))
+            elif scenario == 'analyze':
+                results.append(bench_analyze(fixtures, repeat))
+            elif scenario == 'dimensions':
+                results.append(bench_dimensions(fixtures, repeat))
+            elif scenario == 'convert':
+                results.append(bench_convert(fixtures, repeat, output_folder, output_format, command_params))
+            elif scenario == 'encoder_speed':
+                results.extend(bench_encoder_speed(fixtures, repeat, output_folder, params))
+            elif scenario == 'threading':
+                results.extend(bench_threading(fixtures, repeat, output_folder, output_format, params))
+            elif scenario == 'resize_batch':
+                results.append(bench_resize_batch(fixtures, repeat, dict(form, format=output_format)))
+        return {
+            'environment': environment_info(),
+            'config': {
+                'sizes': [f'{w}x{h}' for w, h in sizes],
+                'repeat': repeat,
+                'output_format': output_format,
+                'form': form,
+                'fixtures': len(fixtures),
+            },
+            'results': results,
+        }
+    finally:
+        imaguick.app.config['UPLOAD_FOLDER'], imaguick.app.config['OUTPUT_FOLDER'] = saved_config
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def _parse_size(value):
+    width, _, height = value.lower().partition('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ImaGUIck conversion pipeline.')
+    parser.add_argument('--sizes', nargs='+', type=_parse_size, help='Input sizes, e.g. 640x480 1920x1080')
+    parser.add_argument('--quick', action='store_true', help='Small inputs and a single round (smoke run).')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Rounds per scenario.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--format', default='WEBP', help='Output format for conversion scenarios.')
+    parser.add_argument('--resize', default='1920p', choices=['none', '1080p', '1920p', '50%'],
+                        help='Resize preset applied in conversion scenarios.')
+    parser.add_argument('--quality', default='85')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--compare', help='Baseline JSON report to compute deltas against.')
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    repeat = 1 if args.quick else args.repeat
+    form = {'quality': args.quality}
+    if args.resize == '1080p':
+        form['use_1080p'] = 'on'
+    elif args.resize == '1920p':
+        form['use_1920p'] = 'on'
+    elif args.resize == '50%':
+        form['percentage'] = '50'
+
+    report = run(sizes, repeat, args.scenarios, args.format.upper(), form)
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'] = {'baseline': args.compare, 'deltas': compare_reports(json.load(f), report)}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        logging.info(f"Report written to {args.output}")
+    else:
+        print(text)
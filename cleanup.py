@@ -2,94 +2,359 @@
 import os
 import sys
 import glob
+import time
 import shutil
+import sqlite3
 import logging
 import argparse
+from contextlib import closing
 from datetime import datetime, timedelta
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
+# Work trees are sharded as <kind>/<aa>/<bb>/<uuid> (see the storage layout in app.py)
+WORK_TREE_PATTERNS = [os.path.join(OUTPUT_FOLDER, kind, '*', '*', '*') for kind in ('jobs', 'single')]
 MAX_AGE_HOURS = 48
 ORPHAN_BATCH_AGE_HOURS = 2
+# Expiry index shared by every app process and the cleanup daemon. Relative paths are
+# resolved against the app directory, not the working directory of whoever imports this
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_PATH = os.path.join(APP_DIR, os.getenv('IMAGUICK_EXPIRY_INDEX', 'expiry.db'))
+SWEEP_INTERVAL = int(os.getenv('IMAGUICK_CLEANUP_INTERVAL', '60'))   # seconds between sweeps
+SCAN_INTERVAL_HOURS = 12        # full-tree reconciliation for files the index does not know
+SWEEP_BATCH = 500               # expired entries claimed per transaction
+DISK_HIGH_WATER = float(os.getenv('IMAGUICK_DISK_HIGH_WATER', '0.90'))   # fraction of the volume
+DISK_LOW_WATER = float(os.getenv('IMAGUICK_DISK_LOW_WATER', '0.80'))     # eviction stops here
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
+MAX_AGE = MAX_AGE_HOURS * 3600
+TEMP_MAX_AGE = ORPHAN_BATCH_AGE_HOURS * 3600
+# Job pins are never renewed: if a job's process dies, its files expire this long after being pinned
+PIN_LEASE = MAX_AGE
 
+logger = logging.getLogger('imaguick.cleanup')
 
-def cleanup_folders(remove_all=False):
-    """Remove files older than MAX_AGE_HOURS from uploads and output folders."""
+
+def path_size(path):
+    """Bytes used by a file, or by every file under a directory."""
+    try:
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(path) for name in files)
+    except OSError:
+        return 0
+
+
+def remove_path(path):
+    """Delete a file or directory tree. Returns False if it could not be removed."""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove {path}: {e}")
+        return False
+    return True
+
+
+class ExpiryIndex:
+    """SQLite index of every upload, output and temp file, keyed by path, with the time
+    it expires. Entries are written when the file is created, so cleanup pops expired
+    paths from an index on `expires` instead of stat-ing the whole tree.
+
+    Files belonging to a running job are pinned: they are never evicted for disk space,
+    and only expire if the job's process dies and the PIN_LEASE runs out. The job
+    unpins them, with a fresh MAX_AGE, when it finishes. Uploads still arriving are
+    pinned the same way, with a lease each chunk renews."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        with closing(self._connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS expiry (
+                path TEXT PRIMARY KEY,
+                job_id TEXT,
+                created REAL NOT NULL,
+                expires REAL NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0)''')
+            db.execute('CREATE INDEX IF NOT EXISTS expiry_by_expires ON expiry (expires)')
+            db.execute('CREATE INDEX IF NOT EXISTS expiry_by_job ON expiry (job_id)')
+
+    def _connect(self):
+        # One short-lived connection per call: the index is shared across threads and processes
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def track(self, *paths, max_age=MAX_AGE, job_id=None, pinned=False, lease=PIN_LEASE):
+        """Record (or refresh) paths that expire max_age seconds from now, in one transaction.
+        Pinned paths expire when their lease runs out instead."""
+        now = time.time()
+        expires = now + (lease if pinned else max_age)
+        with closing(self._connect()) as db, db:
+            db.executemany('''INSERT INTO expiry (path, job_id, created, expires, pinned, size)
+                              VALUES (?, ?, ?, ?, ?, ?)
+                              ON CONFLICT (path) DO UPDATE SET job_id = COALESCE(excluded.job_id, job_id),
+                                  expires = excluded.expires, pinned = excluded.pinned, size = excluded.size''',
+                           [(os.path.abspath(p), job_id, now, expires, int(pinned), path_size(p)) for p in paths])
+
+    def forget(self, *paths):
+        """Drop paths the app has removed itself."""
+        with closing(self._connect()) as db, db:
+            db.executemany('DELETE FROM expiry WHERE path = ?', [(os.path.abspath(p),) for p in paths])
+
+    def pin_job(self, job_id, *paths):
+        """Pin a running job's files (its work tree)."""
+        self.track(*paths, job_id=job_id, pinned=True)
+
+    def release_job(self, job_id, max_age=MAX_AGE):
+        """Unpin a finished job's files, measure them once, and start their expiry clock."""
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            paths = [row[0] for row in db.execute('SELECT path FROM expiry WHERE job_id = ?', (job_id,))]
+            db.executemany('UPDATE expiry SET pinned = 0, expires = ?, size = ? WHERE path = ?',
+                           [(now + max_age, path_size(p), p) for p in paths])
+
+    def forget_job(self, job_id):
+        with closing(self._connect()) as db, db:
+            db.execute('DELETE FROM expiry WHERE job_id = ?', (job_id,))
+
+    def pop_expired(self, now=None, limit=SWEEP_BATCH):
+        """Claim up to `limit` expired paths, oldest expiry first, removing them from the
+        index in the same transaction so concurrent sweepers never claim the same path."""
+        now = now or time.time()
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            paths = [row[0] for row in db.execute(
+                'SELECT path FROM expiry WHERE expires <= ? ORDER BY expires LIMIT ?', (now, limit))]
+            db.executemany('DELETE FROM expiry WHERE path = ?', [(p,) for p in paths])
+            db.execute('COMMIT')
+        return paths
+
+    def pop_oldest(self, bytes_needed):
+        """Claim unpinned paths, oldest completed job first and loose files after them,
+        until their recorded sizes add up to bytes_needed."""
+        claimed, freed = [], 0
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            for job_id, _ in db.execute('''SELECT job_id, MIN(created) FROM expiry
+                                           WHERE job_id IS NOT NULL GROUP BY job_id
+                                           HAVING MAX(pinned) = 0 ORDER BY MIN(created)''').fetchall():
+                if freed >= bytes_needed:
+                    break
+                for path, size in db.execute('SELECT path, size FROM expiry WHERE job_id = ?', (job_id,)).fetchall():
+                    claimed.append(path)
+                    freed += size
+            if freed < bytes_needed:
+                for path, size in db.execute('''SELECT path, size FROM expiry WHERE job_id IS NULL AND pinned = 0
+                                                ORDER BY created'''):
+                    if freed >= bytes_needed:
+                        break
+                    claimed.append(path)
+                    freed += size
+            db.executemany('DELETE FROM expiry WHERE path = ?', [(p,) for p in claimed])
+            db.execute('COMMIT')
+        return claimed
+
+    def pinned_paths(self):
+        with closing(self._connect()) as db:
+            return {row[0] for row in db.execute('SELECT path FROM expiry WHERE pinned = 1')}
+
+    def tracked_paths(self):
+        with closing(self._connect()) as db:
+            return {row[0] for row in db.execute('SELECT path FROM expiry')}
+
+    def clear_unpinned(self):
+        with closing(self._connect()) as db, db:
+            db.execute('DELETE FROM expiry WHERE pinned = 0')
+
+
+class NullIndex:
+    """Stands in for the ExpiryIndex where nothing sweeps: the app imported as a library
+    (imaguick.py, benchmark.py) removes its own files, so it records nothing."""
+
+    def track(self, *paths, max_age=MAX_AGE, job_id=None, pinned=False, lease=PIN_LEASE):
+        pass
+
+    def forget(self, *paths):
+        pass
+
+    def pin_job(self, job_id, *paths):
+        pass
+
+    def release_job(self, job_id, max_age=MAX_AGE):
+        pass
+
+    def forget_job(self, job_id):
+        pass
+
+
+def sweep_expired(index, now=None):
+    """Delete every expired indexed path. Costs O(expired), whatever the tree size."""
+    removed = 0
+    while True:
+        paths = index.pop_expired(now)
+        for path in paths:
+            if remove_path(path):
+                removed += 1
+                logger.info(f"Removed expired {path}")
+        if len(paths) < SWEEP_BATCH:
+            return removed
+
+
+def enforce_high_water(index, folder=OUTPUT_FOLDER):
+    """Once the volume holding `folder` is fuller than DISK_HIGH_WATER, evict the oldest
+    completed jobs (then loose uploads and outputs) until it is back under DISK_LOW_WATER."""
+    try:
+        usage = shutil.disk_usage(folder)
+    except OSError:
+        return 0
+    if usage.used <= usage.total * DISK_HIGH_WATER:
+        return 0
+    bytes_needed = usage.used - usage.total * DISK_LOW_WATER
+    paths = index.pop_oldest(bytes_needed)
+    for path in paths:
+        remove_path(path)
+    logger.warning(f"Disk {usage.used / usage.total:.0%} full: evicted {len(paths)} path(s) "
+                   f"to free {bytes_needed / 1e6:.0f} MB")
+    return len(paths)
+
+
+def _is_protected(path, protected):
+    """True if path, or a directory above it, is in `protected`."""
+    path = os.path.abspath(path)
+    while path not in protected:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+    return True
+
+
+def cleanup_folders(remove_all=False, index=None):
+    """Full-tree reconciliation: remove files older than MAX_AGE_HOURS from uploads and
+    output folders. The expiry index handles everything the app creates; this catches
+    files it never recorded (older trees, crashes). Indexed paths are left to the index,
+    and files of running jobs are never touched, even with remove_all."""
     now = datetime.now()
     folders = [UPLOAD_FOLDER, OUTPUT_FOLDER]
+    index = index or ExpiryIndex()
+    protected = index.pinned_paths() if remove_all else index.tracked_paths()
 
     for folder in folders:
         if not os.path.exists(folder):
-            logging.warning(f"Folder {folder} does not exist")
+            logger.warning(f"Folder {folder} does not exist")
             continue
 
-        logging.info(f"Starting cleanup of {folder}")
+        logger.info(f"Starting cleanup of {folder}")
         for root, dirs, files in os.walk(folder, topdown=False):
+            if _is_protected(root, protected):
+                continue
             for name in files:
                 filepath = os.path.join(root, name)
+                if os.path.abspath(filepath) in protected:
+                    continue
                 mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
                 age = now - mtime
 
                 if remove_all or age > timedelta(hours=MAX_AGE_HOURS):
                     try:
                         os.remove(filepath)
-                        logging.info(f"Removed {filepath} (age: {age})")
+                        logger.info(f"Removed {filepath} (age: {age})")
                     except Exception as e:
-                        logging.error(f"Error removing {filepath}: {e}")
+                        logger.error(f"Error removing {filepath}: {e}")
 
             for name in dirs:
                 dirpath = os.path.join(root, name)
+                if os.path.abspath(dirpath) in protected:
+                    continue
                 try:
+                    # A shard directory the app has just created is about to receive a file
+                    if not remove_all and now - datetime.fromtimestamp(os.path.getmtime(dirpath)) < timedelta(
+                            hours=ORPHAN_BATCH_AGE_HOURS):
+                        continue
                     os.rmdir(dirpath)
-                    logging.info(f"Removed empty directory {dirpath}")
+                    logger.info(f"Removed empty directory {dirpath}")
                 except OSError as e:
-                    logging.error(f"Could not remove directory {dirpath}: {e}")
+                    logger.debug(f"Could not remove directory {dirpath}: {e}")
 
-    cleanup_orphan_batch_dirs(now, remove_all)
-    cleanup_jxl_tmp_files()
+    cleanup_orphan_batch_dirs(now, remove_all, protected)
+    cleanup_jxl_tmp_files(now, protected)
+    if remove_all:
+        index.clear_unpinned()
 
 
-def cleanup_orphan_batch_dirs(now, remove_all=False):
-    """Remove batch_* directories that were not finalised (no corresponding ZIP or older than ORPHAN_BATCH_AGE_HOURS)."""
-    if not os.path.exists(OUTPUT_FOLDER):
-        return
-
-    for name in os.listdir(OUTPUT_FOLDER):
-        if not name.startswith('batch_'):
-            continue
-        batch_path = os.path.join(OUTPUT_FOLDER, name)
-        if not os.path.isdir(batch_path):
+def cleanup_orphan_batch_dirs(now, remove_all=False, protected=frozenset()):
+    """Remove unindexed job and single-image work trees older than ORPHAN_BATCH_AGE_HOURS."""
+    for batch_path in (path for pattern in WORK_TREE_PATTERNS for path in glob.glob(pattern)):
+        if not os.path.isdir(batch_path) or os.path.abspath(batch_path) in protected:
             continue
         try:
             mtime = datetime.fromtimestamp(os.path.getmtime(batch_path))
             age = now - mtime
             if remove_all or age > timedelta(hours=ORPHAN_BATCH_AGE_HOURS):
                 shutil.rmtree(batch_path, ignore_errors=True)
-                logging.info(f"Removed orphan batch dir {batch_path} (age: {age})")
+                logger.info(f"Removed orphan work tree {batch_path} (age: {age})")
+        except Exception as e:
+            logger.error(f"Error removing work tree {batch_path}: {e}")
+
+
+def cleanup_jxl_tmp_files(now, protected=frozenset()):
+    """Remove leftover, unindexed imaguick decoder temp files from /tmp. Temps younger than
+    ORPHAN_BATCH_AGE_HOURS may still be read by a running conversion and are kept, even by --all."""
+    for tmp_file in glob.glob('/tmp/imaguick_*'):
+        if tmp_file in protected:
+            continue
+        try:
+            age = now - datetime.fromtimestamp(os.path.getmtime(tmp_file))
+            if age > timedelta(hours=ORPHAN_BATCH_AGE_HOURS):
+                os.remove(tmp_file)
+                logger.info(f"Removed temp file {tmp_file}")
         except Exception as e:
-            logging.error(f"Error removing batch dir {batch_path}: {e}")
+            logger.error(f"Could not remove temp file {tmp_file}: {e}")
 
 
-def cleanup_jxl_tmp_files():
-    """Remove leftover imaguick JXL temp files from /tmp."""
-    for tmp_file in glob.glob('/tmp/imaguick_*.png'):
+def run_sweeper(index, interval=SWEEP_INTERVAL, scan_interval=SCAN_INTERVAL_HOURS * 3600):
+    """Sweep loop for the daemon (or an app thread): expired entries every `interval`
+    seconds, the disk high-water mark with them, and a full scan every `scan_interval`
+    seconds (none if 0)."""
+    last_scan = 0.0
+    while True:
         try:
-            os.remove(tmp_file)
-            logging.info(f"Removed temp JXL file {tmp_file}")
+            sweep_expired(index)
+            enforce_high_water(index)
+            if scan_interval and time.time() - last_scan >= scan_interval:
+                cleanup_folders(index=index)
+                last_scan = time.time()
         except Exception as e:
-            logging.error(f"Could not remove temp JXL file {tmp_file}: {e}")
+            logger.error(f"Cleanup sweep failed: {e}")
+        time.sleep(interval)
 
 
 if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
     parser = argparse.ArgumentParser(description='Cleanup old files from uploads and output folders.')
-    parser.add_argument('--all', action='store_true', help='Remove all files, regardless of age.')
+    parser.add_argument('--all', action='store_true', help='Remove all files, regardless of age (files of running jobs are kept).')
+    parser.add_argument('--daemon', action='store_true',
+                        help=f'Keep running: sweep expired files every {SWEEP_INTERVAL} s and rescan '
+                             f'the folders every {SCAN_INTERVAL_HOURS} h.')
     args = parser.parse_args()
 
-    cleanup_folders(remove_all=args.all)
+    expiry_index = ExpiryIndex()
+    if args.daemon:
+        run_sweeper(expiry_index)
+    elif args.all:
+        cleanup_folders(remove_all=True, index=expiry_index)
+    else:
+        sweep_expired(expiry_index)
+        enforce_high_water(expiry_index)
+        cleanup_folders(index=expiry_index)
@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""Headless command-line entry point and Python API for bulk conversion.
+
+Converts a directory tree server-side with the same pipeline as the web app
+(extract_processing_params → prepare_input_file → build_imagemagick_command),
+in parallel across all cores, without the HTTP upload / ZIP download round-trip:
+
+    python -m imaguick convert /data/in /data/out --preset web-1920
+    python -m imaguick convert /data/in /data/out --format AVIF --quality 60 --1080p
+    python -m imaguick watch /data/hot /data/out --preset web-1920
+
+`watch` is a hot-folder daemon (Linux inotify): files dropped into the source tree
+are converted as soon as they are completely written, with a .status.json
+sidecar per output.
+
+From Python:
+
+    import imaguick
+    stats = imaguick.convert_directory('/data/in', '/data/out', imaguick.build_params('web-1920'))
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import errno
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from flask.logging import default_handler
+
+# Expired uploads and outputs are swept by the web server, not by headless runs
+os.environ.setdefault('IMAGUICK_CLEANUP_IN_PROCESS', '0')
+os.environ.setdefault('IMAGUICK_HEADLESS', '1')
+import app as imaguick_app
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+# Let app.logger records flow through the root handler only
+imaguick_app.app.logger.removeHandler(default_handler)
+
+
+def build_params(preset=None, **overrides):
+    """Build processing params from a named preset plus form-style overrides
+    (format='WEBP', quality='85', use_1920p='on', ...)."""
+    form = {}
+    if preset:
+        if preset not in imaguick_app.PRESETS:
+            raise ValueError(f"Unknown preset: {preset}")
+        form.update(imaguick_app.PRESETS[preset])
+    form.update({k: v for k, v in overrides.items() if v not in (None, False)})
+    return imaguick_app.extract_processing_params(form)
+
+
+def output_name(filename, params, suffix=''):
+    """Output filename for a source file: same stem, target format extension."""
+    stem, ext = os.path.splitext(filename)
+    if params['output_format']:
+        ext = f".{params['output_format'].lower()}"
+    return f'{stem}{suffix}{ext}'
+
+
+def iter_sources(src_root):
+    """Yield source paths (relative to src_root) accepted by allowed_file()."""
+    for root, dirs, files in os.walk(src_root):
+        dirs.sort()
+        for name in sorted(files):
+            if imaguick_app.allowed_file(name):
+                yield os.path.relpath(os.path.join(root, name), src_root)
+
+
+def auto_output_candidates(dst_path):
+    """Paths an AUTO-format output may have been written to (the winner decides the extension)."""
+    stem = os.path.splitext(dst_path)[0]
+    return [stem + ext for ext in sorted(set(imaguick_app.AUTO_EXTENSIONS.values()))]
+
+
+def is_up_to_date(src_path, dst_path):
+    """True if dst exists and is at least as new as src. Multi-page sources converted one
+    file per page are checked through their page directory (dst without extension)."""
+    if dst_path.endswith(f'.{imaguick_app.AUTO_FORMAT.lower()}'):
+        return any(is_up_to_date(src_path, path) for path in auto_output_candidates(dst_path))
+    if not os.path.exists(dst_path) and os.path.isdir(os.path.splitext(dst_path)[0]):
+        dst_path = os.path.splitext(dst_path)[0]
+    try:
+        return os.path.getmtime(dst_path) >= os.path.getmtime(src_path)
+    except OSError:
+        return False
+
+
+def _init_worker(src_root, dst_root, verbose, threads):
+    """Point the app's two secure_path() roots at this run's source and destination,
+    and split the cores between the worker processes as ImageMagick threads."""
+    imaguick_app.app.config['UPLOAD_FOLDER'] = src_root
+    imaguick_app.app.config['OUTPUT_FOLDER'] = dst_root
+    imaguick_app.worker_state.threads = threads
+    imaguick_app.app.logger.setLevel(logging.INFO if verbose else logging.WARNING)
+    # Ctrl+C / SIGTERM are handled by the parent, which lets in-flight files finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _worker_pool(src_root, dst_root, workers, verbose):
+    threads = max(1, imaguick_app.CPU_CORES // workers)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(src_root, dst_root, verbose, threads))
+
+
+def _check_roots(src_root, dst_root):
+    """Absolute source/destination roots; the destination may not live inside the source."""
+    src_root = os.path.abspath(src_root)
+    dst_root = os.path.abspath(dst_root)
+    if not os.path.isdir(src_root):
+        raise ValueError(f"Source directory does not exist: {src_root}")
+    if dst_root == src_root or dst_root.startswith(os.path.join(src_root, '')):
+        raise ValueError("Destination must not be inside the source tree")
+    os.makedirs(dst_root, exist_ok=True)
+    return src_root, dst_root
+
+
+def convert_one(src_path, dst_path, params):
+    """Convert a single file. Runs inside a pool worker.
+    Returns (output path, megapixels, bytes_in, bytes_out, method), method being 'magick',
+    'auto:<FORMAT>', 'pages:<N>', or 'hardlink' / 'copy' when the source already satisfied
+    the request. With the AUTO format the output path takes the extension of the chosen
+    format; multi-page sources written one file per page produce a directory (dst without
+    extension)."""
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    # Write next to the target and rename, so an interrupted run never leaves a
+    # truncated file that the up-to-date check would later accept.
+    stem, ext = os.path.splitext(dst_path)
+    partial_path = f'{stem}.partial{os.getpid()}{ext}'
+    try:
+        written_path, method = imaguick_app.convert_file(src_path, partial_path, params)
+        if os.path.isdir(written_path):
+            dst_path = stem
+            shutil.rmtree(dst_path, ignore_errors=True)
+        else:
+            dst_path = stem + os.path.splitext(written_path)[1]
+        os.replace(written_path, dst_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        if os.path.isdir(os.path.splitext(partial_path)[0]):
+            shutil.rmtree(os.path.splitext(partial_path)[0], ignore_errors=True)
+    if os.path.isdir(dst_path):
+        bytes_out = sum(os.path.getsize(os.path.join(dst_path, page)) for page in os.listdir(dst_path))
+    else:
+        bytes_out = os.path.getsize(dst_path)
+    return (dst_path, imaguick_app.estimate_megapixels(src_path), os.path.getsize(src_path), bytes_out, method)
+
+
+def convert_directory(src_root, dst_root, params, workers=None, force=False, suffix='', progress=None,
+                      verbose=False):
+    """Convert every supported image under src_root into the mirrored tree under dst_root.
+
+    Files whose output is newer than the source are skipped unless force=True.
+    progress, if given, is called as progress(rel_path, status, error) after each file.
+    Returns a stats dict (counts, elapsed, images/s, MP/s, bytes in/out)."""
+    src_root, dst_root = _check_roots(src_root, dst_root)
+    workers = workers or os.cpu_count() or 1
+    stats = {'converted': 0, 'passed_through': 0, 'skipped': 0, 'failed': 0, 'megapixels': 0.0,
+             'bytes_in': 0, 'bytes_out': 0}
+    claimed = set()
+    started = time.monotonic()
+
+    def report(rel, status, error=None):
+        if progress:
+            progress(rel, status, error)
+
+    with _worker_pool(src_root, dst_root, workers, verbose) as pool:
+        pending = {}
+        # Keep a bounded window of submitted tasks so trees with hundreds of
+        # thousands of files don't materialise every future up front.
+        window = workers * 4
+        for rel in iter_sources(src_root):
+            src_path = os.path.join(src_root, rel)
+            dst_rel = os.path.join(os.path.dirname(rel), output_name(os.path.basename(rel), params, suffix))
+            dst_path = os.path.join(dst_root, dst_rel)
+            if dst_path in claimed:
+                stats['failed'] += 1
+                report(rel, 'failed', f'output name collides with another source: {dst_rel}')
+                continue
+            claimed.add(dst_path)
+            if not force and is_up_to_date(src_path, dst_path):
+                stats['skipped'] += 1
+                report(rel, 'skipped')
+                continue
+
+            pending[pool.submit(convert_one, src_path, dst_path, params)] = rel
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _collect(future, pending.pop(future), stats, report)
+
+        for future in list(pending):
+            _collect(future, pending.pop(future), stats, report)
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_s'] = round(elapsed, 2)
+    stats['images_per_s'] = round(stats['converted'] / elapsed, 2) if elapsed > 0 else None
+    stats['mp_per_s'] = round(stats['megapixels'] / elapsed, 2) if elapsed > 0 else None
+    stats['megapixels'] = round(stats['megapixels'], 1)
+    stats['workers'] = workers
+    return stats
+
+
+def _collect(future, rel, stats, report):
+    try:
+        _, mp, bytes_in, bytes_out, method = future.result()
+    except Exception as e:
+        stats['failed'] += 1
+        report(rel, 'failed', str(e))
+        return
+    stats['converted'] += 1
+    if method in ('hardlink', 'copy'):
+        stats['passed_through'] += 1
+    stats['megapixels'] += mp
+    stats['bytes_in'] += bytes_in
+    stats['bytes_out'] += bytes_out
+    report(rel, 'converted')
+
+
+BATCH_GROUPING_WINDOW = 0.5   # seconds; files settling this close together share a batch
+
+
+class Inotify:
+    """Minimal ctypes binding to Linux inotify, so watch mode needs no extra dependency."""
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if not self._libc or not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'watch mode requires Linux inotify')
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'cannot watch {path}')
+        self._dirs[wd] = path
+
+    def read_events(self):
+        """Yield (directory, mask, name) for everything currently queued on the descriptor."""
+        data = os.read(self.fd, 256 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            yield self._dirs.get(wd), mask, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+def write_sidecar(dst_path, status):
+    """Write <output>.status.json atomically, so readers never see half a document."""
+    sidecar = f'{dst_path}.status.json'
+    tmp = f'{sidecar}.tmp{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp, sidecar)
+
+
+class HotFolder:
+    """Watch-folder daemon: converts files dropped under src_root into dst_root.
+
+    A file is picked up once it has been closed (or moved in) and then left untouched
+    for `debounce` seconds, so slow copies and writers that reopen the file aren't
+    converted half-written. Files that become ready together form a batch. At most
+    workers * 2 files are handed to the process pool at once; the rest wait in order.
+    The loop blocks in select() on the inotify descriptor and a wake-up pipe, so an
+    idle folder costs nothing."""
+
+    def __init__(self, src_root, dst_root, params, workers=None, debounce=2.0, suffix='', verbose=False):
+        self.src_root, self.dst_root = _check_roots(src_root, dst_root)
+        self.params = params
+        self.workers = workers or os.cpu_count() or 1
+        self.debounce = debounce
+        self.suffix = suffix
+        self.verbose = verbose
+        self.settling = {}      # src path -> monotonic time of its last write event
+        self.ready = deque()    # (batch id, rel path) waiting for a pool slot
+        self.in_flight = {}     # future -> (batch id, rel path, dst path, started)
+        self.batches = {}       # batch id -> counters
+        self.batch_seq = 0
+        self.stopping = False
+        self.inotify = Inotify()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+
+    def stop(self, *_):
+        self.stopping = True
+        self._wake()
+
+    def _wake(self, *_):
+        try:
+            os.write(self._wake_w, b'.')
+        except BlockingIOError:
+            pass
+
+    def _watch_tree(self, root):
+        """Watch root and every directory below it, queuing files already present."""
+        for dirpath, dirs, _files in os.walk(root):
+            dirs.sort()
+            self.inotify.add_watch(dirpath)
+        # Scanned after the watches exist, so nothing written meanwhile is missed
+        rel_root = os.path.relpath(root, self.src_root)
+        for rel in iter_sources(root):
+            self._touch(os.path.normpath(os.path.join(self.src_root, rel_root, rel)))
+
+    def _touch(self, src_path):
+        name = os.path.basename(src_path)
+        if name.startswith('.') or not imaguick_app.allowed_file(name):
+            return
+        self.settling[src_path] = time.monotonic()
+
+    def _dst_path(self, rel):
+        return os.path.join(self.dst_root, os.path.dirname(rel),
+                            output_name(os.path.basename(rel), self.params, self.suffix))
+
+    def _handle_events(self):
+        for directory, mask, name in self.inotify.read_events():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflowed; rescanning the source tree")
+                self._watch_tree(self.src_root)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & Inotify.IN_ISDIR:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self._watch_tree(path)
+            elif mask & (Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO):
+                self._touch(path)
+
+    def _collect_settled(self):
+        """Move files quiet for `debounce` seconds into a new batch. Returns seconds until the next one settles."""
+        now = time.monotonic()
+        settled = sorted(p for p, t in self.settling.items() if now - t >= self.debounce)
+        batch = []
+        for src_path in settled:
+            del self.settling[src_path]
+            rel = os.path.relpath(src_path, self.src_root)
+            if os.path.isfile(src_path) and not is_up_to_date(src_path, self._dst_path(rel)):
+                batch.append(rel)
+        if batch:
+            self.batch_seq += 1
+            self.batches[self.batch_seq] = {'total': len(batch), 'converted': 0, 'failed': 0,
+                                            'megapixels': 0.0, 'started': now}
+            self.ready.extend((self.batch_seq, rel) for rel in batch)
+            logging.info(f"Batch {self.batch_seq}: {len(batch)} file(s) ready")
+        if not self.settling:
+            return None
+        # Wake when the next file settles, stretched to include any arriving just behind it,
+        # so a burst of drops becomes one batch instead of many
+        deadlines = sorted(t + self.debounce for t in self.settling.values())
+        wake = max(d for d in deadlines if d <= deadlines[0] + BATCH_GROUPING_WINDOW)
+        return max(0.0, wake - now)
+
+    def _submit_ready(self, pool):
+        while self.ready and len(self.in_flight) < self.workers * 2:
+            batch_id, rel = self.ready.popleft()
+            src_path = os.path.join(self.src_root, rel)
+            dst_path = self._dst_path(rel)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            write_sidecar(dst_path, {'source': rel, 'status': 'processing', 'batch': batch_id})
+            future = pool.submit(convert_one, src_path, dst_path, self.params)
+            future.add_done_callback(self._wake)
+            self.in_flight[future] = (batch_id, rel, dst_path, time.time())
+
+    def _reap_finished(self):
+        for future in [f for f in self.in_flight if f.done()]:
+            batch_id, rel, dst_path, started = self.in_flight.pop(future)
+            batch = self.batches[batch_id]
+            status = {'source': rel, 'output': os.path.relpath(dst_path, self.dst_root), 'batch': batch_id,
+                      'started': started, 'finished': time.time(), 'elapsed_s': round(time.time() - started, 3)}
+            try:
+                written_path, mp, bytes_in, bytes_out, method = future.result()
+            except Exception as e:
+                batch['failed'] += 1
+                status.update(status='failed', error=str(e))
+                logging.error(f"{rel}: {e}")
+            else:
+                batch['converted'] += 1
+                batch['megapixels'] += mp
+                status.update(status='done', output=os.path.relpath(written_path, self.dst_root),
+                              method=method, megapixels=round(mp, 2),
+                              bytes_in=bytes_in, bytes_out=bytes_out)
+                if self.verbose:
+                    logging.info(f"{rel}: converted")
+            write_sidecar(dst_path, status)
+            if batch['converted'] + batch['failed'] == batch['total']:
+                elapsed = time.monotonic() - batch['started']
+                logging.info(f"Batch {batch_id}: {batch['converted']} converted, {batch['failed']} failed in "
+                             f"{elapsed:.1f}s ({batch['megapixels'] / elapsed if elapsed else 0:.1f} MP/s)")
+                del self.batches[batch_id]
+
+    def run(self):
+        """Process until stop() (SIGINT/SIGTERM), then let in-flight files finish."""
+        self._watch_tree(self.src_root)
+        logging.info(f"Watching {self.src_root} -> {self.dst_root} ({self.workers} workers, "
+                     f"{self.debounce}s debounce)")
+        with _worker_pool(self.src_root, self.dst_root, self.workers, self.verbose) as pool:
+            while not self.stopping or self.in_flight:
+                timeout = None if self.stopping else self._collect_settled()
+                if not self.stopping:
+                    self._submit_ready(pool)
+                readable, _, _ = select.select([self.inotify.fd, self._wake_r], [], [], timeout)
+                if self._wake_r in readable:
+                    os.read(self._wake_r, 4096)
+                if self.inotify.fd in readable:
+                    self._handle_events()
+                self._reap_finished()
+        self.inotify.close()
+        logging.info(f"Stopped watching; {len(self.ready) + len(self.settling)} file(s) left for the next start")
+
+
+def watch_directory(src_root, dst_root, params, workers=None, debounce=2.0, suffix='', verbose=False):
+    """Run the hot-folder daemon in the foreground until SIGINT/SIGTERM."""
+    hot_folder = HotFolder(src_root, dst_root, params, workers=workers, debounce=debounce,
+                           suffix=suffix, verbose=verbose)
+    signal.signal(signal.SIGINT, hot_folder.stop)
+    signal.signal(signal.SIGTERM, hot_folder.stop)
+    hot_folder.run()
+
+
+def _add_processing_arguments(parser):
+    """Options shared by every subcommand that runs the pipeline."""
+    parser.add_argument('--preset', choices=sorted(imaguick_app.PRESETS), help='Named processing preset.')
+    parser.add_argument('--format', help='Output format (overrides the preset).')
+    parser.add_argument('--quality', help='Output quality 1-100.')
+    parser.add_argument('--max-size', dest='max_size_kb', metavar='KB',
+                        help='Search quality per file so the output stays under KB kilobytes.')
+    parser.add_argument('--speed', dest='encoder_speed', choices=sorted(imaguick_app.ENCODER_SPEEDS),
+                        help='AVIF/HEIC speed, WEBP method and JXL effort preset.')
+    parser.add_argument('--cjxl', dest='use_cjxl', action='store_true', help='Encode JXL output with cjxl.')
+    parser.add_argument('--width')
+    parser.add_argument('--height')
+    parser.add_argument('--percentage')
+    parser.add_argument('--keep-ratio', action='store_true')
+    parser.add_argument('--1080p', dest='use_1080p', action='store_true', help='Fit within 1080x1080.')
+    parser.add_argument('--1920p', dest='use_1920p', action='store_true', help='Fit within 1920x1920.')
+    parser.add_argument('--sharpen', choices=sorted(imaguick_app.ALLOWED_SHARPEN_LEVELS))
+    parser.add_argument('--auto-level', action='store_true')
+    parser.add_argument('--auto-gamma', action='store_true')
+
+
+def params_from_args(args):
+    """Translate parsed CLI arguments into pipeline params."""
+    checkbox = lambda flag: 'on' if flag else None
+    return build_params(
+        args.preset,
+        format=args.format,
+        quality=args.quality,
+        max_size_kb=args.max_size_kb,
+        encoder_speed=args.encoder_speed,
+        use_cjxl=checkbox(args.use_cjxl),
+        width=args.width,
+        height=args.height,
+        percentage=args.percentage,
+        keep_ratio=checkbox(args.keep_ratio),
+        use_1080p=checkbox(args.use_1080p),
+        use_1920p=checkbox(args.use_1920p),
+        use_sharpen=checkbox(args.sharpen),
+        sharpen_level=args.sharpen,
+        auto_level=checkbox(args.auto_level),
+        auto_gamma=checkbox(args.auto_gamma),
+    )
+
+
+def cmd_convert(args):
+    params = params_from_args(args)
+
+    def progress(rel, status, error):
+        if status == 'failed':
+            logging.error(f"{rel}: {error}")
+        elif args.verbose:
+            logging.info(f"{rel}: {status}")
+
+    stats = convert_directory(args.src, args.dst, params, workers=args.workers, force=args.force,
+                              suffix=args.suffix, progress=progress, verbose=args.verbose)
+    logging.info(
+        f"{stats['converted']} converted ({stats['passed_through']} passed through unchanged), "
+        f"{stats['skipped']} up to date, {stats['failed']} failed "
+        f"in {stats['elapsed_s']}s — {stats['images_per_s']} images/s, {stats['mp_per_s']} MP/s "
+        f"({stats['workers']} workers)"
+    )
+    return 1 if stats['failed'] else 0
+
+
+def cmd_watch(args):
+    watch_directory(args.src, args.dst, params_from_args(args), workers=args.workers, debounce=args.debounce,
+                    suffix=args.suffix, verbose=args.verbose)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='imaguick', description='ImaGUIck headless tools.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help='Convert a directory tree.')
+    convert.add_argument('src', help='Source directory.')
+    convert.add_argument('dst', help='Destination directory (mirrors the source tree).')
+    _add_processing_arguments(convert)
+    convert.add_argument('--workers', type=int, help='Parallel processes (default: all cores).')
+    convert.add_argument('--force', action='store_true', help='Reconvert even if outputs are up to date.')
+    convert.add_argument('--suffix', default='', help='Suffix appended to output stems, e.g. _imaGUIck.')
+    convert.add_argument('-v', '--verbose', action='store_true')
+    convert.set_defaults(func=cmd_convert)
+
+    watch = subparsers.add_parser('watch', help='Convert files as they are dropped into a folder.')
+    watch.add_argument('src', help='Hot folder to watch (subdirectories included).')
+    watch.add_argument('dst', help='Destination directory (mirrors the source tree).')
+    _add_processing_arguments(watch)
+    watch.add_argument('--workers', type=int, help='Parallel processes (default: all cores).')
+    watch.add_argument('--debounce', type=float, default=2.0,
+                       help='Seconds a file must stay untouched before it is converted (default: 2).')
+    watch.add_argument('--suffix', default='', help='Suffix appended to output stems, e.g. _imaGUIck.')
+    watch.add_argument('-v', '--verbose', action='store_true')
+    watch.set_defaults(func=cmd_watch)
+
+    presets = subparsers.add_parser('presets', help='List the available presets.')
+    presets.set_defaults(func=lambda args: print('\n'.join(
+        f'{name:<12} {fields}' for name, fields in sorted(imaguick_app.PRESETS.items()))) or 0)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""Load generator for a running ImaGUIck instance.
+
+Simulates N concurrent users going through the full browser flow —
+POST /upload → /resize_batch_options → POST /resize_batch → SSE on
+/job/<id>/status → GET /download_batch/<id>/<zip> — and reports end-to-end and
+per-phase latency percentiles, error rates and server resource usage as JSON.
+
+    docker compose up -d
+    python loadtest.py --url http://localhost:5000 --users 8 --iterations 3 --container imaguick
+"""
+import os
+import io
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from collections import defaultdict
+from urllib.parse import urljoin
+
+import requests
+from PIL import Image
+
+# Configuration
+DEFAULT_URL = 'http://localhost:5000'
+DEFAULT_SIZES = [(800, 600), (1920, 1080), (3000, 2000)]
+DEFAULT_FORMATS = ['jpg', 'png', 'webp']
+SSE_TIMEOUT = 1800
+SAMPLE_INTERVAL = 1.0
+PHASES = ['upload', 'options', 'submit', 'processing', 'download', 'total']
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+
+
+def _percentile(values, pct):
+    """Linear-interpolated percentile of a list of floats."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _synthetic_bytes(width, height, fmt, seed):
+    """Encode a noisy gradient so uploads have realistic entropy."""
+    rng = random.Random(seed)
+    base = Image.radial_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), rng.randint(16, 64))
+    img = Image.merge('RGB', (base, noise, Image.linear_gradient('L').resize((width, height))))
+    buf = io.BytesIO()
+    pil_format = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'tiff': 'TIFF'}[fmt]
+    img.save(buf, pil_format, **({'quality': 90} if fmt in ('jpg', 'webp') else {}))
+    return buf.getvalue()
+
+
+def build_corpus(sizes, formats, variants, input_dir=None):
+    """Return a list of (filename, bytes) the simulated users draw their batches from."""
+    corpus = []
+    if input_dir:
+        for name in sorted(os.listdir(input_dir)):
+            path = os.path.join(input_dir, name)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    corpus.append((name, f.read()))
+        if not corpus:
+            raise SystemExit(f"No files found in {input_dir}")
+        return corpus
+    for width, height in sizes:
+        for fmt in formats:
+            for variant in range(variants):
+                name = f'load_{width}x{height}_{variant}.{fmt}'
+                corpus.append((name, _synthetic_bytes(width, height, fmt, seed=f'{width}x{height}.{fmt}.{variant}')))
+    return corpus
+
+
+class ResourceSampler(threading.Thread):
+    """Periodically samples server CPU / memory via `docker stats` or /proc/<pid>."""
+
+    def __init__(self, container=None, pid=None, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.container = container
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=self.interval * 5)
+
+    def _docker_sample(self):
+        result = subprocess.run(
+            ['docker', 'stats', '--no-stream', '--format', '{{json .}}', self.container],
+            capture_output=True, text=True, timeout=15
+        )
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        stats = json.loads(result.stdout.strip().splitlines()[0])
+        mem = stats.get('MemUsage', '').split('/')[0].strip()
+        return {'cpu_pct': float(stats.get('CPUPerc', '0').rstrip('%') or 0), 'mem_mb': _parse_mem_mb(mem)}
+
+    def _proc_tree(self):
+        pids = {self.pid}
+        changed = True
+        while changed:
+            changed = False
+            for entry in os.listdir('/proc'):
+                if not entry.isdigit() or int(entry) in pids:
+                    continue
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                if ppid in pids:
+                    pids.add(int(entry))
+                    changed = True
+        return pids
+
+    def _proc_sample(self, previous):
+        ticks = os.sysconf('SC_CLK_TCK')
+        page_mb = os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+        cpu_ticks, rss_mb = 0, 0.0
+        for pid in self._proc_tree():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                # utime, stime, cutime, cstime — children that already exited are accounted via c*time
+                cpu_ticks += sum(int(v) for v in fields[11:15])
+                rss_mb += int(fields[21]) * page_mb
+            except (OSError, IndexError, ValueError):
+                continue
+        now = time.monotonic()
+        sample = {'cpu_pct': None, 'mem_mb': round(rss_mb, 1)}
+        if previous:
+            dt = now - previous[0]
+            if dt > 0:
+                sample['cpu_pct'] = round((cpu_ticks - previous[1]) / ticks / dt * 100, 1)
+        return sample, (now, cpu_ticks)
+
+    def run(self):
+        previous = None
+        while not self._stop_event.is_set():
+            try:
+                if self.container:
+                    sample = self._docker_sample()
+                elif self.pid:
+                    sample, previous = self._proc_sample(previous)
+                else:
+                    return
+                if sample:
+                    sample['t'] = time.time()
+                    self.samples.append(sample)
+            except Exception as e:
+                logging.warning(f"Resource sampling failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def summary(self):
+        cpu = [s['cpu_pct'] for s in self.samples if s.get('cpu_pct') is not None]
+        mem = [s['mem_mb'] for s in self.samples if s.get('mem_mb') is not None]
+        if not cpu and not mem:
+            return None
+        return {
+            'source': f'docker:{self.container}' if self.container else f'pid:{self.pid}',
+            'samples': len(self.samples),
+            'cpu_pct_mean': round(sum(cpu) / len(cpu), 1) if cpu else None,
+            'cpu_pct_max': max(cpu) if cpu else None,
+            'mem_mb_mean': round(sum(mem) / len(mem), 1) if mem else None,
+            'mem_mb_max': max(mem) if mem else None,
+        }
+
+
+def _parse_mem_mb(text):
+    match = re.match(r'([\d.]+)\s*([KMGT]i?B|B)', text)
+    if not match:
+        return None
+    factor = {'B': 1 / 1024 / 1024, 'KiB': 1 / 1024, 'KB': 1 / 1024, 'MiB': 1, 'MB': 1,
+              'GiB': 1024, 'GB': 1024, 'TiB': 1024 * 1024, 'TB': 1024 * 1024}[match.group(2)]
+    return round(float(match.group(1)) * factor, 1)
+
+
+class Stats:
+    """Thread-safe collector for per-phase latencies and error counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.sessions = 0
+        self.failed_sessions = 0
+        self.files = 0
+        self.file_errors = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def record(self, phase, seconds):
+        with self.lock:
+            self.latencies[phase].append(seconds)
+
+    def error(self, phase, reason):
+        with self.lock:
+            self.errors[f'{phase}:{reason}'] += 1
+
+    def report(self):
+        phases = {}
+        for phase in PHASES:
+            values = self.latencies.get(phase, [])
+            phases[phase] = {
+                'count': len(values),
+                'p50_ms': round(_percentile(values, 50) * 1000, 1) if values else None,
+                'p95_ms': round(_percentile(values, 95) * 1000, 1) if values else None,
+                'p99_ms': round(_percentile(values, 99) * 1000, 1) if values else None,
+                'max_ms': round(max(values) * 1000, 1) if values else None,
+            }
+        return {
+            'sessions': self.sessions,
+            'failed_sessions': self.failed_sessions,
+            'session_error_rate': round(self.failed_sessions / self.sessions, 4) if self.sessions else None,
+            'files': self.files,
+            'file_errors': self.file_errors,
+            'file_error_rate': round(self.file_errors / self.files, 4) if self.files else None,
+            'bytes_uploaded': self.bytes_up,
+            'bytes_downloaded': self.bytes_down,
+            'errors': dict(self.errors),
+            'phases': phases,
+        }
+
+
+class SessionError(Exception):
+    def __init__(self, phase, reason):
+        super().__init__(f'{phase}: {reason}')
+        self.phase = phase
+        self.reason = reason
+
+
+def follow_job(session, base_url, job_id):
+    """Consume the SSE stream until the job reports completion. Returns the final payload."""
+    url = urljoin(base_url, f'/job/{job_id}/status')
+    with session.get(url, stream=True, timeout=(10, SSE_TIMEOUT)) as response:
+        if response.status_code != 200:
+            raise SessionError('processing', f'http_{response.status_code}')
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = json.loads(line[5:].strip())
+            if payload.get('error'):
+                raise SessionError('processing', 'job_error')
+            if payload.get('complete'):
+                return payload
+    raise SessionError('processing', 'stream_closed')
+
+
+def run_session(base_url, batch, form, stats):
+    """One simulated user: upload → options → submit → SSE → download."""
+    session = requests.Session()
+    session.headers['User-Agent'] = 'imaguick-loadtest'
+    t_start = time.perf_counter()
+
+    t0 = time.perf_counter()
+    files = [('file', (name, data, 'application/octet-stream')) for name, data in batch]
+    response = session.post(urljoin(base_url, '/upload'), files=files,
+                            headers={'X-Requested-With': 'XMLHttpRequest'}, timeout=600)
+    if response.status_code != 200:
+        raise SessionError('upload', f'http_{response.status_code}')
+    redirect = response.json().get('redirect')
+    if not redirect:
+        raise SessionError('upload', 'no_redirect')
+    stats.record('upload', time.perf_counter() - t0)
+    with stats.lock:
+        stats.bytes_up += sum(len(data) for _, data in batch)
+
+    t0 = time.perf_counter()
+    response = session.get(urljoin(base_url, redirect), timeout=600)
+    if response.status_code != 200:
+        raise SessionError('options', f'http_{response.status_code}')
+    match = re.search(r'name="filenames" value="([^"]*)"', response.text)
+    if not match:
+        raise SessionError('options', 'no_filenames')
+    stats.record('options', time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    response = session.post(urljoin(base_url, '/resize_batch'), data=dict(form, filenames=match.group(1)),
+                            allow_redirects=False, timeout=120)
+    if response.status_code == 429:
+        raise SessionError('submit', 'http_429')
+    location = response.headers.get('Location', '')
+    job_match = re.search(r'/job/([a-f0-9]+)/', location)
+    if response.status_code not in (302, 303) or not job_match:
+        raise SessionError('submit', f'http_{response.status_code}')
+    stats.record('submit', time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    final = follow_job(session, base_url, job_match.group(1))
+    stats.record('processing', time.perf_counter() - t0)
+    with stats.lock:
+        stats.files += final.get('total', 0)
+        stats.file_errors += final.get('errors', 0)
+
+    if final.get('zip'):
+        t0 = time.perf_counter()
+        zip_url = urljoin(base_url, f"/download_batch/{job_match.group(1)}/{final['zip']}")
+        with session.get(zip_url, stream=True, timeout=600) as response:
+            if response.status_code != 200:
+                raise SessionError('download', f'http_{response.status_code}')
+            received = sum(len(chunk) for chunk in response.iter_content(chunk_size=1 << 16))
+        stats.record('download', time.perf_counter() - t0)
+        with stats.lock:
+            stats.bytes_down += received
+    elif final.get('done', 0) > 0:
+        raise SessionError('download', 'no_zip')
+
+    stats.record('total', time.perf_counter() - t_start)
+
+
+def user_loop(user_id, args, corpus, form, stats, start_delay):
+    """Run `iterations` sessions for one simulated user."""
+    rng = random.Random(args.seed + user_id)
+    time.sleep(start_delay)
+    for _ in range(args.iterations):
+        batch_size = rng.randint(args.min_batch, args.max_batch)
+        batch = [corpus[rng.randrange(len(corpus))] for _ in range(batch_size)]
+        with stats.lock:
+            stats.sessions += 1
+        try:
+            run_session(args.url, batch, form, stats)
+        except SessionError as e:
+            logging.warning(f"User {user_id}: {e}")
+            stats.error(e.phase, e.reason)
+            with stats.lock:
+                stats.failed_sessions += 1
+        except requests.RequestException as e:
+            logging.warning(f"User {user_id}: {type(e).__name__}: {e}")
+            stats.error('transport', type(e).__name__)
+            with stats.lock:
+                stats.failed_sessions += 1
+        if args.think_time:
+            time.sleep(rng.uniform(0, args.think_time))
+
+
+def _parse_size(value):
+    width, _, height = value.lower().partition('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test a running ImaGUIck instance end to end.')
+    parser.add_argument('--url', default=DEFAULT_URL, help='Base URL of the server under test.')
+    parser.add_argument('--users', type=int, default=4, help='Concurrent simulated users.')
+    parser.add_argument('--iterations', type=int, default=2, help='Sessions per user.')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='Seconds over which users start.')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Max random pause between sessions.')
+    parser.add_argument('--min-batch', type=int, default=2)
+    parser.add_argument('--max-batch', type=int, default=12)
+    parser.add_argument('--sizes', nargs='+', type=_parse_size, default=DEFAULT_SIZES)
+    parser.add_argument('--formats', nargs='+', default=DEFAULT_FORMATS, choices=['jpg', 'png', 'webp', 'tiff'])
+    parser.add_argument('--variants', type=int, default=2, help='Distinct synthetic files per size/format.')
+    parser.add_argument('--input-dir', help='Use real files from this directory instead of synthetic ones.')
+    parser.add_argument('--format', default='WEBP', help='Output format submitted to /resize_batch.')
+    parser.add_argument('--quality', default='85')
+    parser.add_argument('--resize', default='1920p', choices=['none', '1080p', '1920p'])
+    parser.add_argument('--container', help='Docker container to sample CPU/memory from.')
+    parser.add_argument('--server-pid', type=int, help='Local server PID to sample from /proc instead.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args()
+
+    form = {'format': args.format, 'quality': args.quality}
+    if args.resize != 'none':
+        form[f'use_{args.resize}'] = 'on'
+
+    logging.info("Building corpus")
+    corpus = build_corpus(args.sizes, args.formats, args.variants, args.input_dir)
+
+    sampler = ResourceSampler(container=args.container, pid=args.server_pid)
+    if args.container or args.server_pid:
+        sampler.start()
+
+    stats = Stats()
+    threads = []
+    started = time.perf_counter()
+    for user_id in range(args.users):
+        delay = args.ramp_up * user_id / max(1, args.users)
+        t = threading.Thread(target=user_loop, args=(user_id, args, corpus, form, stats, delay), daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    if sampler.is_alive():
+        sampler.stop()
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'url': args.url, 'users': args.users, 'iterations': args.iterations,
+            'batch': [args.min_batch, args.max_batch], 'corpus_files': len(corpus),
+            'form': form,
+        },
+        'wall_s': round(elapsed, 2),
+        'sessions_per_min': round(stats.sessions / elapsed * 60, 2) if elapsed > 0 else None,
+        'files_per_s': round(stats.files / elapsed, 3) if elapsed > 0 else None,
+        'results': stats.report(),
+        'server': sampler.summary(),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        logging.info(f"Report written to {args.output}")
+    else:
+        print(text)
@@ -1,7 +1,7 @@
 #!/bin/bash
 set -e
 
-echo "Starting cleanup service configuration..."
+echo "Starting cleanup daemon..."
 
 # Check/create the log file
 if [ ! -f /var/log/cleanup.log ]; then
@@ -9,30 +9,24 @@ if [ ! -f /var/log/cleanup.log ]; then
     chmod 666 /var/log/cleanup.log
 fi
 
-# Start the cron service with detailed logging
-if ! service cron start > /var/log/cron.log 2>&1; then
-    echo "Error: Failed to start cron service"
-    cat /var/log/cron.log
-    exit 1
-fi
-
-# Check that cron is actually running
-if ! pgrep cron > /dev/null; then
-    echo "Error: Cron service is not running"
-    exit 1
-fi
+# Create the directories if needed and ensure correct permissions
+mkdir -p /app/uploads && chmod 755 /app/uploads
+mkdir -p /app/output && chmod 755 /app/output
 
-# Check that the task is correctly scheduled
-if ! crontab -l | grep -q cleanup.py; then
-    echo "Error: Cleanup task not found in crontab"
+# One sweeper for the whole container: it pops expired entries from the expiry index
+# every minute, so the Gunicorn workers don't each run their own
+cd /app
+/usr/local/bin/python /app/cleanup.py --daemon >> /var/log/cleanup.log 2>&1 &
+CLEANUP_PID=$!
+sleep 1
+if ! kill -0 "$CLEANUP_PID" 2>/dev/null; then
+    echo "Error: cleanup daemon failed to start"
+    tail -n 20 /var/log/cleanup.log
     exit 1
 fi
+export IMAGUICK_CLEANUP_IN_PROCESS=0
 
-echo "Cron service started and validated successfully"
-
-# Create the directories if needed and ensure correct permissions
-mkdir -p /app/uploads && chmod 755 /app/uploads
-mkdir -p /app/output && chmod 755 /app/output
+echo "Cleanup daemon started (pid $CLEANUP_PID)"
 
 # Find the Gunicorn path
 GUNICORN_PATH=$(which gunicorn || echo "/usr/local/bin/gunicorn")
@@ -44,5 +38,14 @@ fi
 
 echo "Using Gunicorn at: $GUNICORN_PATH"
 
+# One process: jobs, idempotency keys and admission counters live in its memory, so every
+# request must reach the same process. Threads carry the concurrency, and conversions run in
+# ImageMagick child processes anyway. With more processes each one gets an equal share of the
+# conversion cores, workers and memory, but API and progress requests then need the process
+# that owns their job, which Gunicorn's shared socket cannot guarantee.
+GUNICORN_WORKERS=${GUNICORN_WORKERS:-1}
+GUNICORN_THREADS=${GUNICORN_THREADS:-32}
+export IMAGUICK_GUNICORN_WORKERS=$GUNICORN_WORKERS
+
 # Start the application with Gunicorn
-exec $GUNICORN_PATH --bind 0.0.0.0:5000 --workers 4 --worker-class gthread --threads 8 --timeout 600 --limit-request-line 8190 app:app
+exec $GUNICORN_PATH --bind 0.0.0.0:5000 --workers "$GUNICORN_WORKERS" --worker-class gthread --threads "$GUNICORN_THREADS" --timeout 600 --limit-request-line 8190 app:app
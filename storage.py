@@ -0,0 +1,131 @@
+"""Where uploads and outputs are kept between requests.
+
+The conversion pipeline always works on local files under uploads/ and output/, since
+ImageMagick, djxl and dcraw need paths. A storage backend decides what else happens to
+those files:
+
+- LocalStorage (default): the local files are the stored copies, and the app serves
+  downloads itself. Every method is free.
+- S3Storage: stored uploads, outputs and ZIPs are also written to an S3-compatible
+  bucket (AWS S3, MinIO, ...). Any app node can then fetch an upload that another node
+  received, and downloads are presigned URLs, so the bytes go from the bucket straight
+  to the browser.
+
+Objects are keyed by their path relative to the app directory (the layout is described
+in app.py), so every node derives the same key from the same path.
+"""
+import os
+import uuid
+import logging
+
+# Configuration
+STORAGE_BACKEND = os.getenv('IMAGUICK_STORAGE', 'local')
+S3_BUCKET = os.getenv('IMAGUICK_S3_BUCKET', '')
+S3_ENDPOINT = os.getenv('IMAGUICK_S3_ENDPOINT') or None               # e.g. http://minio:9000
+S3_PUBLIC_ENDPOINT = os.getenv('IMAGUICK_S3_PUBLIC_ENDPOINT') or None  # as browsers reach it, if different
+S3_REGION = os.getenv('IMAGUICK_S3_REGION') or None
+S3_PREFIX = os.getenv('IMAGUICK_S3_PREFIX', '')
+PRESIGNED_URL_EXPIRY = int(os.getenv('IMAGUICK_S3_URL_EXPIRY', '3600'))
+MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024     # outputs larger than this are uploaded in parts
+MULTIPART_CONCURRENCY = 4                   # parts in flight per file
+
+logger = logging.getLogger('imaguick.storage')
+
+
+class StorageError(OSError):
+    """A stored copy could not be written or read."""
+
+
+class LocalStorage:
+    """Uploads and outputs live on this node's disk only."""
+
+    def save(self, path):
+        """Persist a freshly written file, or every file under a directory."""
+
+    def fetch(self, path):
+        """Make sure path exists locally. Returns False if there is no stored copy."""
+        return os.path.exists(path)
+
+    def download_url(self, path, filename):
+        """URL the client should download path from, or None to serve it from the app."""
+        return None
+
+
+class S3Storage(LocalStorage):
+    """Local files mirrored to an S3-compatible bucket. Outputs are streamed from disk in
+    MULTIPART_CHUNK_SIZE parts, and downloads are presigned GET URLs that expire after
+    PRESIGNED_URL_EXPIRY seconds. Objects are never deleted by the app: give the bucket a
+    lifecycle rule that expires them after the cleanup age (48 h)."""
+
+    def __init__(self, bucket, endpoint_url=None, public_endpoint_url=None, region=None, prefix=''):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+            from botocore.exceptions import BotoCoreError, ClientError
+        except ImportError:
+            raise RuntimeError('IMAGUICK_STORAGE=s3 requires boto3 (pip install boto3)')
+        if not bucket:
+            raise RuntimeError('IMAGUICK_STORAGE=s3 requires IMAGUICK_S3_BUCKET')
+        # MinIO and most self-hosted endpoints only support path-style bucket addressing
+        config = Config(region_name=region, retries={'max_attempts': 5, 'mode': 'standard'},
+                        s3={'addressing_style': 'path'} if endpoint_url else {})
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, config=config)
+        # Presigned URLs embed the host they were signed for, which must be the one browsers use
+        self.presigner = (boto3.client('s3', endpoint_url=public_endpoint_url, config=config)
+                          if public_endpoint_url else self.client)
+        self.transfer = TransferConfig(multipart_threshold=MULTIPART_CHUNK_SIZE,
+                                       multipart_chunksize=MULTIPART_CHUNK_SIZE,
+                                       max_concurrency=MULTIPART_CONCURRENCY)
+        self.errors = (BotoCoreError, ClientError)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.root = os.path.abspath('.')
+
+    def key(self, path):
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative.startswith(os.pardir):
+            raise StorageError(f"{path} is outside the storage root {self.root}")
+        return self.prefix + relative.replace(os.sep, '/')
+
+    def save(self, path):
+        if os.path.isdir(path):
+            paths = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        else:
+            paths = [path]
+        for local in paths:
+            try:
+                self.client.upload_file(local, self.bucket, self.key(local), Config=self.transfer)
+            except self.errors as e:
+                raise StorageError(f"Could not store {local} in s3://{self.bucket}: {e}")
+
+    def fetch(self, path):
+        if os.path.exists(path):
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{uuid.uuid4().hex}.download'
+        try:
+            self.client.download_file(self.bucket, self.key(path), partial, Config=self.transfer)
+            os.replace(partial, path)
+        except self.errors as e:
+            logger.info(f"No stored copy of {path}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            return False
+        return True
+
+    def download_url(self, path, filename):
+        return self.presigner.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(path),
+                    'ResponseContentDisposition': f'attachment; filename="{filename}"'},
+            ExpiresIn=PRESIGNED_URL_EXPIRY)
+
+
+def open_storage(backend=STORAGE_BACKEND):
+    """The backend selected by IMAGUICK_STORAGE ('local' or 's3')."""
+    if backend == 'local':
+        return LocalStorage()
+    if backend == 's3':
+        return S3Storage(S3_BUCKET, S3_ENDPOINT, S3_PUBLIC_ENDPOINT, S3_REGION, S3_PREFIX)
+    raise RuntimeError(f"Unknown IMAGUICK_STORAGE backend: {backend}")
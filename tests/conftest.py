@@ -0,0 +1,68 @@
+"""Shared fixtures: the app runs against a fake `magick` on PATH, inside a scratch
+working directory per test, so no ImageMagick install is needed."""
+import io
+import os
+import stat
+import sys
+import tempfile
+import time
+
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# `magick identify` reports a 20x20 PNG; a conversion writes a stub output, or fails
+# for inputs named *bad* while FAKE_MAGICK_FAIL is set.
+FAKE_MAGICK = '''#!/usr/bin/env python3
+import os, sys
+args = sys.argv[1:]
+if args[0] == 'identify':
+    print('x.png PNG 20x20 20x20+0+0 8-bit')
+    sys.exit(0)
+if os.environ.get('FAKE_MAGICK_FAIL') and any('bad' in a for a in args):
+    sys.stderr.write('delegate timeout\\n')
+    sys.exit(1)
+with open(args[-1], 'w') as f:
+    f.write('data')
+'''
+
+FAKE_BIN = tempfile.mkdtemp(prefix='imaguick-test-')
+with open(os.path.join(FAKE_BIN, 'magick'), 'w') as f:
+    f.write(FAKE_MAGICK)
+os.chmod(os.path.join(FAKE_BIN, 'magick'), stat.S_IRWXU)
+os.environ['PATH'] = FAKE_BIN + os.pathsep + os.environ['PATH']
+os.environ['IMAGUICK_CLEANUP_IN_PROCESS'] = '0'
+os.environ['IMAGUICK_EXPIRY_INDEX'] = os.path.join(FAKE_BIN, 'expiry.db')
+
+
+@pytest.fixture
+def imaguick(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app
+    os.makedirs(app.UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(app.OUTPUT_FOLDER, exist_ok=True)
+    return app
+
+
+@pytest.fixture
+def client(imaguick):
+    return imaguick.app.test_client()
+
+
+def png():
+    buf = io.BytesIO()
+    Image.new('RGB', (20, 20)).save(buf, 'PNG')
+    buf.seek(0)
+    return buf
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/v1/jobs/{job_id}').get_json()
+        if job['complete']:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} did not finish')
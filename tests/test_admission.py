@@ -0,0 +1,67 @@
+import pytest
+
+from conftest import png
+
+
+@pytest.fixture
+def idle(imaguick, monkeypatch):
+    """Admission state of a server with no batches running."""
+    monkeypatch.setattr(imaguick, 'jobs', {})
+    monkeypatch.setattr(imaguick, 'queued_megapixels', 0.0)
+    monkeypatch.setattr(imaguick, 'measured_mp_per_second', None)
+    return imaguick
+
+
+def active_job(client, remaining_mp=10.0):
+    return {'client': client, 'status': 'processing', 'remaining_mp': remaining_mp}
+
+
+def test_admit_job_reserves_megapixels(idle):
+    assert idle.admit_job('10.0.0.1', 50.0) is None
+    assert idle.queued_megapixels == 50.0
+
+
+def test_admit_job_limits_batches_per_client(idle, monkeypatch):
+    monkeypatch.setattr(idle, 'MAX_JOBS_PER_CLIENT', 2)
+    idle.jobs.update(a=active_job('10.0.0.1'), b=active_job('10.0.0.1'))
+
+    decision = idle.admit_job('10.0.0.1', 1.0)
+    assert decision['reason'] == 'client_limit'
+    assert decision['position'] == 2
+    assert idle.admit_job('10.0.0.2', 1.0) is None
+
+
+def test_admit_job_limits_active_batches(idle, monkeypatch):
+    monkeypatch.setattr(idle, 'MAX_ACTIVE_JOBS', 2)
+    idle.jobs.update(a=active_job('10.0.0.1'), b=active_job('10.0.0.2'),
+                     c=dict(active_job('10.0.0.3'), status='complete'))
+
+    decision = idle.admit_job('10.0.0.4', 1.0)
+    assert decision['reason'] == 'busy'
+    assert decision['position'] == 2
+
+
+def test_admit_job_limits_queued_megapixels(idle, monkeypatch):
+    monkeypatch.setattr(idle, 'MAX_QUEUED_MEGAPIXELS', 100.0)
+    # An oversized batch still gets onto an idle queue
+    assert idle.admit_job('10.0.0.1', 500.0) is None
+    idle.jobs['a'] = active_job('10.0.0.1', 500.0)
+
+    decision = idle.admit_job('10.0.0.2', 10.0)
+    assert decision['reason'] == 'busy'
+    low, high = idle.RETRY_AFTER_BOUNDS
+    assert low <= decision['retry_after'] <= high
+    assert idle.queued_megapixels == 500.0
+
+
+def test_saturated_queue_answers_429_with_retry_after(idle, client, monkeypatch):
+    monkeypatch.setattr(idle, 'MAX_ACTIVE_JOBS', 1)
+    idle.jobs['a'] = active_job('10.0.0.1')
+
+    r = client.post('/api/v1/jobs', content_type='multipart/form-data',
+                    data={'file': [(png(), 'a.png')]})
+    assert r.status_code == 429
+    assert int(r.headers['Retry-After']) >= idle.RETRY_AFTER_BOUNDS[0]
+    body = r.get_json()
+    assert body['reason'] == 'busy'
+    assert body['position'] == 1
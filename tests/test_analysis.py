@@ -0,0 +1,44 @@
+import random
+import subprocess
+
+from PIL import Image
+
+
+def save(tmp_path, img, name='a.png'):
+    path = tmp_path / 'uploads' / name
+    img.save(path)
+    return str(path)
+
+
+def test_photos_are_told_from_flat_graphics(imaguick, tmp_path):
+    rng = random.Random(1)
+    noisy = Image.frombytes('RGB', (64, 64), bytes(rng.randrange(256) for _ in range(64 * 64 * 3)))
+    assert imaguick._analyze_with_pil(save(tmp_path, noisy, 'noisy.png'))['is_photo']
+
+    flat = Image.new('RGBA', (64, 64), (10, 20, 30, 128))
+    result = imaguick._analyze_with_pil(save(tmp_path, flat, 'flat.png'))
+    assert not result['is_photo']
+    assert result['has_transparency']
+    assert result['original_format'] == 'PNG'
+
+
+def test_pillow_keeps_its_decompression_bomb_limit(imaguick):
+    assert Image.MAX_IMAGE_PIXELS < imaguick.MAX_MEGAPIXELS * 1_000_000
+
+
+def test_headers_past_the_bomb_limit_come_from_imagemagick(imaguick, tmp_path, monkeypatch):
+    path = save(tmp_path, Image.new('RGB', (40, 30)))
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+    commands = []
+
+    def run_command(command, job_id=None, timeout=None, stdout=None):
+        commands.append(command)
+        return subprocess.CompletedProcess(command, 0, '40 30 PNG 1 False\n', '')
+    monkeypatch.setattr(imaguick, 'run_command', run_command)
+
+    assert imaguick.probe_header(path) == {'width': 40, 'height': 30, 'format': 'PNG', 'frames': 1,
+                                           'alpha': False}
+    assert imaguick.estimate_megapixels(path) == 40 * 30 / 1e6
+    assert imaguick._analyze_with_pil(path) == {'has_transparency': False, 'is_photo': True,
+                                                'original_format': 'PNG'}
+    assert all(command[:3] == ['magick', 'identify', '-ping'] for command in commands)
@@ -0,0 +1,60 @@
+import uuid
+
+from conftest import png, wait_for_job
+
+
+def test_non_object_params_are_rejected(client):
+    r = client.post('/api/v1/jobs', json={'params': ['quality'], 'filenames': []})
+    assert r.status_code == 400
+    assert 'error' in r.get_json()
+
+    r = client.post('/api/v1/jobs', content_type='multipart/form-data',
+                    data={'file': [(png(), 'a.png')]})
+    job_id = r.get_json()['id']
+    wait_for_job(client, job_id)
+    r = client.post(f'/api/v1/jobs/{job_id}/retry', json={'params': ['quality']})
+    assert r.status_code == 400
+    assert 'error' in r.get_json()
+
+
+def test_idempotency_key_returns_the_original_job(client):
+    key = {'Idempotency-Key': uuid.uuid4().hex}
+    first = client.post('/api/v1/jobs', headers=key, content_type='multipart/form-data',
+                        data={'file': [(png(), 'a.png')], 'format': 'webp'})
+    assert first.status_code == 202
+    again = client.post('/api/v1/jobs', headers=key, content_type='multipart/form-data',
+                        data={'file': [(png(), 'a.png')], 'format': 'webp'})
+    assert again.status_code == 200
+    assert again.get_json()['id'] == first.get_json()['id']
+
+    other = client.post('/api/v1/jobs', headers=key, content_type='multipart/form-data',
+                        data={'file': [(png(), 'a.png')], 'format': 'png'})
+    assert other.status_code == 422
+    wait_for_job(client, first.get_json()['id'])
+
+
+def test_idempotency_key_is_freed_when_the_request_fails(imaguick, client, monkeypatch):
+    key = {'Idempotency-Key': uuid.uuid4().hex}
+
+    start_job = imaguick.start_job
+
+    def broken_start_job(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(imaguick, 'start_job', broken_start_job)
+    r = client.post('/api/v1/jobs', headers=key, content_type='multipart/form-data',
+                    data={'file': [(png(), 'a.png')]})
+    assert r.status_code == 500
+
+    monkeypatch.setattr(imaguick, 'start_job', start_job)
+    r = client.post('/api/v1/jobs', headers=key, content_type='multipart/form-data',
+                    data={'file': [(png(), 'a.png')]})
+    assert r.status_code == 202
+    wait_for_job(client, r.get_json()['id'])
+
+
+def test_filenames_must_be_a_list_of_strings(client):
+    for filenames in ('a.jpg', [1, 2], [None], {'a': 'b'}):
+        r = client.post('/api/v1/jobs', json={'filenames': filenames})
+        assert r.status_code == 400, filenames
+        assert 'filenames' in r.get_json()['error']
@@ -0,0 +1,80 @@
+import io
+import os
+import tarfile
+import zipfile
+
+from conftest import png
+
+
+def zip_archive(members, compression=zipfile.ZIP_STORED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def extract(imaguick, data, name='photos.zip'):
+    return imaguick.extract_archive(io.BytesIO(data), name, len(data))
+
+
+def test_member_paths_cannot_leave_the_upload_folder(imaguick, tmp_path):
+    image = png().getvalue()
+    data = zip_archive([('../../escape.png', image), ('/etc/absolute.png', image),
+                        ('dir\\..\\..\\windows.png', image), ('__MACOSX/._x.png', image)])
+    stored, errors = extract(imaguick, data)
+
+    assert not errors
+    assert sorted(name.split('_', 1)[1] for name in stored) == ['absolute.png', 'escape.png', 'windows.png']
+    upload_folder = os.path.realpath(imaguick.UPLOAD_FOLDER)
+    for name in stored:
+        assert os.path.realpath(imaguick.upload_path(name)).startswith(upload_folder + os.sep)
+    assert sorted(os.listdir(tmp_path)) == sorted([imaguick.UPLOAD_FOLDER, imaguick.OUTPUT_FOLDER])
+
+
+def test_tar_links_and_traversal_are_not_followed(imaguick):
+    image = png().getvalue()
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tf:
+        link = tarfile.TarInfo('passwd.png')
+        link.type, link.linkname = tarfile.SYMTYPE, '/etc/passwd'
+        tf.addfile(link)
+        member = tarfile.TarInfo('../../escape.png')
+        member.size = len(image)
+        tf.addfile(member, io.BytesIO(image))
+    stored, errors = extract(imaguick, buf.getvalue(), 'photos.tar')
+
+    assert [name.split('_', 1)[1] for name in stored] == ['escape.png']
+    with open(imaguick.upload_path(stored[0]), 'rb') as f:
+        assert f.read() == image
+
+
+def test_highly_compressed_member_is_rejected(imaguick):
+    data = zip_archive([('bomb.png', b'\0' * (4 * 1024 * 1024))], zipfile.ZIP_DEFLATED)
+    stored, errors = extract(imaguick, data)
+    assert stored == []
+    assert 'suspicious compression ratio' in errors[0]
+
+
+def test_extraction_stops_at_the_archive_budget(imaguick, monkeypatch):
+    image = png().getvalue()
+    monkeypatch.setattr(imaguick, 'MAX_ARCHIVE_EXTRACTED_SIZE', len(image) * 3 // 2)
+    stored, errors = extract(imaguick, zip_archive([('a.png', image), ('b.png', image), ('c.png', image)]))
+    assert len(stored) == 1
+    assert errors == ['photos.zip: expands beyond the allowed size, extraction stopped']
+    # The member cut off half-way was removed
+    files = [name for _, _, names in os.walk(imaguick.UPLOAD_FOLDER) for name in names]
+    assert files == stored
+
+
+def test_member_count_and_size_limits(imaguick, monkeypatch):
+    image = png().getvalue()
+    monkeypatch.setattr(imaguick, 'MAX_ARCHIVE_MEMBERS', 2)
+    stored, errors = extract(imaguick, zip_archive([(f'{i}.png', image) for i in range(3)]))
+    assert len(stored) == 2
+    assert errors == ['photos.zip: more than 2 files, the rest was skipped']
+
+    monkeypatch.setattr(imaguick, 'PER_FILE_MAX_SIZE', len(image) - 1)
+    stored, errors = extract(imaguick, zip_archive([('big.png', image)]))
+    assert stored == []
+    assert 'exceeds the per-file limit' in errors[0]
@@ -0,0 +1,67 @@
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+import pytest
+
+# A parent that has forked a delegate into its process group, as magick does with gs or potrace
+WITH_DELEGATE = ['sh', '-c', 'sleep 30 & sleep 30']
+
+
+def run_in_thread(imaguick, job_id):
+    outcome = {}
+
+    def run():
+        try:
+            imaguick.run_command(WITH_DELEGATE, job_id=job_id, timeout=60)
+        except subprocess.CalledProcessError as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def wait_for_process(imaguick, job_id):
+    deadline = time.time() + 5
+    while not imaguick.job_processes.get(job_id):
+        assert time.time() < deadline, 'process never started'
+        time.sleep(0.01)
+
+
+def test_cancel_job_kills_running_processes_and_their_delegates(imaguick, monkeypatch):
+    job_id = uuid.uuid4().hex
+    monkeypatch.setitem(imaguick.jobs, job_id, {'files': [], 'status': 'processing', 'futures': [],
+                                                'remaining_mp': 0.0})
+    thread, outcome = run_in_thread(imaguick, job_id)
+    wait_for_process(imaguick, job_id)
+
+    started = time.monotonic()
+    assert imaguick.cancel_job(job_id)
+    # The delegate holds the stderr pipe open: the run only returns once the whole group is gone
+    thread.join(5)
+    assert not thread.is_alive()
+    assert time.monotonic() - started < 5
+    assert outcome['error'].returncode < 0
+    assert imaguick.conversion_cancelled(job_id)
+    assert not imaguick.job_processes[job_id]
+    assert not imaguick.cancel_job(job_id)
+
+
+def test_abandoned_single_conversion_is_killed(imaguick):
+    token = uuid.uuid4().hex
+    future = Future()
+    future.set_running_or_notify_cancel()
+    thread, outcome = run_in_thread(imaguick, token)
+    wait_for_process(imaguick, token)
+
+    imaguick.abandon_single(token, future)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert outcome['error'].returncode < 0
+    # Processes it starts after being abandoned are killed on sight
+    with pytest.raises(subprocess.CalledProcessError):
+        imaguick.run_command(WITH_DELEGATE, job_id=token, timeout=5)
+    with imaguick.jobs_lock:
+        imaguick.abandoned_conversions.discard(token)
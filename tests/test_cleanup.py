@@ -0,0 +1,78 @@
+import os
+import time
+from collections import namedtuple
+
+import pytest
+
+import cleanup
+from conftest import png
+
+Usage = namedtuple('Usage', 'total used free')
+
+
+@pytest.fixture
+def index(tmp_path):
+    return cleanup.ExpiryIndex(str(tmp_path / 'index.db'))
+
+
+def make_file(tmp_path, name, size=100):
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'\0' * size)
+    return str(path)
+
+
+def test_sweep_removes_only_expired_paths(index, tmp_path):
+    expired = make_file(tmp_path, 'expired.png')
+    fresh = make_file(tmp_path, 'fresh.png')
+    job_file = make_file(tmp_path, 'job/in/a.png')
+    index.track(expired, max_age=-1)
+    index.track(fresh)
+    index.pin_job('job', os.path.dirname(os.path.dirname(job_file)))
+
+    assert cleanup.sweep_expired(index) == 1
+    assert not os.path.exists(expired)
+    assert os.path.exists(fresh) and os.path.exists(job_file)
+    assert index.tracked_paths() == {os.path.abspath(fresh), os.path.abspath(tmp_path / 'job')}
+    # A pin whose lease has run out (its process died) expires like anything else
+    assert cleanup.sweep_expired(index, now=time.time() + cleanup.PIN_LEASE + 1) == 2
+
+
+def test_high_water_evicts_completed_jobs_before_loose_files(index, tmp_path, monkeypatch):
+    old_job = make_file(tmp_path, 'old/out.zip', 300)
+    index.track(os.path.dirname(old_job), job_id='old')
+    running = make_file(tmp_path, 'running/out.zip', 300)
+    index.pin_job('running', os.path.dirname(running))
+    loose = [make_file(tmp_path, f'loose{i}.png', 100) for i in range(3)]
+    index.track(*loose)
+    arriving = make_file(tmp_path, 'upload.part', 500)
+    index.track(arriving, pinned=True, lease=60)
+
+    # A full volume: getting back to the 80 % low water means freeing 500 bytes
+    monkeypatch.setattr(cleanup.shutil, 'disk_usage', lambda folder: Usage(2500, 2500, 0))
+    assert cleanup.enforce_high_water(index, str(tmp_path)) == 3
+
+    assert not os.path.exists(old_job)
+    assert [os.path.exists(p) for p in loose] == [False, False, True]
+    assert os.path.exists(running) and os.path.exists(arriving)
+
+
+def test_high_water_does_nothing_below_the_mark(index, tmp_path, monkeypatch):
+    index.track(make_file(tmp_path, 'a.png'))
+    monkeypatch.setattr(cleanup.shutil, 'disk_usage', lambda folder: Usage(2000, 1700, 300))
+    assert cleanup.enforce_high_water(index, str(tmp_path)) == 0
+    assert len(index.tracked_paths()) == 1
+
+
+def test_resumable_upload_is_pinned_until_complete(imaguick, client):
+    data = png().getvalue()
+    upload_id = client.post('/uploads', json={'filename': 'photo.png', 'size': len(data)}).get_json()['id']
+    record_path = os.path.abspath(imaguick._chunked_upload_record_path(upload_id))
+    part_path = os.path.abspath(imaguick.chunked_uploads[upload_id]['path'])
+    assert {part_path, record_path} <= imaguick.expiry_index.pinned_paths()
+
+    headers = {'Upload-Offset': '0', 'Content-Type': 'application/offset+octet-stream'}
+    assert client.patch(f'/uploads/{upload_id}', data=data, headers=headers).get_json()['complete']
+    pinned = imaguick.expiry_index.pinned_paths()
+    assert part_path not in pinned and record_path not in pinned
+    assert record_path in imaguick.expiry_index.tracked_paths()
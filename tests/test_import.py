@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_importing_the_module_starts_no_threads(tmp_path):
+    # As imaguick.py and benchmark.py use it
+    code = ('import threading, app\n'
+            'print(sorted(t.name for t in threading.enumerate()))\n'
+            'print(app.scheduler.submit(app.LANE_BATCH, app.magick_threads).result(timeout=5))\n'
+            'print(sorted(t.name for t in threading.enumerate() if t.name.startswith("imaguick-worker")))\n')
+    env = {**os.environ, 'IMAGUICK_HEADLESS': '1', 'PYTHONPATH': ROOT}
+    out = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, timeout=60, check=True).stdout.splitlines()
+    assert out[0] == "['MainThread']"
+    assert out[1] == '1'
+    assert 'imaguick-worker-0' in out[2]
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,69 @@
+import io
+import os
+from zipfile import ZipFile
+
+from conftest import png, wait_for_job
+
+
+def test_retry_with_partial_params_keeps_other_settings(imaguick, client, monkeypatch):
+    monkeypatch.setenv('FAKE_MAGICK_FAIL', '1')
+    r = client.post('/api/v1/jobs', content_type='multipart/form-data', data={
+        'file': [(png(), 'good.png'), (png(), 'bad.png')],
+        'format': 'webp', 'width': '800', 'height': '600', 'keep_ratio': 'on', 'use_sharpen': 'on',
+    })
+    assert r.status_code == 202
+    job_id = r.get_json()['id']
+    job = wait_for_job(client, job_id)
+    assert (job['done'], job['errors']) == (1, 1)
+
+    monkeypatch.delenv('FAKE_MAGICK_FAIL')
+    r = client.post(f'/api/v1/jobs/{job_id}/retry', json={'params': {'quality': '80'}})
+    assert r.status_code == 202
+    assert r.get_json()['retried'] == 1
+    job = wait_for_job(client, job_id)
+    assert job['errors'] == 0
+
+    params = imaguick.jobs[job_id]['params']
+    assert params['quality'] == '80'
+    assert params['output_format'] == 'WEBP'
+    assert (params['width'], params['height']) == ('800', '600')
+    assert params['keep_ratio'] and params['use_sharpen']
+
+
+def test_retry_can_switch_an_option_off(imaguick, client, monkeypatch):
+    monkeypatch.setenv('FAKE_MAGICK_FAIL', '1')
+    r = client.post('/api/v1/jobs', content_type='multipart/form-data', data={
+        'file': [(png(), 'bad.png')], 'format': 'png', 'use_sharpen': 'on',
+    })
+    job_id = r.get_json()['id']
+    wait_for_job(client, job_id)
+
+    monkeypatch.delenv('FAKE_MAGICK_FAIL')
+    r = client.post(f'/api/v1/jobs/{job_id}/retry', json={'params': {'use_sharpen': False}})
+    assert r.status_code == 202
+    wait_for_job(client, job_id)
+    params = imaguick.jobs[job_id]['params']
+    assert not params['use_sharpen']
+    assert params['output_format'] == 'PNG'
+
+
+def test_archive_members_with_the_same_basename_keep_separate_outputs(imaguick, client):
+    archive = io.BytesIO()
+    with ZipFile(archive, 'w') as zf:
+        zf.writestr('a/x.png', png().getvalue())
+        zf.writestr('b/x.png', png().getvalue())
+        zf.writestr('c/X.png', png().getvalue())
+    archive.seek(0)
+    r = client.post('/api/v1/jobs', content_type='multipart/form-data',
+                    data={'file': [(archive, 'photos.zip')], 'format': 'webp'})
+    assert r.status_code == 202
+    job_id = r.get_json()['id']
+    job = wait_for_job(client, job_id)
+    assert (job['done'], job['errors']) == (3, 0)
+
+    outputs = [f['output'] for f in imaguick.jobs[job_id]['files']]
+    assert len({os.path.basename(path).lower() for path in outputs}) == 3
+    with ZipFile(os.path.join(imaguick.job_dir(job_id), job['zip'])) as zf:
+        names = zf.namelist()
+    assert sorted(name.lower() for name in names) == ['x_imaguick-2.webp', 'x_imaguick-3.webp',
+                                                       'x_imaguick.webp']
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import png
+
+HEADER = {'width': 20, 'height': 20, 'format': 'PNG', 'frames': 1}
+
+
+def params(imaguick, **form):
+    return imaguick.extract_processing_params({'quality': '100', 'keep_ratio': 'on', **form})
+
+
+@pytest.mark.parametrize('form', [
+    {},
+    {'quality': ''},
+    {'use_1080p': 'on'},
+    {'use_1920p': 'on'},
+    {'percentage': '100'},
+    {'width': '20'},
+    {'width': '64', 'height': '64'},
+])
+def test_requests_the_file_already_satisfies_are_noops(imaguick, form):
+    assert imaguick.is_noop_conversion('a.png', 'out/a.png', params(imaguick, **form), HEADER)
+
+
+@pytest.mark.parametrize('output, form', [
+    ('out/a.webp', {}),                           # another format
+    ('out/a.jpg', {}),
+    ('out/a.avif', {}),                           # not a pass-through format
+    ('out/a.png', {'quality': '90'}),
+    ('out/a.png', {'auto_level': 'on'}),
+    ('out/a.png', {'use_sharpen': 'on'}),
+    ('out/a.png', {'percentage': '50'}),
+    ('out/a.png', {'width': '10'}),
+    ('out/a.png', {'width': '10', 'height': '64'}),
+    ('out/a.png', {'width': 'abc'}),
+])
+def test_requests_that_change_the_file_are_not_noops(imaguick, output, form):
+    assert not imaguick.is_noop_conversion('a.png', output, params(imaguick, **form), HEADER)
+
+
+def test_presets_only_pass_through_images_inside_them(imaguick):
+    large = {**HEADER, 'width': 3000, 'height': 2000}
+    assert not imaguick.is_noop_conversion('a.png', 'out/a.png', params(imaguick, use_1080p='on'), large)
+    assert not imaguick.is_noop_conversion('a.png', 'out/a.png', params(imaguick, use_1920p='on'), large)
+    stretched = imaguick.extract_processing_params({'quality': '100', 'width': '64', 'height': '64'})
+    assert not imaguick.is_noop_conversion('a.png', 'out/a.png', stretched, HEADER)
+
+
+def test_noop_conversion_links_the_source(imaguick, tmp_path):
+    source = tmp_path / 'uploads' / 'a.png'
+    source.write_bytes(png().getvalue())
+    output = tmp_path / 'output' / 'a.png'
+    path, method = imaguick.convert_file(str(source), str(output), params(imaguick))
+    assert method in ('hardlink', 'copy')
+    assert output.read_bytes() == source.read_bytes()
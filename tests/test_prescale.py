@@ -0,0 +1,39 @@
+import pytest
+
+HEADER = {'width': 1920, 'height': 1280}
+
+
+def params(imaguick, **form):
+    return imaguick.extract_processing_params({'keep_ratio': 'on', **form})
+
+
+@pytest.mark.parametrize('form', [
+    {'use_1920p': 'on'},
+    {'use_1080p': 'on'},
+    {'width': '800'},
+    {'width': '1920', 'height': '1920'},
+])
+def test_prescaled_upload_serves_sizes_it_covers(imaguick, form):
+    assert imaguick.prescale_shortfall(params(imaguick, **form), HEADER, 1920) is None
+
+
+@pytest.mark.parametrize('form', [
+    {},
+    {'percentage': '100'},
+    {'percentage': '50'},
+    {'width': '3000'},
+    {'height': '1600'},
+])
+def test_prescaled_upload_refuses_sizes_that_need_the_original(imaguick, form):
+    assert 'original' in imaguick.prescale_shortfall(params(imaguick, **form), HEADER, 1920)
+
+
+def test_1920p_needs_more_than_a_1080_prescale(imaguick):
+    header = {'width': 1080, 'height': 720}
+    assert imaguick.prescale_shortfall(params(imaguick, use_1920p='on'), header, 1080)
+    assert imaguick.prescale_shortfall(params(imaguick, use_1080p='on'), header, 1080) is None
+
+
+def test_stretching_beyond_the_shrunk_size_is_refused(imaguick):
+    stretch = imaguick.extract_processing_params({'width': '1920', 'height': '1920'})
+    assert imaguick.prescale_shortfall(stretch, HEADER, 1920)
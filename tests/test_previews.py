@@ -0,0 +1,64 @@
+import threading
+import time
+import uuid
+
+from conftest import png
+
+
+def stored_png(imaguick):
+    filename = f'{uuid.uuid4().hex}_photo.png'
+    with open(imaguick.upload_path(filename, create=True), 'wb') as f:
+        f.write(png().read())
+    return filename
+
+
+def test_thumbnail_answers_202_until_rendered(imaguick, client, monkeypatch):
+    release = threading.Event()
+    make_previews = imaguick.make_previews
+
+    def slow_previews(filepath):
+        release.wait(10)
+        thumb_path, proxy_path = imaguick.preview_paths(filepath)
+        for path in (thumb_path, proxy_path):
+            with open(path, 'wb') as f:
+                f.write(png().read())
+        return thumb_path, proxy_path
+
+    monkeypatch.setattr(imaguick, 'make_previews', slow_previews)
+    filename = stored_png(imaguick)
+    try:
+        r = client.get(f'/thumbnail/{filename}')
+        assert r.status_code == 202
+        assert r.headers['Retry-After'] == str(imaguick.PREVIEW_RETRY_AFTER)
+        assert client.post(f'/preview/{filename}').status_code == 202
+    finally:
+        release.set()
+    future = imaguick.request_previews(filename, imaguick.upload_path(filename))
+    future.result(timeout=10)
+    monkeypatch.setattr(imaguick, 'make_previews', make_previews)
+
+    assert client.get(f'/thumbnail/{filename}').status_code == 200
+
+
+def test_previews_run_on_a_bounded_lane(imaguick):
+    scheduler = imaguick.ConversionScheduler(4, reserved=1, cores=4, previews=1)
+    release = threading.Event()
+    running = []
+
+    def render(name):
+        running.append(name)
+        release.wait(10)
+
+    try:
+        scheduler.submit(imaguick.LANE_PREVIEW, render, 'p1')
+        scheduler.submit(imaguick.LANE_PREVIEW, render, 'p2')
+        scheduler.submit(imaguick.LANE_BATCH, render, 'b1')
+        deadline = time.time() + 5
+        while len(running) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        # One preview at a time; the batch task takes a free worker instead of the second preview
+        assert sorted(running) == ['b1', 'p1']
+        assert scheduler.stats()['queued'][imaguick.LANE_PREVIEW] == 1
+    finally:
+        release.set()
@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_interactive_tasks_dequeue_before_batch_tasks(imaguick):
+    scheduler = imaguick.ConversionScheduler(1, reserved=0, cores=1)
+    release = threading.Event()
+    order = []
+    blocker = scheduler.submit(imaguick.LANE_BATCH, release.wait, 5)
+    wait_until(lambda: scheduler.stats()['running'][imaguick.LANE_BATCH] == 1)
+
+    futures = [scheduler.submit(imaguick.LANE_BATCH, order.append, 'batch 1'),
+               scheduler.submit(imaguick.LANE_BATCH, order.append, 'batch 2'),
+               scheduler.submit(imaguick.LANE_INTERACTIVE, order.append, 'interactive')]
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(timeout=5)
+    assert order == ['interactive', 'batch 1', 'batch 2']
+
+
+def test_batch_tasks_leave_the_reserved_worker_free(imaguick):
+    scheduler = imaguick.ConversionScheduler(2, reserved=1, cores=2)
+    release = threading.Event()
+    try:
+        scheduler.submit(imaguick.LANE_BATCH, release.wait, 5)
+        second = scheduler.submit(imaguick.LANE_BATCH, release.wait, 5)
+        wait_until(lambda: scheduler.stats()['running'][imaguick.LANE_BATCH] == 1)
+
+        assert scheduler.submit(imaguick.LANE_INTERACTIVE, lambda: 'done').result(timeout=5) == 'done'
+        assert not second.running()
+        assert scheduler.stats()['queued'][imaguick.LANE_BATCH] == 1
+    finally:
+        release.set()
+
+
+def test_large_tasks_get_more_threads_when_the_queue_is_short(imaguick):
+    scheduler = imaguick.ConversionScheduler(4, reserved=1, cores=8)
+    threads = scheduler.submit(imaguick.LANE_BATCH, imaguick.magick_threads,
+                               megapixels=8 * imaguick.MP_PER_THREAD)
+    assert threads.result(timeout=5) == 8
+    small = scheduler.submit(imaguick.LANE_BATCH, imaguick.magick_threads, megapixels=1)
+    assert small.result(timeout=5) == 1
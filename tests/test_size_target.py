@@ -0,0 +1,63 @@
+import math
+
+import pytest
+
+
+@pytest.fixture
+def encoder(imaguick, monkeypatch, tmp_path):
+    """convert_to_size() against a model encoder: size(quality) from the returned dict's
+    'size' function, with every encoded quality recorded in 'calls'."""
+    model = {'size': None, 'calls': []}
+
+    def encode_reference(reference, output_path, quality, params, job_id=None, timeout=None):
+        size = model['size'](int(quality))
+        model['calls'].append(int(quality))
+        with open(output_path, 'wb') as f:
+            f.write(b'\0' * size)
+        return size
+
+    monkeypatch.setattr(imaguick, 'render_reference', lambda *args, **kwargs: str(tmp_path / 'reference.png'))
+    monkeypatch.setattr(imaguick, 'remove_reference', lambda reference: None)
+    monkeypatch.setattr(imaguick, 'encode_reference', encode_reference)
+    return model
+
+
+def convert(imaguick, tmp_path, max_size_kb, quality='100'):
+    params = imaguick.extract_processing_params({'quality': quality, 'max_size_kb': str(max_size_kb)})
+    return imaguick.convert_to_size('in.png', str(tmp_path / 'out.jpg'), params)
+
+
+@pytest.mark.parametrize('max_size_kb', [40, 100, 250, 600])
+def test_search_ends_on_the_highest_quality_that_fits(imaguick, encoder, tmp_path, max_size_kb):
+    encoder['size'] = lambda q: int(20_000 * math.exp(q / 25))
+    path, method = convert(imaguick, tmp_path, max_size_kb)
+
+    chosen = int(method.split(':q')[1])
+    target = max_size_kb * 1024
+    assert encoder['size'](chosen) <= target < encoder['size'](chosen + 1)
+    assert len(encoder['calls']) <= imaguick.SIZE_TARGET_MAX_ENCODES
+    assert len(set(encoder['calls'])) == len(encoder['calls'])
+    assert (tmp_path / 'out.jpg').stat().st_size == encoder['size'](chosen)
+    # Only the chosen encode is left behind
+    assert sorted(p.name for p in tmp_path.glob('out.*')) == ['out.jpg']
+
+
+def test_search_stops_after_one_encode_when_the_top_quality_fits(imaguick, encoder, tmp_path):
+    encoder['size'] = lambda q: 1000 + q
+    assert convert(imaguick, tmp_path, 100, quality='80')[1] == 'size:q80'
+    assert encoder['calls'] == [80]
+
+
+def test_smallest_encode_is_kept_when_nothing_fits(imaguick, encoder, tmp_path):
+    encoder['size'] = lambda q: 500_000 + q * 1000
+    low = imaguick.SIZE_TARGET_QUALITY_RANGE[0]
+    assert convert(imaguick, tmp_path, 10)[1] == f'size:q{low}'
+    assert len(encoder['calls']) <= imaguick.SIZE_TARGET_MAX_ENCODES
+
+
+def test_search_ends_on_a_flat_size_curve(imaguick, encoder, tmp_path):
+    # Sizes that barely move with quality must not divide by zero or loop
+    encoder['size'] = lambda q: 100_000 if q > 50 else 99_000
+    path, method = convert(imaguick, tmp_path, 97)
+    assert len(encoder['calls']) <= imaguick.SIZE_TARGET_MAX_ENCODES
+    assert method.startswith('size:q')
@@ -0,0 +1,148 @@
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+from conftest import png, wait_for_job
+
+
+def start_upload(client, data):
+    r = client.post('/uploads', json={'filename': 'photo.png', 'size': len(data)})
+    assert r.status_code == 201
+    return r.get_json()['id']
+
+
+def patch(client, upload_id, chunk, offset):
+    return client.patch(f'/uploads/{upload_id}', data=chunk, headers={
+        'Upload-Offset': str(offset), 'Content-Type': 'application/offset+octet-stream'})
+
+
+def test_upload_continues_in_another_worker_process(imaguick, client):
+    data = png().getvalue()
+    upload_id = start_upload(client, data)
+    assert patch(client, upload_id, data[:10], 0).get_json()['offset'] == 10
+
+    # A different worker process has none of this one's records in memory
+    imaguick.chunked_uploads.clear()
+    state = client.get(f'/uploads/{upload_id}').get_json()
+    assert state['offset'] == 10
+
+    imaguick.chunked_uploads.clear()
+    state = patch(client, upload_id, data[10:], 10).get_json()
+    assert state['complete'] and state['files'] == [f'{upload_id}_photo.png']
+    imaguick.chunked_uploads.clear()
+    assert client.get(f'/uploads/{upload_id}').get_json()['complete']
+
+
+def test_stale_record_is_reloaded(imaguick, client):
+    data = png().getvalue()
+    upload_id = start_upload(client, data)
+    client.get(f'/uploads/{upload_id}')
+    stale = dict(imaguick.chunked_uploads[upload_id])
+
+    assert patch(client, upload_id, data[:10], 0).status_code == 200
+    # Another process kept its copy from before that chunk
+    imaguick.chunked_uploads[upload_id] = stale
+    assert client.get(f'/uploads/{upload_id}').get_json()['offset'] == 10
+
+
+def test_aborted_upload_is_gone_everywhere(imaguick, client):
+    data = png().getvalue()
+    upload_id = start_upload(client, data)
+    part = imaguick.chunked_uploads[upload_id]['path']
+    assert client.delete(f'/uploads/{upload_id}').status_code == 204
+    assert not os.path.exists(part)
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+    assert client.get('/uploads/not-an-id').status_code == 404
+
+
+@pytest.mark.parametrize('params, done', [
+    ({'format': 'png', 'use_1080p': True}, 1),
+    # No resize needs the original, which the browser did not send
+    ({'format': 'png'}, 0),
+])
+def test_upload_joins_open_job_after_its_probe(imaguick, client, params, done):
+    r = client.post('/api/v1/jobs', json={'open': True, 'params': params})
+    assert r.status_code == 202
+    job_id = r.get_json()['id']
+    data = png().getvalue()
+    r = client.post('/uploads', json={'filename': 'photo.png', 'size': len(data), 'job_id': job_id,
+                                      'prescaled': {'max_edge': 1080, 'original_size': 10 * len(data)}})
+    upload_id = r.get_json()['id']
+    assert patch(client, upload_id, data, 0).get_json()['complete']
+    # Closed straight away: the job still waits for the upload being probed
+    assert client.post(f'/api/v1/jobs/{job_id}/close').status_code == 200
+
+    job = wait_for_job(client, job_id)
+    assert (job['total'], job['done'], job['errors']) == (1, done, 1 - done)
+    assert imaguick.jobs[job_id]['files'][0]['prescaled'] == 1080
+
+
+def test_repeated_final_chunk_returns_the_stored_result(imaguick, client, monkeypatch):
+    data = png().getvalue()
+    upload_id = start_upload(client, data)
+    release = threading.Event()
+    finish = imaguick.finish_chunked_upload
+
+    def slow_finish(*args):
+        release.wait(5)
+        return finish(*args)
+
+    monkeypatch.setattr(imaguick, 'finish_chunked_upload', slow_finish)
+    first = {}
+    thread = threading.Thread(target=lambda: first.update(r=patch(client, upload_id, data, 0)))
+    thread.start()
+    deadline = time.time() + 5
+    while not imaguick.chunked_uploads[upload_id].get('finishing'):
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    # The client timed out and resends the (empty) rest of the file
+    threading.Timer(0.3, release.set).start()
+    second = patch(client, upload_id, b'', len(data))
+    thread.join()
+    assert first['r'].status_code == second.status_code == 200
+    assert second.get_json()['files'] == first['r'].get_json()['files'] == [f'{upload_id}_photo.png']
+
+
+def claim_finish(imaguick, upload_id, **lease):
+    with imaguick.upload_sessions_lock:
+        record = imaguick.chunked_uploads[upload_id]
+        record['finishing'] = {**imaguick.finish_lease(), **lease}
+        record['updated'] = time.time()
+        imaguick._save_chunked_upload(upload_id, record)
+
+
+def test_finish_claim_of_a_dead_process_is_released(imaguick, client, monkeypatch):
+    monkeypatch.setattr(imaguick, 'UPLOAD_FINISH_WAIT', 0.2)
+    data = png().getvalue()
+    upload_id = start_upload(client, data)
+    assert patch(client, upload_id, data[:10], 0).status_code == 200
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+
+    claim_finish(imaguick, upload_id)
+    # Claimed by this very process: still running
+    r = patch(client, upload_id, data[10:], 10)
+    assert r.status_code == 409 and not r.get_json()['complete']
+
+    for lease in ({'pid': dead.pid}, {'process': 'an earlier process with this pid'},
+                  {'since': time.time() - imaguick.UPLOAD_FINISH_LEASE - 1}):
+        claim_finish(imaguick, upload_id, **lease)
+        assert not client.get(f'/uploads/{upload_id}').get_json()['complete']
+        assert imaguick.chunked_uploads[upload_id]['finishing'] is None
+
+    # The final chunk can be sent again
+    assert patch(client, upload_id, data[10:], 10).get_json()['complete']
+
+
+def test_upload_lost_by_a_dead_finishing_process_is_gone(imaguick, client):
+    data = png().getvalue()
+    upload_id = start_upload(client, data)
+    assert patch(client, upload_id, data[:10], 0).status_code == 200
+    claim_finish(imaguick, upload_id, process='an earlier process with this pid')
+    os.remove(imaguick.chunked_uploads[upload_id]['path'])
+
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
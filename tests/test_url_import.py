@@ -0,0 +1,89 @@
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import pytest
+import requests
+
+
+@pytest.fixture
+def dns(imaguick, monkeypatch):
+    """Fresh URL-import caches, and a resolver answering from the returned dict."""
+    answers = {}
+
+    def getaddrinfo(hostname, *args, **kwargs):
+        if hostname not in answers:
+            raise socket.gaierror(hostname)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (ip, 0)) for ip in answers[hostname]]
+
+    monkeypatch.setattr(imaguick, 'dns_cache', {})
+    monkeypatch.setattr(imaguick, 'host_sessions', {})
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    return answers
+
+
+def test_parse_url_list_reads_lines_and_json_manifests(imaguick):
+    text = '# holiday\nhttps://a.example/1.jpg\n\n  https://a.example/2.jpg \nhttps://a.example/1.jpg\n'
+    assert imaguick.parse_url_list(text) == ['https://a.example/1.jpg', 'https://a.example/2.jpg']
+    manifest = '[{"url": "https://a.example/1.jpg"}, "https://a.example/2.jpg", {"name": "x"}]'
+    assert imaguick.parse_url_list(manifest) == ['https://a.example/1.jpg', 'https://a.example/2.jpg']
+
+
+def test_parse_url_list_rejects_bad_manifests_and_long_lists(imaguick):
+    with pytest.raises(ValueError):
+        imaguick.parse_url_list('[not json')
+    too_many = '\n'.join(f'https://a.example/{i}.jpg' for i in range(imaguick.MAX_URLS_PER_IMPORT + 1))
+    with pytest.raises(ValueError):
+        imaguick.parse_url_list(too_many)
+
+
+@pytest.mark.parametrize('ips', [
+    ['127.0.0.1'], ['10.0.0.5'], ['192.168.1.1'], ['169.254.169.254'], ['0.0.0.0'],
+    # One internal answer is enough: a later connection could be made to it
+    ['93.184.216.34', '172.16.0.1'],
+])
+def test_hosts_resolving_to_internal_addresses_are_refused(imaguick, dns, ips):
+    dns['internal.example'] = ips
+    assert imaguick.resolve_public_ips('internal.example') is None
+    with pytest.raises(ValueError):
+        imaguick.host_session(urlparse('https://internal.example/a.jpg'))
+
+
+def test_session_connects_to_the_validated_ip(imaguick, dns, monkeypatch):
+    dns['images.example'] = ['93.184.216.34']
+    session, slots = imaguick.host_session(urlparse('https://images.example:8443/a.jpg'))
+    assert isinstance(slots, threading.BoundedSemaphore)
+    sent = []
+
+    def send(self, request, **kwargs):
+        sent.append(request)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', send)
+
+    # Rebinding the name to an internal address changes nothing: the pinned IP is used
+    dns['images.example'] = ['127.0.0.1']
+    session.get('https://images.example:8443/a.jpg')
+    assert sent[0].url == 'https://93.184.216.34:8443/a.jpg'
+    assert sent[0].headers['Host'] == 'images.example:8443'
+
+
+def test_expired_dns_answers_and_idle_sessions_are_dropped(imaguick, dns):
+    dns['old.example'] = ['93.184.216.34']
+    dns['new.example'] = ['93.184.216.35']
+    old_session, _ = imaguick.host_session(urlparse('https://old.example/a.jpg'))
+    closed = []
+    old_session.close = lambda: closed.append(True)
+
+    # Everything about old.example is now past DNS_CACHE_TTL
+    past = time.monotonic() - imaguick.DNS_CACHE_TTL - 1
+    key = ('https', 'old.example', None)
+    imaguick.dns_cache['old.example'] = (['93.184.216.34'], past)
+    imaguick.host_sessions[key] = (*imaguick.host_sessions[key][:3], past)
+
+    imaguick.host_session(urlparse('https://new.example/a.jpg'))
+    assert list(imaguick.dns_cache) == ['new.example']
+    assert list(imaguick.host_sessions) == [('https', 'new.example', None)]
+    assert closed == [True]